@@ -126,6 +126,37 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Finished dataset exports, reused until the dataset changes
+EXPORT_CACHE_DIR = BASE_DIR / 'export_cache'
+EXPORT_CACHE_MAX_BYTES = 10 * 1024 ** 3
+
+# Partial files of resumable uploads. Keep this on the same filesystem as
+# MEDIA_ROOT so finished uploads are moved into place by rename.
+UPLOAD_SESSION_DIR = BASE_DIR / 'upload_sessions'
+UPLOAD_SESSION_MAX_BYTES = 50 * 1024 ** 3
+
+# Largest image (in pixels) Pillow will decode
+IMAGE_MAX_PIXELS = 2 * 1024 ** 3
+
+# Tile pyramids for very large images shown in the annotation canvas
+TILE_CACHE_DIR = BASE_DIR / 'tile_cache'
+TILE_CACHE_MAX_BYTES = 20 * 1024 ** 3
+
+# Video frames are decoded with these executables and the most recently
+# viewed ones kept in memory, per process
+FFMPEG_BINARY = 'ffmpeg'
+FFPROBE_BINARY = 'ffprobe'
+VIDEO_FRAME_CACHE_MAX_BYTES = 256 * 1024 ** 2
+
+# Encoded per-image annotation lists are kept in the default cache (per
+# process unless CACHES points at a shared backend), keyed by revision
+ANNOTATION_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Saved annotation changes are pushed to open editors through this broker.
+# LocalBroker only reaches clients of the same server process; with several
+# processes use 'labeling.events.RedisBroker' and ANNOTATION_EVENTS_REDIS_URL
+ANNOTATION_EVENTS_BROKER = 'labeling.events.LocalBroker'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
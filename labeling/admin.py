@@ -1,21 +1,64 @@
 from django.contrib import admin
+from django.db import transaction
 #from django.utils.html import format_html
-from .models import Project, LabelCategory, Dataset, Image, Video, Annotation, AnnotationSession
+from .counters import recount_datasets, recount_images, recount_labels, recount_projects
+from .models import (
+    Project, LabelCategory, Dataset, Image, Video, Annotation, AnnotationSession, Task, Track, UploadSession,
+    bury_annotations
+)
 #from .widgets import ColorPickerWidget
 
 
+class DatasetRevisionMixin:
+    """
+    Bulk deletes skip Model.delete, so recount the affected rows, advance
+    dataset revisions and leave tombstones for the deleted annotations here.
+    """
+    dataset_paths = []
+    image_paths = []
+    label_paths = []
+    # Lookup from Annotation to the model being deleted, when deleting it deletes annotations
+    annotation_path = None
+
+    def _affected(self, queryset, paths):
+        ids = set()
+        for path in paths:
+            ids.update(queryset.exclude(**{path: None}).values_list(path, flat=True))
+        return ids
+
+    def delete_queryset(self, request, queryset):
+        dataset_ids = self._affected(queryset, self.dataset_paths)
+        image_ids = self._affected(queryset, self.image_paths)
+        label_ids = self._affected(queryset, self.label_paths)
+        deleted = []
+        if self.annotation_path:
+            deleted = list(
+                Annotation.objects.filter(**{f'{self.annotation_path}__in': queryset}).values_list('id', 'dataset_id')
+            )
+            dataset_ids.update(dataset_id for _, dataset_id in deleted if dataset_id)
+        with transaction.atomic():
+            super().delete_queryset(request, queryset)
+            recount_images(Image.objects.filter(pk__in=image_ids))
+            recount_labels(LabelCategory.objects.filter(pk__in=label_ids))
+            recount_datasets(Dataset.objects.filter(pk__in=dataset_ids))
+            bury_annotations(deleted)
+
+
 @admin.register(Project)
 class ProjectAdmin(admin.ModelAdmin):
-    list_display = ['name', 'owner', 'created_at', 'updated_at']
+    list_display = ['name', 'owner', 'dataset_count', 'created_at', 'updated_at']
     list_filter = ['created_at', 'owner']
     search_fields = ['name', 'description']
     readonly_fields = ['created_at', 'updated_at']
 
 
 @admin.register(LabelCategory)
-class LabelCategoryAdmin(admin.ModelAdmin):
+class LabelCategoryAdmin(DatasetRevisionMixin, admin.ModelAdmin):
+    dataset_paths = ['project__datasets']
+    image_paths = ['annotations__image']
+    annotation_path = 'label_category'
 #    list_display = ['name', 'project', 'annotation_type', 'color_preview', 'created_at']
-    list_display = ['name', 'project', 'annotation_type', 'color', 'created_at']
+    list_display = ['name', 'project', 'annotation_type', 'color', 'annotation_count', 'created_at']
     list_filter = ['annotation_type', 'project', 'created_at']
     search_fields = ['name', 'project__name']
     
@@ -44,38 +87,79 @@ class LabelCategoryAdmin(admin.ModelAdmin):
 
 @admin.register(Dataset)
 class DatasetAdmin(admin.ModelAdmin):
-    list_display = ['name', 'project', 'dataset_type', 'created_at']
+    list_display = ['name', 'project', 'dataset_type', 'image_count', 'annotated_count', 'created_at']
     list_filter = ['dataset_type', 'created_at', 'project']
     search_fields = ['name', 'description', 'project__name']
     readonly_fields = ['created_at', 'updated_at']
 
+    def delete_queryset(self, request, queryset):
+        project_ids = set(queryset.values_list('project', flat=True))
+        super().delete_queryset(request, queryset)
+        recount_projects(Project.objects.filter(pk__in=project_ids))
+        recount_labels(LabelCategory.objects.filter(project_id__in=project_ids))
+
 
 @admin.register(Image)
-class ImageAdmin(admin.ModelAdmin):
-    list_display = ['filename', 'dataset', 'width', 'height', 'size', 'is_annotated', 'uploaded_at']
+class ImageAdmin(DatasetRevisionMixin, admin.ModelAdmin):
+    dataset_paths = ['dataset']
+    label_paths = ['annotations__label_category']
+    annotation_path = 'image'
+    list_display = ['filename', 'dataset', 'width', 'height', 'size', 'is_annotated', 'annotation_count', 'uploaded_at']
     list_filter = ['is_annotated', 'uploaded_at', 'dataset']
-    search_fields = ['filename', 'dataset__name']
-    readonly_fields = ['filename', 'width', 'height', 'size', 'uploaded_at']
+    search_fields = ['filename', 'dataset__name', 'content_hash']
+    readonly_fields = ['filename', 'width', 'height', 'size', 'uploaded_at', 'content_hash', 'perceptual_hash']
 
 
 @admin.register(Video)
-class VideoAdmin(admin.ModelAdmin):
-    list_display = ['filename', 'dataset', 'duration', 'fps', 'width', 'height', 'uploaded_at']
+class VideoAdmin(DatasetRevisionMixin, admin.ModelAdmin):
+    label_paths = ['annotations__label_category']
+    annotation_path = 'video'
+    list_display = ['filename', 'dataset', 'duration', 'fps', 'frame_count', 'width', 'height', 'uploaded_at']
     list_filter = ['uploaded_at', 'dataset']
     search_fields = ['filename', 'dataset__name']
-    readonly_fields = ['filename', 'duration', 'fps', 'width', 'height', 'size', 'uploaded_at']
+    readonly_fields = ['filename', 'duration', 'fps', 'frame_count', 'width', 'height', 'size', 'uploaded_at']
 
 
 @admin.register(Annotation)
-class AnnotationAdmin(admin.ModelAdmin):
+class AnnotationAdmin(DatasetRevisionMixin, admin.ModelAdmin):
+    dataset_paths = ['image__dataset', 'video__dataset']
+    image_paths = ['image']
+    label_paths = ['label_category']
+    annotation_path = 'pk'
     list_display = ['__str__', 'label_category', 'annotation_type', 'annotator', 'created_at']
     list_filter = ['annotation_type', 'label_category', 'annotator', 'created_at']
     search_fields = ['label_category__name', 'annotator__username']
     readonly_fields = ['created_at', 'updated_at']
 
 
+@admin.register(Track)
+class TrackAdmin(DatasetRevisionMixin, admin.ModelAdmin):
+    dataset_paths = ['video__dataset']
+    list_display = ['__str__', 'video', 'label_category', 'start_frame', 'end_frame', 'annotator', 'updated_at']
+    list_filter = ['label_category', 'annotator', 'created_at']
+    search_fields = ['video__filename', 'label_category__name', 'annotator__username']
+    readonly_fields = ['start_frame', 'end_frame', 'created_at', 'updated_at']
+
+
 @admin.register(AnnotationSession)
 class AnnotationSessionAdmin(admin.ModelAdmin):
     list_display = ['annotator', 'dataset', 'start_time', 'end_time', 'annotations_count']
     list_filter = ['start_time', 'annotator', 'dataset']
     search_fields = ['annotator__username', 'dataset__name']
+
+
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ['kind', 'status', 'progress', 'owner', 'worker', 'created_at', 'finished_at']
+    list_filter = ['status', 'kind', 'created_at']
+    search_fields = ['kind', 'owner__username', 'worker']
+    readonly_fields = ['created_at', 'started_at', 'finished_at']
+
+
+@admin.register(UploadSession)
+class UploadSessionAdmin(admin.ModelAdmin):
+    list_display = ['filename', 'kind', 'dataset', 'owner', 'size', 'status', 'created_at']
+    list_filter = ['status', 'kind', 'created_at']
+    search_fields = ['filename', 'owner__username']
+    readonly_fields = ['created_at', 'updated_at']
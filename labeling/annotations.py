@@ -0,0 +1,208 @@
+"""
+Batched annotation writes.
+
+The annotation canvas sends every create, update and delete of a save as
+one list. ``apply_annotation_batch`` validates the whole list against
+preloaded images, annotations and labels, then applies it in a single
+transaction with a fixed number of queries however many boxes it holds.
+Once it commits, the operations are published to open editors.
+"""
+import math
+from collections import Counter, defaultdict
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .events import annotation_operation, publish_annotations
+from .geometry import InvalidGeometry, pack_geometry
+from .models import (
+    Annotation, Image, LabelCategory, bury_annotations, stamp_annotations, touch_datasets, touch_images,
+    update_annotation_counters
+)
+
+
+ANNOTATION_TYPES = {choice for choice, _ in Annotation.ANNOTATION_TYPES}
+NUMERIC_FIELDS = ('x', 'y', 'width', 'height', 'confidence')
+MAX_OPERATIONS = 5000
+BULK_BATCH_SIZE = 500
+
+
+class AnnotationBatchError(ValueError):
+    def __init__(self, message, index=None):
+        super().__init__(message)
+        self.index = index
+
+
+def _fields(operation, index):
+    """Validated geometry and metadata present in ``operation``."""
+    fields = {}
+    for field in NUMERIC_FIELDS:
+        if field in operation:
+            value = operation[field]
+            if value is not None and (
+                isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value)
+            ):
+                raise AnnotationBatchError(f'{field} must be a number', index)
+            fields[field] = value
+    if 'points' in operation:
+        try:
+            fields['geometry'] = pack_geometry(operation['points'])
+        except InvalidGeometry as e:
+            raise AnnotationBatchError(str(e), index)
+    if 'notes' in operation:
+        fields['notes'] = str(operation['notes'] or '')
+    return fields
+
+
+def _preload(operations, user):
+    image_ids = set()
+    annotation_ids = set()
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict) or operation.get('op') not in ('create', 'update', 'delete'):
+            raise AnnotationBatchError('op must be "create", "update" or "delete"', index)
+        key = 'image_id' if operation['op'] == 'create' else 'id'
+        if not operation.get(key):
+            raise AnnotationBatchError(f'{key} is required', index)
+        (image_ids if operation['op'] == 'create' else annotation_ids).add(str(operation[key]))
+
+    try:
+        images = {
+            str(row['id']): row for row in Image.objects.filter(
+                pk__in=image_ids, dataset__project__owner=user
+            ).values('id', 'dataset_id', project_id=F('dataset__project_id'))
+        }
+        annotations = {
+            str(annotation.pk): annotation for annotation in Annotation.objects.filter(
+                pk__in=annotation_ids, image__dataset__project__owner=user
+            ).annotate(
+                image_dataset_id=F('image__dataset_id'),
+                image_project_id=F('image__dataset__project_id'),
+            )
+        }
+    except ValidationError:
+        raise AnnotationBatchError('Invalid id')
+
+    projects = {row['project_id'] for row in images.values()}
+    projects.update(annotation.image_project_id for annotation in annotations.values())
+    labels = {
+        str(label_id): project_id for label_id, project_id in
+        LabelCategory.objects.filter(project_id__in=projects).values_list('id', 'project_id')
+    }
+    return images, annotations, labels
+
+
+def apply_annotation_batch(operations, user):
+    """
+    Apply ``operations`` to images owned by ``user`` in one transaction.
+
+    Each operation is a dict with ``op`` set to ``create`` (``image_id``,
+    ``label_id``, ``type`` and geometry), ``update`` (``id`` plus the
+    fields to change, optionally ``label_id``) or ``delete`` (``id``).
+    Returns one ``{'op', 'id'}`` result per operation, in order. Raises
+    ``AnnotationBatchError`` naming the first invalid operation, in which
+    case nothing is written.
+    """
+    if not isinstance(operations, list):
+        raise AnnotationBatchError('operations must be a list')
+    if len(operations) > MAX_OPERATIONS:
+        raise AnnotationBatchError(f'At most {MAX_OPERATIONS} operations per batch')
+
+    images, annotations, labels = _preload(operations, user)
+
+    created = []
+    updated = {}
+    update_fields = set()
+    changed_fields = defaultdict(set)
+    deleted = {}
+    results = []
+    for index, operation in enumerate(operations):
+        op = operation['op']
+        if op == 'create':
+            image = images.get(str(operation['image_id']))
+            if image is None:
+                raise AnnotationBatchError('Image not found', index)
+            if labels.get(str(operation.get('label_id'))) != image['project_id']:
+                raise AnnotationBatchError('Label not found in this project', index)
+            if operation.get('type') not in ANNOTATION_TYPES:
+                raise AnnotationBatchError('Unknown annotation type', index)
+            annotation = Annotation(
+                image_id=image['id'],
+                dataset_id=image['dataset_id'],
+                label_category_id=operation['label_id'],
+                annotation_type=operation['type'],
+                annotator=user,
+                **_fields(operation, index)
+            )
+            annotation.image_dataset_id = image['dataset_id']
+            created.append(annotation)
+        else:
+            annotation = annotations.get(str(operation['id']))
+            if annotation is None or annotation.pk in deleted:
+                raise AnnotationBatchError('Annotation not found', index)
+            if op == 'delete':
+                deleted[annotation.pk] = annotation
+                updated.pop(annotation.pk, None)
+            else:
+                fields = _fields(operation, index)
+                if 'label_id' in operation:
+                    if labels.get(str(operation['label_id'])) != annotation.image_project_id:
+                        raise AnnotationBatchError('Label not found in this project', index)
+                    fields['label_category_id'] = operation['label_id']
+                for field, value in fields.items():
+                    setattr(annotation, field, value)
+                update_fields.update(fields)
+                changed_fields[annotation.pk].update(fields)
+                updated[annotation.pk] = annotation
+        results.append({'op': op, 'id': str(annotation.pk)})
+
+    # Creates and deletes change image counts; label changes move label counts
+    image_deltas = Counter(annotation.image_id for annotation in created)
+    image_deltas.subtract(annotation.image_id for annotation in deleted.values())
+    label_deltas = Counter(annotation.label_category_id for annotation in created)
+    label_deltas.subtract(annotation._loaded_label_category_id for annotation in deleted.values())
+    for annotation in updated.values():
+        label_deltas[annotation.label_category_id] += 1
+        label_deltas[annotation._loaded_label_category_id] -= 1
+    # Every image and dataset touched needs a new revision, including those whose counters net out
+    changed = [*created, *updated.values(), *deleted.values()]
+    images = {annotation.image_id for annotation in changed}
+    datasets = {annotation.image_dataset_id for annotation in changed}
+
+    with transaction.atomic():
+        if created:
+            Annotation.objects.bulk_create(created, batch_size=BULK_BATCH_SIZE)
+        if updated and update_fields:
+            now = timezone.now()
+            for annotation in updated.values():
+                annotation.updated_at = now
+            update_fields = sorted(update_fields)
+            Annotation.objects.bulk_update(
+                list(updated.values()), update_fields + ['updated_at'], batch_size=BULK_BATCH_SIZE
+            )
+        if deleted:
+            Annotation.objects.filter(pk__in=list(deleted)).delete()
+        # The bulk paths skip Annotation.save/delete, so maintain counters and revisions here
+        update_annotation_counters(image_deltas, label_deltas)
+        if images:
+            touch_images(pk__in=images)
+        if datasets:
+            touch_datasets(pk__in=datasets)
+        # After the revisions advance, so changes are stamped with the new ones
+        if created or updated:
+            stamp_annotations(pk__in=[annotation.pk for annotation in created] + list(updated))
+        if deleted:
+            bury_annotations((pk, annotation.image_dataset_id) for pk, annotation in deleted.items())
+        publish_annotations(
+            [(annotation.image_dataset_id, annotation_operation('create', annotation)) for annotation in created]
+            + [
+                (annotation.image_dataset_id, annotation_operation('update', annotation, changed_fields[pk]))
+                for pk, annotation in updated.items()
+            ]
+            + [
+                (annotation.image_dataset_id, annotation_operation('delete', annotation))
+                for annotation in deleted.values()
+            ]
+        )
+    return results
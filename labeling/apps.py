@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class LabelingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'labeling'
+
+    def ready(self):
+        from django.conf import settings
+        from PIL import Image as PILImage
+
+        # Aerial and satellite originals routinely exceed Pillow's
+        # decompression bomb limit; allow them up to the configured size.
+        PILImage.MAX_IMAGE_PIXELS = getattr(settings, 'IMAGE_MAX_PIXELS', PILImage.MAX_IMAGE_PIXELS)
@@ -0,0 +1,64 @@
+"""
+Recomputing the denormalized counters from scratch.
+
+Image, dataset, label and project counters are kept up to date by the
+models and the bulk write paths (see ``update_annotation_counters``).
+These helpers rebuild them from the underlying rows with one UPDATE per
+table, for bulk admin deletes and ``manage.py recount``.
+"""
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Annotation, Dataset, Image, LabelCategory, Project
+
+
+def _count(queryset, field, distinct=False):
+    """Correlated subquery counting the rows of ``queryset`` grouped by ``field``."""
+    return Coalesce(
+        Subquery(
+            queryset.order_by().values(field).annotate(n=Count('pk', distinct=distinct)).values('n'),
+            output_field=IntegerField(),
+        ),
+        Value(0),
+    )
+
+
+def recount_images(images=None):
+    """
+    Recompute ``annotation_count`` and ``is_annotated`` for ``images`` and
+    advance their annotation revisions; returns rows updated.
+    """
+    images = Image.objects.all() if images is None else images
+    annotations = Annotation.objects.filter(image_id=OuterRef('pk'))
+    count = images.update(
+        annotation_count=_count(annotations, 'image_id'),
+        annotation_revision=F('annotation_revision') + 1,
+    )
+    images.update(is_annotated=Q(annotation_count__gt=0))
+    return count
+
+
+def recount_datasets(datasets=None):
+    """Recompute the image and annotation counters of ``datasets`` and advance their revisions."""
+    datasets = Dataset.objects.all() if datasets is None else datasets
+    images = Image.objects.filter(dataset_id=OuterRef('pk'))
+    return datasets.update(
+        image_count=_count(images, 'dataset_id'),
+        annotated_count=_count(images.filter(annotations__isnull=False), 'dataset_id', distinct=True),
+        annotation_count=_count(Annotation.objects.filter(image__dataset_id=OuterRef('pk')), 'image__dataset_id'),
+        revision=F('revision') + 1,
+    )
+
+
+def recount_labels(labels=None):
+    """Recompute ``annotation_count`` for ``labels``."""
+    labels = LabelCategory.objects.all() if labels is None else labels
+    annotations = Annotation.objects.filter(label_category_id=OuterRef('pk'))
+    return labels.update(annotation_count=_count(annotations, 'label_category_id'))
+
+
+def recount_projects(projects=None):
+    """Recompute ``dataset_count`` for ``projects``."""
+    projects = Project.objects.all() if projects is None else projects
+    datasets = Dataset.objects.filter(project_id=OuterRef('pk'))
+    return projects.update(dataset_count=_count(datasets, 'project_id'))
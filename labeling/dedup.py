@@ -0,0 +1,253 @@
+"""
+Exact and near-duplicate detection for images.
+
+Every image carries the SHA-256 of its file, which catches byte-identical
+re-uploads at ingest, and a 64-bit difference hash (dHash) of its pixels,
+which survives re-encoding, resizing and small edits. Near duplicates are
+images whose dHashes differ in only a few bits; they are found with a
+multi-index hash table over the hashes of a dataset or project, built
+once per process and extended with the images uploaded since.
+"""
+import hashlib
+import multiprocessing
+import threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import django
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from django.db.models import Count, Max
+from PIL import Image as PILImage
+
+from .derivatives import to_display_mode
+from .models import Image
+
+
+HASH_READ_SIZE = 1024 * 1024
+HASH_BITS = 64
+HASH_MASK = (1 << HASH_BITS) - 1
+BANDS = 4
+BAND_BITS = HASH_BITS // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+# Indexes kept in memory per process; each holds one dataset or project
+INDEX_CACHE_SIZE = 8
+
+
+def content_hash(file):
+    """Hex SHA-256 of a file object, read in chunks from the start."""
+    digest = hashlib.sha256()
+    if hasattr(file, 'chunks'):
+        for chunk in file.chunks(HASH_READ_SIZE):
+            digest.update(chunk)
+    else:
+        file.seek(0)
+        for chunk in iter(lambda: file.read(HASH_READ_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def perceptual_hash(img):
+    """
+    64-bit difference hash of a PIL image, as a signed integer for ``BigIntegerField``.
+
+    The image is shrunk to 9x8 grey pixels and each bit records whether a
+    pixel is brighter than its right-hand neighbour.
+    """
+    # JPEG can decode straight to a small scale instead of full resolution
+    img.draft('L', (64, 64))
+    pixels = list(to_display_mode(img).convert('L').resize((9, 8), PILImage.Resampling.BOX).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def existing_hashes(dataset, hashes):
+    """Map each of ``hashes`` already present in ``dataset`` to that image's filename."""
+    return dict(
+        Image.objects.filter(dataset=dataset, content_hash__in=set(hashes))
+        .order_by()
+        .values_list('content_hash', 'filename')
+    )
+
+
+def drop_duplicates(dataset, entries):
+    """
+    Filter ``(name, content hash, payload)`` entries down to new content.
+
+    Returns ``(payloads, errors)``: the payloads of entries whose hash is
+    neither in ``dataset`` nor earlier in ``entries``, and ``(name, message)``
+    pairs for the rest.
+    """
+    known = existing_hashes(dataset, [digest for _, digest, _ in entries])
+    payloads = []
+    errors = []
+    for name, digest, payload in entries:
+        if digest in known:
+            errors.append((name, f'duplicate of {known[digest]}'))
+            continue
+        known[digest] = name
+        payloads.append(payload)
+    return payloads, errors
+
+
+@lru_cache(maxsize=None)
+def _band_flips(max_bits):
+    """Every ``BAND_BITS``-bit mask with at most ``max_bits`` bits set, fewest first."""
+    return sorted((mask for mask in range(1 << BAND_BITS) if mask.bit_count() <= max_bits), key=int.bit_count)
+
+
+class HashIndex:
+    """
+    Multi-index hash table over 64-bit hashes under Hamming distance.
+
+    Each hash is split into four 16-bit bands with a table per band. Two
+    hashes within ``r`` bits of each other agree to within ``r // 4`` bits
+    on at least one band, so a search only probes each table for the band
+    values that close to the query's and verifies the candidates it finds,
+    instead of comparing against every hash.
+    """
+
+    def __init__(self, entries=()):
+        self.hashes = array('Q')
+        self.items = []
+        self.tables = [{} for _ in range(BANDS)]
+        for value, item in entries:
+            self.add(value, item)
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, value, item):
+        value &= HASH_MASK
+        position = len(self.items)
+        self.hashes.append(value)
+        self.items.append(item)
+        for band, table in enumerate(self.tables):
+            key = (value >> (band * BAND_BITS)) & BAND_MASK
+            bucket = table.get(key)
+            if bucket is None:
+                bucket = table[key] = array('I')
+            bucket.append(position)
+
+    def search(self, value, radius):
+        """Return ``(item, distance)`` for every entry within ``radius`` bits of ``value``."""
+        value &= HASH_MASK
+        flips = _band_flips(min(radius // BANDS, BAND_BITS))
+        seen = set()
+        results = []
+        for band, table in enumerate(self.tables):
+            key = (value >> (band * BAND_BITS)) & BAND_MASK
+            for flip in flips:
+                bucket = table.get(key ^ flip)
+                if bucket is None:
+                    continue
+                for position in bucket:
+                    if position in seen:
+                        continue
+                    seen.add(position)
+                    distance = (self.hashes[position] ^ value).bit_count()
+                    if distance <= radius:
+                        results.append((self.items[position], distance))
+        return results
+
+
+_index_cache = OrderedDict()
+_index_lock = threading.Lock()
+
+
+def hash_index(**scope):
+    """
+    ``HashIndex`` of image ids for the images matching ``scope`` (e.g. ``dataset_id=...``).
+
+    Indexes are cached per process. Images uploaded since an index was
+    built are added to it as they are found; it is only rebuilt from
+    scratch when images were removed or hashed after their upload, which
+    leaves the image count off from what was added.
+    """
+    images = Image.objects.filter(perceptual_hash__isnull=False, **scope).order_by()
+    state = images.aggregate(count=Count('id'), newest=Max('uploaded_at'))
+    key = tuple(sorted((name, str(value)) for name, value in scope.items()))
+
+    with _index_lock:
+        cached = _index_cache.get(key)
+        if cached:
+            _index_cache.move_to_end(key)
+    if cached:
+        newest, index = cached
+        if (newest, len(index)) == (state['newest'], state['count']):
+            return index
+        if newest is not None and len(index) < state['count']:
+            added = list(images.filter(uploaded_at__gt=newest).values_list('perceptual_hash', 'id'))
+            if len(index) + len(added) == state['count']:
+                with _index_lock:
+                    # Unless another thread got here first
+                    if _index_cache.get(key) is cached:
+                        for value, item in added:
+                            index.add(value, item)
+                        _index_cache[key] = (state['newest'], index)
+                        return index
+
+    index = HashIndex(images.values_list('perceptual_hash', 'id').iterator(chunk_size=10000))
+    with _index_lock:
+        _index_cache[key] = (state['newest'], index)
+        _index_cache.move_to_end(key)
+        while len(_index_cache) > INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    return index
+
+
+def near_duplicates(image, radius=8, **scope):
+    """Return ``(image id, distance)`` pairs within ``radius`` bits of ``image``, nearest first."""
+    if image.perceptual_hash is None:
+        return []
+    matches = hash_index(**scope).search(image.perceptual_hash, radius)
+    return sorted(
+        ((image_id, distance) for image_id, distance in matches if image_id != image.pk),
+        key=lambda match: match[1],
+    )
+
+
+def hash_images(image_ids):
+    """Fill in missing hashes for ``image_ids``; returns (hashed, failed) counts."""
+    hashed = failed = 0
+    updated = []
+    for image in Image.objects.filter(pk__in=image_ids).only('id', 'file'):
+        try:
+            with default_storage.open(image.file.name, 'rb') as f:
+                image.content_hash = content_hash(f)
+                f.seek(0)
+                with PILImage.open(f) as img:
+                    image.perceptual_hash = perceptual_hash(img)
+        except (OSError, ValueError, PILImage.DecompressionBombError):
+            failed += 1
+            continue
+        updated.append(image)
+        hashed += 1
+    Image.objects.bulk_update(updated, ['content_hash', 'perceptual_hash'])
+    return hashed, failed
+
+
+def _hash_images_chunk(image_ids):
+    close_old_connections()
+    try:
+        return hash_images(image_ids)
+    finally:
+        close_old_connections()
+
+
+def hash_images_parallel(image_ids, processes=None, chunk_size=200):
+    """Hash many images across a process pool, yielding ``(hashed, failed)`` per chunk."""
+    image_ids = [str(image_id) for image_id in image_ids]
+    chunks = [image_ids[i:i + chunk_size] for i in range(0, len(image_ids), chunk_size)]
+    with ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=django.setup,
+    ) as pool:
+        for result in pool.map(_hash_images_chunk, chunks):
+            yield result
@@ -0,0 +1,165 @@
+"""
+Downscaled derivatives (thumbnails and annotation previews) of ``Image`` files.
+
+Derivatives live next to the originals in storage under ``derivatives/``,
+named by a digest of the source file identity and the derivative spec, so
+a replaced original or a changed spec never serves a stale file. They are
+built on ingest by the task queue and lazily by ``ImageDerivativeView``
+for anything that is still missing.
+"""
+import hashlib
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from PIL import Image as PILImage, features
+
+from .models import Image
+
+
+DERIVATIVE_FORMAT = 'WEBP' if features.check('webp') else 'JPEG'
+DERIVATIVE_EXTENSION = '.webp' if DERIVATIVE_FORMAT == 'WEBP' else '.jpg'
+DERIVATIVE_CONTENT_TYPE = 'image/webp' if DERIVATIVE_FORMAT == 'WEBP' else 'image/jpeg'
+
+# name -> (longest edge in pixels, encoder quality)
+DERIVATIVE_SPECS = {
+    'thumb': (320, 80),
+    'preview': (1600, 85),
+}
+
+# Bump to invalidate every derivative after changing how they are rendered
+DERIVATIVE_VERSION = 1
+
+
+def derivative_name(image, spec):
+    """Storage name of the ``spec`` derivative for ``image`` (model instance or values() dict)."""
+    if isinstance(image, dict):
+        dataset_id, file_name, size = image['dataset_id'], image['file'], image['size']
+    else:
+        dataset_id, file_name, size = image.dataset_id, image.file.name, image.size
+    max_edge, quality = DERIVATIVE_SPECS[spec]
+    digest = hashlib.sha256(
+        f'{file_name}:{size}:{max_edge}:{quality}:{DERIVATIVE_FORMAT}:{DERIVATIVE_VERSION}'.encode('utf-8')
+    ).hexdigest()[:32]
+    return os.path.join('derivatives', str(dataset_id), digest[:2], f'{digest}_{spec}{DERIVATIVE_EXTENSION}')
+
+
+def tone_map(img, low=0.005, high=0.995):
+    """
+    Stretch a 16/32-bit greyscale image onto 8 bits between two percentiles.
+
+    Sensor data rarely uses the full range, so a plain shift by 8 bits
+    would render most TIFFs nearly black.
+    """
+    img = img.convert('I')
+    minimum, maximum = img.getextrema()
+    if maximum <= minimum:
+        return img.convert('L')
+
+    histogram = img.histogram(extrema=(minimum, maximum))
+    total = sum(histogram)
+    bins = len(histogram)
+    black_bin, white_bin = 0, bins - 1
+    running = 0
+    for idx, count in enumerate(histogram):
+        running += count
+        if running <= total * low:
+            black_bin = idx + 1
+        if running >= total * high:
+            white_bin = idx
+            break
+
+    step = (maximum - minimum) / bins
+    black = minimum + black_bin * step
+    white = max(minimum + (white_bin + 1) * step, black + 1)
+    scale = 255 / (white - black)
+    # convert('L') clamps the stretched values into 0..255
+    return img.point(lambda value: value * scale - black * scale).convert('L')
+
+
+def to_display_mode(img):
+    """Convert ``img`` to a mode the derivative encoder accepts."""
+    if img.mode in ('I;16', 'I;16B', 'I;16L', 'I'):
+        img = tone_map(img)
+    if img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info):
+        return img.convert('RGBA') if DERIVATIVE_FORMAT == 'WEBP' else img.convert('RGB')
+    if img.mode not in ('RGB', 'L'):
+        return img.convert('RGB')
+    return img
+
+
+def render_derivative(source, spec):
+    """Encode the ``spec`` derivative of the image file object ``source``; returns bytes."""
+    max_edge, quality = DERIVATIVE_SPECS[spec]
+    with PILImage.open(source) as img:
+        # Let JPEG decode at a reduced DCT scale instead of full resolution
+        img.draft('RGB', (max_edge, max_edge))
+        img = to_display_mode(img)
+        img.thumbnail((max_edge, max_edge), PILImage.Resampling.LANCZOS)
+        output = io.BytesIO()
+        img.save(output, DERIVATIVE_FORMAT, quality=quality)
+    return output.getvalue()
+
+
+def ensure_derivative(image, spec):
+    """Return the storage name of the ``spec`` derivative, rendering it if missing."""
+    name = derivative_name(image, spec)
+    if default_storage.exists(name):
+        return name
+
+    file_name = image['file'] if isinstance(image, dict) else image.file.name
+    with default_storage.open(file_name, 'rb') as source:
+        data = render_derivative(source, spec)
+
+    saved = default_storage.save(name, ContentFile(data))
+    if saved != name:
+        # A concurrent request rendered the same derivative first
+        default_storage.delete(saved)
+    return name
+
+
+def ensure_derivatives(image_ids, specs=None):
+    """Render missing derivatives for ``image_ids``; returns (built, failed) counts."""
+    specs = specs or list(DERIVATIVE_SPECS)
+    built = failed = 0
+    rows = Image.objects.filter(pk__in=image_ids).values('id', 'dataset_id', 'file', 'size')
+    for row in rows:
+        try:
+            for spec in specs:
+                ensure_derivative(row, spec)
+            built += 1
+        except (OSError, ValueError, PILImage.DecompressionBombError):
+            failed += 1
+    return built, failed
+
+
+def _ensure_derivatives_chunk(image_ids):
+    close_old_connections()
+    try:
+        return ensure_derivatives(image_ids)
+    finally:
+        close_old_connections()
+
+
+def build_derivatives_parallel(image_ids, processes=None, chunk_size=50):
+    """
+    Render derivatives for many images across a process pool.
+
+    Yields ``(built, failed)`` per finished chunk so callers can report
+    progress. Must be called from a context where Django is configured;
+    children are spawned and set Django up themselves.
+    """
+    image_ids = [str(image_id) for image_id in image_ids]
+    chunks = [image_ids[i:i + chunk_size] for i in range(0, len(image_ids), chunk_size)]
+    with ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=django.setup,
+    ) as pool:
+        for result in pool.map(_ensure_derivatives_chunk, chunks):
+            yield result
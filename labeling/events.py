@@ -0,0 +1,232 @@
+"""
+Annotation changes pushed to the editors that have an image or dataset open.
+
+Every committed create, update and delete made through the batch or the
+annotation API is published on the channel of its image and on the channel
+of its dataset, as an operation in the batch API's own vocabulary:
+``{"op": "create", "id", "image_id", ...}`` with every field, ``update``
+with only the fields that changed, and ``delete`` with just the ids. All
+operations of one save that fall on one channel go out as a single message,
+a JSON list of them.
+
+``AnnotationEventsView`` streams a channel to the browser as Server-Sent
+Events. Messages reach it through the broker named by
+``ANNOTATION_EVENTS_BROKER``: ``LocalBroker``, the default, delivers to
+subscribers in the same server process; ``RedisBroker`` relays through Redis
+pub/sub so that subscribers in every process get every message.
+
+Messages are not stored. A subscriber that falls ``MAX_PENDING`` messages
+behind gets ``RESYNC`` in their place, and so does everyone when the Redis
+connection drops; clients then reload, or catch up through
+``/api/annotations/changes/``.
+"""
+import asyncio
+import functools
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from .geometry import unpack_geometry
+from .serializers import dumps
+
+try:
+    import redis
+    import redis.asyncio
+except ImportError:
+    redis = None
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BROKER = 'labeling.events.LocalBroker'
+MAX_PENDING = 1000
+RESYNC = object()
+# Model fields of an annotation and their names in the API
+FIELD_NAMES = {
+    'label_category_id': 'label_id',
+    'annotation_type': 'type',
+    'x': 'x',
+    'y': 'y',
+    'width': 'width',
+    'height': 'height',
+    'geometry': 'points',
+    'confidence': 'confidence',
+    'notes': 'notes',
+}
+
+
+def channel_name(kind, pk):
+    return f'{kind}:{pk}'
+
+
+def annotation_operation(op, annotation, fields=FIELD_NAMES):
+    """``annotation`` as a batch API operation, with only the model ``fields`` listed."""
+    operation = {'op': op, 'id': annotation.pk, 'image_id': annotation.image_id}
+    if op != 'delete':
+        for field, name in FIELD_NAMES.items():
+            if field in fields:
+                value = getattr(annotation, field)
+                operation[name] = unpack_geometry(value) if field == 'geometry' else value
+    return operation
+
+
+def publish_annotations(operations):
+    """
+    Publish ``(dataset_id, operation)`` pairs once the current transaction
+    commits, grouped into one message per image and per dataset.
+    """
+    channels = defaultdict(list)
+    for dataset_id, operation in operations:
+        if dataset_id:
+            channels[channel_name('dataset', dataset_id)].append(operation)
+        if operation['image_id']:
+            channels[channel_name('image', operation['image_id'])].append(operation)
+    if channels:
+        # A broker that is down must not turn a committed save into an error
+        transaction.on_commit(
+            lambda: get_broker().publish([(channel, dumps(message)) for channel, message in channels.items()]),
+            robust=True,
+        )
+
+
+class Subscription:
+    """
+    Messages published on one channel while the subscription is open, in
+    order. Open it with ``async with`` on the event loop that reads it.
+    """
+
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.loop = None
+        self.queue = None
+
+    async def __aenter__(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        self.broker.add(self)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.broker.discard(self)
+
+    async def get(self, timeout=None):
+        """The next message, bytes or ``RESYNC``; raises ``asyncio.TimeoutError`` after ``timeout`` seconds."""
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def send(self, message):
+        """Queue ``message`` from any thread."""
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            # The loop has closed; the subscription is about to be discarded
+            pass
+
+    def _put(self, message):
+        if self.queue.qsize() >= MAX_PENDING:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            message = RESYNC
+        self.queue.put_nowait(message)
+
+
+class LocalBroker:
+    """Delivers messages to the subscribers in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def subscribe(self, channel):
+        return Subscription(self, channel)
+
+    def add(self, subscription):
+        with self._lock:
+            self._subscriptions[subscription.channel].add(subscription)
+
+    def discard(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.channel]
+
+    def publish(self, messages):
+        """Send each ``(channel, message)`` of ``messages``; callable from any thread."""
+        self.deliver(messages)
+
+    def deliver(self, messages):
+        for channel, message in messages:
+            with self._lock:
+                subscriptions = list(self._subscriptions.get(channel, ()))
+            for subscription in subscriptions:
+                subscription.send(message)
+
+    def resync(self):
+        """Tell every subscriber that messages were lost."""
+        with self._lock:
+            subscriptions = [subscription for group in self._subscriptions.values() for subscription in group]
+        for subscription in subscriptions:
+            subscription.send(RESYNC)
+
+
+class RedisBroker(LocalBroker):
+    """
+    Relays messages through one Redis pub/sub channel. Each process keeps a
+    single Redis subscription, shared by all of its subscribers, and
+    delivers what arrives on it locally.
+    """
+    redis_channel = 'labeling:annotation-events'
+    reconnect_delay = 1
+
+    def __init__(self, url=None):
+        if redis is None:
+            raise ImproperlyConfigured('RedisBroker requires the redis package')
+        super().__init__()
+        self.url = url or getattr(settings, 'ANNOTATION_EVENTS_REDIS_URL', 'redis://localhost:6379/0')
+        self.client = redis.Redis.from_url(self.url)
+        self._listener = None
+
+    def publish(self, messages):
+        pipeline = self.client.pipeline(transaction=False)
+        for channel, message in messages:
+            pipeline.publish(self.redis_channel, channel.encode('utf-8') + b'\n' + message)
+        pipeline.execute()
+
+    def add(self, subscription):
+        super().add(subscription)
+        listener = self._listener
+        if listener is None or listener.done() or listener.get_loop() is not subscription.loop:
+            self._listener = subscription.loop.create_task(self._listen())
+
+    async def _listen(self):
+        client = redis.asyncio.Redis.from_url(self.url)
+        while True:
+            try:
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(self.redis_channel)
+                    async for item in pubsub.listen():
+                        if item['type'] == 'message':
+                            channel, _, message = item['data'].partition(b'\n')
+                            self.deliver([(channel.decode('utf-8'), message)])
+            except redis.ConnectionError as e:
+                logger.warning('Lost the annotation events subscription: %s', e)
+                # Whatever was published meanwhile is gone
+                self.resync()
+                await asyncio.sleep(self.reconnect_delay)
+
+
+@functools.cache
+def get_broker():
+    return import_string(getattr(settings, 'ANNOTATION_EVENTS_BROKER', DEFAULT_BROKER))()
+
+
+def server_sent_event(event, data):
+    """One Server-Sent Events frame; ``data`` is bytes without newlines."""
+    return b'event: ' + event.encode('ascii') + b'\ndata: ' + data + b'\n\n'
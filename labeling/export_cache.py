@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import tempfile
+
+from django.conf import settings
+
+
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3
+
+
+class ExportCache:
+    """
+    On-disk store of finished export artifacts.
+
+    Entries are keyed by dataset, format, export options and the dataset's
+    revision, so any image, annotation or label change simply makes the
+    old entry unreachable. Entries of older revisions of the same export
+    are removed when a new one lands, and the least recently served entries
+    are evicted once the directory grows past ``EXPORT_CACHE_MAX_BYTES``.
+    """
+
+    @property
+    def root(self):
+        return str(getattr(settings, 'EXPORT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'labeling_export_cache')))
+
+    @property
+    def max_bytes(self):
+        return getattr(settings, 'EXPORT_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+
+    def key(self, dataset, format, options=None):
+        fingerprint = json.dumps([
+            str(dataset.pk),
+            format,
+            options or {},
+            dataset.revision,
+            dataset.updated_at.isoformat(),
+        ], sort_keys=True)
+        return hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()[:40]
+
+    def _prefix(self, dataset, format, options):
+        options_hash = hashlib.sha256(json.dumps(options or {}, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+        return f'{dataset.pk}-{format}-{options_hash}-'
+
+    def _version(self, dataset):
+        """What orders the entries of one export: the dataset's revision, then its last edit."""
+        return dataset.revision, int(dataset.updated_at.timestamp() * 1_000_000)
+
+    def path(self, dataset, format, options, key):
+        revision, edited = self._version(dataset)
+        return os.path.join(self.root, f'{self._prefix(dataset, format, options)}{revision}-{edited}-{key}')
+
+    def get(self, dataset, format, options, key):
+        """Return the artifact path for ``key`` if cached, marking it recently used."""
+        path = self.path(dataset, format, options, key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def stream_and_store(self, dataset, format, options, key, chunks):
+        """
+        Pass ``chunks`` through to the caller while writing them to the cache.
+
+        The artifact only becomes visible once the whole export has been
+        produced; an abandoned download leaves nothing behind.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=self.root, prefix='.partial-')
+        completed = False
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode('utf-8')
+                    f.write(chunk)
+                    yield chunk
+            os.replace(temp_path, self.path(dataset, format, options, key))
+            completed = True
+        finally:
+            if not completed:
+                try:
+                    os.remove(temp_path)
+                except FileNotFoundError:
+                    pass
+        self._discard_superseded(dataset, format, options, key)
+        self.evict()
+
+    def _discard_superseded(self, dataset, format, options, key):
+        """
+        Remove the entries of this export for older revisions than the one
+        just stored. A slow export that finishes after a newer one was
+        stored is removed itself instead, and leaves the newer entry alone.
+        """
+        prefix = self._prefix(dataset, format, options)
+        current = self._version(dataset)
+        older = []
+        for entry in os.scandir(self.root):
+            if not entry.name.startswith(prefix):
+                continue
+            version = entry.name[len(prefix):].split('-')[:2]
+            version = tuple(map(int, version)) if all(part.isdigit() for part in version) else ()
+            if version > current:
+                older = [self.path(dataset, format, options, key)]
+                break
+            if version < current:
+                older.append(entry.path)
+        for path in older:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def evict(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.root):
+            if not entry.is_file() or entry.name.startswith('.partial-'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+        # Oldest-served first
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+export_cache = ExportCache()
@@ -0,0 +1,464 @@
+import heapq
+import logging
+import os
+import zipfile
+from collections import defaultdict
+
+from django.core.files.storage import default_storage
+
+from .geometry import coco_geometry
+from .models import Annotation, LabelCategory, Track, Video
+from .pagination import iter_image_chunks
+from .serializers import dumps
+from .tracks import interpolate, unpack_keyframes
+
+
+logger = logging.getLogger(__name__)
+
+EXPORT_CHUNK_SIZE = 1000
+FILE_READ_SIZE = 1024 * 1024
+
+# Formats that are already compressed gain nothing from deflate.
+STORED_EXTENSIONS = {'.jpg', '.jpeg', '.png'}
+
+
+def _dumps(obj):
+    return dumps(obj).decode('utf-8')
+
+
+def iter_export(dataset, format, options=None, progress=None):
+    """Return the chunk iterator for ``format``; ``progress(done, total)`` is called per image chunk."""
+    options = options or {}
+    if format == 'coco':
+        return iter_coco_export(dataset, progress=progress)
+    if format == 'yolo':
+        return iter_yolo_export(dataset, options.get('include_images', False), progress=progress)
+    raise ValueError(f'Unsupported format: {format}')
+
+
+def _tracked_videos(dataset):
+    """
+    ``[(video, tracks)]`` for the videos of ``dataset`` that have tracks,
+    each track as ``(track number, category id, keyframes)``.
+    """
+    tracks = defaultdict(list)
+    rows = Track.objects.filter(video__dataset=dataset).order_by('video_id', 'start_frame', 'created_at', 'id').values_list(
+        'video_id', 'label_category_id', 'keyframe_data'
+    )
+    for number, (video_id, category_id, keyframe_data) in enumerate(rows, 1):
+        tracks[video_id].append((number, category_id, unpack_keyframes(keyframe_data)))
+    if not tracks:
+        return []
+    videos = Video.objects.filter(pk__in=list(tracks)).order_by('filename', 'id').values(
+        'id', 'filename', 'width', 'height'
+    )
+    return [(video, tracks[video['id']]) for video in videos]
+
+
+def _boxes(number, category_id, keyframes):
+    for n, x, y, width, height in interpolate(keyframes):
+        yield n, number, category_id, x, y, width, height
+
+
+def _track_boxes(tracks):
+    """Every interpolated box of one video's tracks as ``(frame, track number, category id, x, y, w, h)``, by frame."""
+    return heapq.merge(*(_boxes(*track) for track in tracks))
+
+
+def iter_coco_export(dataset, chunk_size=EXPORT_CHUNK_SIZE, progress=None):
+    """
+    Yield a COCO JSON document for ``dataset`` piece by piece.
+
+    Images are walked twice in the same keyset order: once to emit the
+    ``images`` array and once to join each chunk of images with its
+    annotations. Image ids are the 1-based position in that order and
+    annotation ids are a running counter, so both are unique no matter
+    how many annotations an image has. Memory stays bounded by the chunk
+    size rather than the dataset size.
+
+    Video tracks are materialized here, one box per frame: every frame
+    with a visible track becomes an image (named like the frames
+    ``extract_frames`` writes) with ``video_id`` and ``frame_id``, and each
+    box an annotation with a ``track_id``, as in COCO-VID.
+
+    Polygons, keypoints and masks get COCO ``segmentation`` or
+    ``keypoints``, with their true area and bounding box (see
+    ``labeling.geometry.coco_geometry``).
+    """
+    categories = list(
+        LabelCategory.objects.filter(project_id=dataset.project_id).values_list('id', 'name')
+    )
+    category_map = {category_id: idx for idx, (category_id, _) in enumerate(categories, 1)}
+    images = dataset.images.all()
+    total_images = dataset.image_count if progress else None
+    videos = _tracked_videos(dataset)
+
+    yield '{\n'
+    yield '"info": ' + _dumps({
+        'description': dataset.description,
+        'version': '1.0',
+        'year': 2024
+    }) + ',\n'
+    yield '"categories": [\n' + ',\n'.join(_dumps({
+        'id': idx,
+        'name': name,
+        'supercategory': 'object'
+    }) for idx, (_, name) in enumerate(categories, 1)) + '\n],\n'
+    if videos:
+        yield '"videos": [\n' + ',\n'.join(_dumps({
+            'id': idx,
+            'file_name': video['filename'],
+            'width': video['width'],
+            'height': video['height']
+        }) for idx, (video, _) in enumerate(videos, 1)) + '\n],\n'
+
+    yield '"images": ['
+    image_id = 0
+    for rows in iter_image_chunks(images, ('width', 'height'), chunk_size):
+        parts = []
+        for row in rows:
+            image_id += 1
+            parts.append(_dumps({
+                'id': image_id,
+                'width': row['width'],
+                'height': row['height'],
+                'file_name': row['filename']
+            }))
+        yield (',\n' if image_id > len(rows) else '\n') + ',\n'.join(parts)
+
+    frame_ids = []
+    for video_id, (video, tracks) in enumerate(videos, 1):
+        stem = os.path.splitext(video['filename'])[0]
+        ids = {}
+        parts = []
+        for n, *_ in _track_boxes(tracks):
+            if n in ids:
+                continue
+            image_id += 1
+            ids[n] = image_id
+            parts.append(_dumps({
+                'id': image_id,
+                'width': video['width'],
+                'height': video['height'],
+                'file_name': f'{stem}_{n:07}.jpg',
+                'video_id': video_id,
+                'frame_id': n
+            }))
+            if len(parts) == chunk_size:
+                yield (',\n' if image_id > len(parts) else '\n') + ',\n'.join(parts)
+                parts = []
+        if parts:
+            yield (',\n' if image_id > len(parts) else '\n') + ',\n'.join(parts)
+        frame_ids.append(ids)
+    yield '\n],\n'
+
+    yield '"annotations": ['
+    image_id = 0
+    annotation_id = 0
+    for rows in iter_image_chunks(images, (), chunk_size):
+        image_ids = {}
+        for row in rows:
+            image_id += 1
+            image_ids[row['id']] = image_id
+
+        annotations = Annotation.objects.filter(
+            image_id__in=list(image_ids)
+        ).order_by('image_id', 'created_at', 'id').values_list(
+            'image_id', 'label_category_id', 'annotation_type', 'x', 'y', 'width', 'height', 'geometry'
+        )
+
+        parts = []
+        for image_pk, category_id, annotation_type, x, y, width, height, geometry in annotations.iterator(
+            chunk_size=chunk_size
+        ):
+            annotation_id += 1
+            parts.append(_dumps({
+                'id': annotation_id,
+                'image_id': image_ids[image_pk],
+                'category_id': category_map.get(category_id),
+                **coco_geometry(annotation_type, geometry, x, y, width, height),
+                'iscrowd': 0
+            }))
+        if parts:
+            yield (',\n' if annotation_id > len(parts) else '\n') + ',\n'.join(parts)
+        if progress:
+            progress(image_id, total_images)
+
+    for (video, tracks), ids in zip(videos, frame_ids):
+        parts = []
+        for n, track_id, category_id, x, y, width, height in _track_boxes(tracks):
+            annotation_id += 1
+            parts.append(_dumps({
+                'id': annotation_id,
+                'image_id': ids[n],
+                'category_id': category_map.get(category_id),
+                'bbox': [x, y, width, height],
+                'area': width * height,
+                'iscrowd': 0,
+                'track_id': track_id
+            }))
+            if len(parts) == chunk_size:
+                yield (',\n' if annotation_id > len(parts) else '\n') + ',\n'.join(parts)
+                parts = []
+        if parts:
+            yield (',\n' if annotation_id > len(parts) else '\n') + ',\n'.join(parts)
+    yield '\n]\n}\n'
+
+
+class ZipStreamBuffer:
+    """
+    Write-only, unseekable sink for ``zipfile.ZipFile``.
+
+    Without ``tell``/``seek`` zipfile falls back to data descriptors, so
+    entries can be written without knowing their CRC up front and the
+    produced bytes can be handed to the client as soon as they exist.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _zip_info(arcname, date_time, size=None):
+    info = zipfile.ZipInfo(arcname, date_time=date_time)
+    info.external_attr = 0o644 << 16
+    if os.path.splitext(arcname)[1].lower() in STORED_EXTENSIONS:
+        info.compress_type = zipfile.ZIP_STORED
+    else:
+        info.compress_type = zipfile.ZIP_DEFLATED
+    if size is not None:
+        # Lets zipfile pick zip64 headers for large images up front.
+        info.file_size = size
+    return info
+
+
+def _yolo_line(class_id, annotation_x, annotation_y, annotation_width, annotation_height,
+               img_width, img_height):
+    # YOLO format: class_id center_x center_y width height (all normalized 0-1)
+    center_x = (annotation_x + annotation_width / 2) / img_width
+    center_y = (annotation_y + annotation_height / 2) / img_height
+    norm_width = annotation_width / img_width
+    norm_height = annotation_height / img_height
+
+    # Ensure values are within [0, 1] range
+    center_x = max(0, min(1, center_x))
+    center_y = max(0, min(1, center_y))
+    norm_width = max(0, min(1, norm_width))
+    norm_height = max(0, min(1, norm_height))
+
+    return f"{class_id} {center_x:.6f} {center_y:.6f} {norm_width:.6f} {norm_height:.6f}\n"
+
+
+def _yolo_data_yaml(dataset, category_names):
+    names = ', '.join(f"'{name}'" for name in category_names)
+    return (
+        f"# Dataset configuration for {dataset.name}\n"
+        f"path: ./  # dataset root dir\n"
+        f"train: images/  # train images (relative to 'path')\n"
+        f"val: images/  # val images (relative to 'path')\n"
+        f"test:  # test images (optional)\n\n"
+        f"# Classes\n"
+        f"nc: {len(category_names)}  # number of classes\n"
+        f"names: [{names}]\n"
+    )
+
+
+def _yolo_readme(dataset, category_names, include_images, total_images, annotated_images,
+                 total_annotations):
+    lines = [
+        f"YOLO Dataset Export - {dataset.name}\n",
+        "=" * 50 + "\n\n",
+        "Generated by Image Labeling Tool\n",
+        f"Export Date: {dataset.updated_at.strftime('%Y-%m-%d %H:%M:%S')}\n",
+        f"Dataset Type: {dataset.get_dataset_type_display()}\n\n",
+
+        "OVERVIEW\n",
+        "-" * 20 + "\n",
+        "This export contains annotation files in YOLO format, ready for training\n",
+        "YOLO (You Only Look Once) object detection models.\n\n",
+
+        "FILE STRUCTURE\n",
+        "-" * 20 + "\n",
+        "📁 Root Directory\n",
+        "├── 📁 labels/          # YOLO annotation files (.txt)\n",
+    ]
+    if include_images:
+        lines.append("├── 📁 images/          # Training images\n")
+    lines += [
+        "├── 📄 classes.txt      # Class names (one per line)\n",
+        "├── 📄 data.yaml        # YOLO dataset configuration\n",
+        "└── 📄 README.txt       # This documentation\n\n",
+
+        "YOLO ANNOTATION FORMAT\n",
+        "-" * 20 + "\n",
+        "Each annotation file (.txt) contains one line per object:\n",
+        "Format: class_id center_x center_y width height\n\n",
+        "Where:\n",
+        "• class_id    = Integer class identifier (0-based)\n",
+        "• center_x    = X-coordinate of bounding box center (0.0-1.0)\n",
+        "• center_y    = Y-coordinate of bounding box center (0.0-1.0)\n",
+        "• width       = Bounding box width (0.0-1.0)\n",
+        "• height      = Bounding box height (0.0-1.0)\n\n",
+        "All coordinates are normalized relative to image dimensions.\n\n",
+
+        "DATASET STATISTICS\n",
+        "-" * 20 + "\n",
+        f"📊 Total Images:        {total_images}\n",
+        f"✅ Annotated Images:    {annotated_images}\n",
+        f"🏷️  Total Annotations:   {total_annotations}\n",
+        f"📦 Number of Classes:   {len(category_names)}\n\n",
+
+        "CLASS MAPPING\n",
+        "-" * 20 + "\n",
+        "ID | Class Name\n",
+        "---|------------\n",
+    ]
+    for class_id, name in enumerate(category_names):
+        lines.append(f"{class_id:2d} | {name}\n")
+    lines += [
+        f"\nUSAGE WITH YOLO\n",
+        "-" * 20 + "\n",
+        "1. Use the data.yaml file to configure your YOLO training\n",
+        "2. Place this dataset in your YOLO project directory\n",
+        "3. Update the paths in data.yaml if needed\n",
+        "4. Train your model: yolo train data=data.yaml\n\n",
+    ]
+    if not include_images:
+        lines += [
+            "NOTE: This export contains labels only. Add your images to the\n",
+            "'images/' directory to complete the dataset structure.\n\n",
+        ]
+    else:
+        lines += [
+            "NOTE: Images that could not be read from storage are left out or\n",
+            "cut short, and listed in missing_images.txt.\n\n",
+        ]
+    lines += [
+        "For more information about YOLO format and training, visit:\n",
+        "https://github.com/ultralytics/ultralytics\n",
+    ]
+    return ''.join(lines)
+
+
+def iter_yolo_export(dataset, include_images=False, chunk_size=EXPORT_CHUNK_SIZE, progress=None):
+    """
+    Yield a YOLO zip archive for ``dataset`` as it is produced.
+
+    Label files are built in memory per chunk of images and image entries
+    are copied straight from storage in ``FILE_READ_SIZE`` blocks, so
+    neither a temporary directory nor a full-archive buffer is needed.
+    """
+    categories = list(
+        LabelCategory.objects.filter(project_id=dataset.project_id).values_list('id', 'name')
+    )
+    category_names = [name for _, name in categories]
+    # Create class mapping (YOLO uses integer class IDs)
+    class_mapping = {category_id: idx for idx, (category_id, _) in enumerate(categories)}
+    images = dataset.images.all()
+    # Fixed entry timestamps keep rebuilt archives byte-identical, which
+    # the export cache relies on for strong ETags.
+    date_time = dataset.updated_at.timetuple()[:6]
+
+    total_images = dataset.image_count
+    done_images = 0
+    # (archive name, reason) of images that could not be copied in full
+    missing = []
+
+    buffer = ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr(_zip_info('classes.txt', date_time), ''.join(f"{name}\n" for name in category_names))
+        zip_file.writestr(_zip_info('data.yaml', date_time), _yolo_data_yaml(dataset, category_names))
+        zip_file.writestr(_zip_info('README.txt', date_time), _yolo_readme(
+            dataset,
+            category_names,
+            include_images,
+            total_images=total_images,
+            annotated_images=dataset.annotated_count,
+            total_annotations=Annotation.objects.filter(
+                image__dataset=dataset, annotation_type='bbox'
+            ).count(),
+        ))
+        yield buffer.drain()
+
+        for rows in iter_image_chunks(images, ('file', 'width', 'height'), chunk_size):
+            lines = {row['id']: [] for row in rows}
+            annotations = Annotation.objects.filter(
+                image_id__in=list(lines), annotation_type='bbox'
+            ).order_by('image_id', 'created_at', 'id').values_list(
+                'image_id', 'label_category_id', 'x', 'y', 'width', 'height'
+            )
+            sizes = {row['id']: (row['width'], row['height']) for row in rows}
+            for image_id, category_id, x, y, width, height in annotations.iterator(chunk_size=chunk_size):
+                img_width, img_height = sizes[image_id]
+                lines[image_id].append(_yolo_line(
+                    class_mapping.get(category_id, 0), x, y, width, height, img_width, img_height
+                ))
+
+            for row in rows:
+                # Images without annotations still get an empty label file
+                label_filename = os.path.splitext(row['filename'])[0] + '.txt'
+                zip_file.writestr(_zip_info(f'labels/{label_filename}', date_time), ''.join(lines[row['id']]))
+
+                if include_images and row['file']:
+                    yield from _iter_storage_file(
+                        zip_file, buffer, row['file'], f"images/{row['filename']}", date_time, missing
+                    )
+                yield buffer.drain()
+            done_images += len(rows)
+            if progress:
+                progress(done_images, total_images)
+        if missing:
+            zip_file.writestr(
+                _zip_info('missing_images.txt', date_time),
+                ''.join(f'{arcname}: {reason}\n' for arcname, reason in missing),
+            )
+    yield buffer.drain()
+
+
+def _open_storage_file(name):
+    """Open storage file ``name`` and read its first block; returns ``(file, size, block)``."""
+    source = default_storage.open(name, 'rb')
+    try:
+        return source, source.size, source.read(FILE_READ_SIZE)
+    except BaseException:
+        source.close()
+        raise
+
+
+def _iter_storage_file(zip_file, buffer, name, arcname, date_time, missing):
+    """
+    Copy storage file ``name`` into the archive as ``arcname``.
+
+    The file is opened, sized and read from before its entry header is
+    written, so a missing or unreadable file is left out entirely. A read
+    that fails partway through can no longer be taken back: the entry is
+    closed with what was copied, which keeps the archive itself valid.
+    Either way ``(arcname, reason)`` is added to ``missing``.
+    """
+    try:
+        source, size, block = _open_storage_file(name)
+    except OSError as e:
+        logger.warning('Could not add %s to YOLO export: %s', arcname, e)
+        missing.append((arcname, f'unreadable ({e})'))
+        return
+    with source:
+        with zip_file.open(_zip_info(arcname, date_time, size), 'w') as dest:
+            try:
+                while block:
+                    dest.write(block)
+                    yield buffer.drain()
+                    block = source.read(FILE_READ_SIZE)
+            except OSError as e:
+                logger.warning('Could not finish %s in YOLO export: %s', arcname, e)
+                missing.append((arcname, f'truncated ({e})'))
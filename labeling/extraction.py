@@ -0,0 +1,183 @@
+"""
+Sampling a ``Video`` into a sequential ``Dataset``.
+
+``extract_frames`` picks the frames to keep (every ``stride``-th frame, or
+``fps`` frames a second, between ``start`` and ``end`` seconds) and splits
+them into segments that each begin at a keyframe. The segments are decoded
+in parallel across a process pool, each worker running its own ffmpeg
+from its segment's keyframe, so a long video uses every core instead of
+one decoder reading it end to end.
+
+Frames are stored as JPEG files and registered with ``bulk_create`` as
+``Image`` rows numbered by frame index and linked to the video and frame
+they came from. Frames already extracted into the dataset are skipped, so
+an interrupted run can simply be repeated; files of frames that were never
+registered are deleted again.
+"""
+import io
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from .dedup import content_hash, perceptual_hash
+from .frames import encode_frame, index_video, iter_raw_frames, keyframe_before, video_source
+from .models import Image, count_new_images
+
+
+EXTRACT_QUALITY = 95
+# Most frames one worker extracts at a time; smaller segments spread better across processes
+EXTRACT_SEGMENT_FRAMES = 200
+
+
+def sample_frames(video, stride=None, fps=None, start=None, end=None):
+    """Frame numbers to extract from an indexed ``video``."""
+    if stride and fps:
+        raise ValueError('Give either a stride or a frame rate, not both.')
+    if (stride is not None and stride < 1) or (fps is not None and fps <= 0):
+        raise ValueError('The stride and frame rate must be positive.')
+    if not video.frame_count:
+        raise ValueError(f'The number of frames in {video.filename} is unknown.')
+    first = math.ceil((start or 0) * video.fps)
+    stop = video.frame_count
+    if end is not None:
+        stop = min(stop, math.floor(end * video.fps) + 1)
+    if fps:
+        step = max(1.0, video.fps / fps)
+        return sorted({first + round(i * step) for i in range(math.ceil((stop - first) / step))} - {stop})
+    return list(range(first, stop, stride or 1))
+
+
+def plan_segments(keyframes, frames, max_frames=EXTRACT_SEGMENT_FRAMES):
+    """
+    Split sorted ``frames`` into ``(keyframe, frames)`` segments, each
+    decoded from its own ``[frame_number, seconds]`` keyframe.
+
+    A segment never spans a keyframe interval with no wanted frames, since
+    seeking past it is cheaper than decoding it, and ends at the first
+    keyframe after it has ``max_frames`` frames.
+    """
+    segments = []
+    for n in frames:
+        keyframe = keyframe_before(keyframes, n)
+        if segments:
+            _, segment_frames = segments[-1]
+            # Stay in the segment while n is in its interval or the one right after the last frame's
+            previous = keyframe_before(keyframes, segment_frames[-1])
+            contiguous = keyframe == previous or keyframe_before(keyframes, keyframe[0] - 1) == previous
+            if contiguous and (keyframe == previous or len(segment_frames) < max_frames):
+                segment_frames.append(n)
+                continue
+        segments.append((keyframe, [n]))
+    return segments
+
+
+def _extract_segment(source, width, height, keyframe, names):
+    """
+    Decode from ``keyframe`` and store the frames in ``names`` (frame
+    number -> storage name). Returns ``(frame, name, size, content hash,
+    perceptual hash)`` per stored frame. Runs in a worker process.
+    """
+    first, seconds = keyframe
+    last = max(names)
+    stored = []
+    try:
+        for n, raw in enumerate(iter_raw_frames(source, seconds, last - first + 1, width, height), first):
+            if n not in names:
+                continue
+            data, img = encode_frame(raw, width, height, EXTRACT_QUALITY)
+            name = default_storage.save(names[n], ContentFile(data))
+            stored.append((n, name, len(data), content_hash(io.BytesIO(data)), perceptual_hash(img)))
+    except BaseException:
+        _delete_stored(stored)
+        raise
+    return stored
+
+
+def _delete_stored(stored):
+    for _, name, _, _, _ in stored:
+        default_storage.delete(name)
+
+
+def extract_frames(video, dataset, stride=None, fps=None, start=None, end=None, processes=None,
+                   segment_frames=EXTRACT_SEGMENT_FRAMES):
+    """
+    Extract frames of ``video`` into ``dataset`` across a process pool,
+    yielding ``(done, total)`` as each segment is registered.
+
+    Must be called from a context where Django is configured; children are
+    spawned and set Django up themselves.
+    """
+    if not video.keyframes:
+        index_video(video)
+    frames = sample_frames(video, stride, fps, start, end)
+
+    stem = os.path.splitext(video.filename)[0]
+    filenames = {n: f'{stem}_{n:07}.jpg' for n in frames}
+    existing = set(
+        Image.objects.filter(dataset=dataset, source_video=video).values_list('source_frame', flat=True)
+    )
+    frames = [n for n in frames if n not in existing]
+    if not frames:
+        return
+
+    upload_to = Image._meta.get_field('file')
+    placeholder = Image(dataset=dataset)
+    source = video_source(video)
+    done = 0
+    with ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=django.setup,
+    ) as pool:
+        futures = [
+            pool.submit(
+                _extract_segment, source, video.width, video.height, keyframe,
+                {n: upload_to.generate_filename(placeholder, filenames[n]) for n in segment}
+            )
+            for keyframe, segment in plan_segments(video.keyframes, frames, segment_frames)
+        ]
+        registered = set()
+        try:
+            for future in as_completed(futures):
+                registered.add(future)
+                stored = future.result()
+                images = [
+                    Image(
+                        dataset=dataset,
+                        file=name,
+                        # Storage renames a file rather than overwrite one already there
+                        filename=os.path.basename(name),
+                        width=video.width,
+                        height=video.height,
+                        size=size,
+                        sequence_number=n,
+                        content_hash=digest,
+                        perceptual_hash=phash,
+                        source_video=video,
+                        source_frame=n,
+                    )
+                    for n, name, size, digest, phash in stored
+                ]
+                try:
+                    with transaction.atomic():
+                        Image.objects.bulk_create(images)
+                        count_new_images(dataset.pk, len(images))
+                except BaseException:
+                    _delete_stored(stored)
+                    raise
+                done += len(images)
+                yield done, len(frames)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            # Segments that finished meanwhile stored frames nobody will register
+            for future in futures:
+                if future not in registered and not future.cancelled() and future.exception() is None:
+                    _delete_stored(future.result())
+            raise
@@ -1,6 +1,7 @@
 from django import forms
 from django.forms import modelformset_factory
 from .models import Project, Dataset, Image, Annotation, LabelCategory
+from .geometry import InvalidGeometry, pack_geometry
 
 
 class MultipleFileInput(forms.ClearableFileInput):
@@ -64,6 +65,25 @@ class LabelCategoryForm(forms.ModelForm):
 
 
 class AnnotationForm(forms.ModelForm):
+    # Stored packed in Annotation.geometry
+    points = forms.JSONField(required=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.initial.setdefault('points', self.instance.points)
+
+    def clean_points(self):
+        points = self.cleaned_data['points']
+        try:
+            pack_geometry(points)
+        except InvalidGeometry as e:
+            raise forms.ValidationError(str(e))
+        return points
+
+    def save(self, commit=True):
+        self.instance.points = self.cleaned_data.get('points')
+        return super().save(commit)
+
     class Meta:
         model = Annotation
         fields = ['label_category', 'annotation_type', 'x', 'y', 'width', 'height', 'points', 'confidence', 'notes']
@@ -0,0 +1,318 @@
+"""
+Single frames of ``Video`` files for the annotation canvas.
+
+Decoding is delegated to the ``ffprobe`` and ``ffmpeg`` executables
+(``FFPROBE_BINARY`` and ``FFMPEG_BINARY``). On ingest ``index_video``
+fills in a video's dimensions, frame rate, duration and frame count and
+records where its keyframes are. ``get_frame`` then serves frame ``n`` by
+seeking straight to the last keyframe at or before it and decoding
+forward from there, so a frame costs at most one keyframe interval of
+decoding wherever it is in the video.
+
+Every frame decoded along the way is kept, JPEG-encoded, in a per-process
+LRU cache bounded by ``VIDEO_FRAME_CACHE_MAX_BYTES``, and the frames
+around the one being viewed are decoded in a background thread, so
+stepping through a video is served from memory.
+
+Frame numbers count from 0 and assume a constant frame rate: frame ``n``
+is the one shown ``n / fps`` seconds after the start of the video.
+"""
+import bisect
+import io
+import json
+import logging
+import subprocess
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from PIL import Image as PILImage
+
+
+logger = logging.getLogger(__name__)
+
+FRAME_QUALITY = 85
+# Frames decoded ahead of and behind the one being viewed
+PREFETCH_FRAMES = 30
+PREFETCH_WORKERS = 2
+DEFAULT_CACHE_BYTES = 256 * 1024 ** 2
+PROBE_TIMEOUT = 60
+INDEX_TIMEOUT = 15 * 60
+
+
+class VideoDecodeError(Exception):
+    pass
+
+
+class FrameNotFound(LookupError):
+    pass
+
+
+def _binary(name):
+    return getattr(settings, f'{name.upper()}_BINARY', name)
+
+
+def _run(args, timeout):
+    try:
+        result = subprocess.run(args, capture_output=True, timeout=timeout)
+    except FileNotFoundError:
+        raise VideoDecodeError(f'{args[0]} is not installed')
+    except subprocess.TimeoutExpired:
+        raise VideoDecodeError(f'{args[0]} timed out')
+    if result.returncode:
+        raise VideoDecodeError(result.stderr.decode('utf-8', 'replace').strip() or f'{args[0]} failed')
+    return result.stdout
+
+
+def _number(value, type=float):
+    try:
+        return type(Fraction(value)) or None
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+
+
+def video_source(video):
+    """Path, or failing that URL, that ffmpeg can read ``video.file`` from."""
+    try:
+        return default_storage.path(video.file.name)
+    except NotImplementedError:
+        return default_storage.url(video.file.name)
+
+
+def probe_video(source):
+    """Dimensions, frame rate, duration, frame count and start time of the first video stream."""
+    output = _run([
+        _binary('ffprobe'), '-v', 'error', '-select_streams', 'v:0',
+        '-show_entries', 'stream=width,height,avg_frame_rate,r_frame_rate,nb_frames,duration,start_time'
+                         ':format=duration,start_time',
+        '-of', 'json', source,
+    ], PROBE_TIMEOUT)
+    info = json.loads(output)
+    if not info.get('streams'):
+        raise VideoDecodeError('No video stream')
+    stream, container = info['streams'][0], info.get('format', {})
+
+    fps = _number(stream.get('avg_frame_rate')) or _number(stream.get('r_frame_rate'))
+    duration = _number(stream.get('duration')) or _number(container.get('duration'))
+    frame_count = _number(stream.get('nb_frames'), int)
+    if frame_count is None and fps and duration:
+        frame_count = round(duration * fps)
+    return {
+        'width': stream.get('width'),
+        'height': stream.get('height'),
+        'fps': fps,
+        'duration': duration,
+        'frame_count': frame_count,
+        'start_time': _number(stream.get('start_time')) or _number(container.get('start_time')) or 0.0,
+    }
+
+
+def keyframe_index(source, fps, start_time=0.0):
+    """
+    ``[frame_number, seconds]`` of every keyframe, read from packet flags
+    so nothing is decoded. Seconds are from the start of the video.
+    """
+    output = _run([
+        _binary('ffprobe'), '-v', 'error', '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', source,
+    ], INDEX_TIMEOUT)
+    keyframes = {}
+    for line in output.decode('ascii', 'replace').splitlines():
+        pts_time, _, flags = line.partition(',')
+        seconds = _number(pts_time)
+        if 'K' in flags and seconds is not None:
+            seconds = max(0.0, seconds - start_time)
+            keyframes.setdefault(round(seconds * fps), seconds)
+    # Seeking to 0 always lands on the first frame, keyframe flag or not
+    keyframes.setdefault(0, 0.0)
+    return sorted([frame, seconds] for frame, seconds in keyframes.items())
+
+
+def index_video(video):
+    """Probe ``video``, index its keyframes and save both on the row."""
+    source = video_source(video)
+    info = probe_video(source)
+    if not (info['fps'] and info['width'] and info['height']):
+        raise VideoDecodeError('Could not determine the frame rate and size')
+    video.width = info['width']
+    video.height = info['height']
+    video.fps = info['fps']
+    video.duration = info['duration']
+    video.frame_count = info['frame_count']
+    video.keyframes = keyframe_index(source, info['fps'], info['start_time'])
+    video.save(update_fields=['width', 'height', 'fps', 'duration', 'frame_count', 'keyframes'])
+    return video
+
+
+def keyframe_before(keyframes, n):
+    """``[frame_number, seconds]`` of the last keyframe at or before frame ``n``."""
+    index = bisect.bisect_right(keyframes, n, key=lambda keyframe: keyframe[0]) - 1
+    return keyframes[index] if index >= 0 else [0, 0.0]
+
+
+class FrameCache:
+    """Thread-safe LRU of encoded frames, bounded by their total size in bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.frames = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.frames
+
+    def get(self, key):
+        with self.lock:
+            data = self.frames.get(key)
+            if data is not None:
+                self.frames.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        with self.lock:
+            previous = self.frames.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self.frames[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes and self.frames:
+                _, evicted = self.frames.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+            self.size = 0
+
+
+frame_cache = FrameCache(getattr(settings, 'VIDEO_FRAME_CACHE_MAX_BYTES', DEFAULT_CACHE_BYTES))
+
+
+def frame_key(video, n):
+    # The file name and size make a replaced file miss the cache
+    return (str(video.pk), video.file.name, video.size, n)
+
+
+def iter_raw_frames(source, seconds, count, width, height):
+    """
+    Decode up to ``count`` frames of ``source`` starting ``seconds`` in,
+    which should be a keyframe, yielding each as packed RGB bytes.
+    """
+    frame_size = width * height * 3
+    args = [
+        _binary('ffmpeg'), '-v', 'error', '-nostdin',
+        # Frames keep the coded orientation, matching the probed width and height
+        '-noautorotate', '-ss', f'{seconds:.6f}', '-i', source,
+        '-map', '0:v:0', '-frames:v', str(count),
+        '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-',
+    ]
+    decoded = 0
+    with tempfile.TemporaryFile() as stderr:
+        try:
+            process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=stderr)
+        except FileNotFoundError:
+            raise VideoDecodeError(f'{args[0]} is not installed')
+        try:
+            while decoded < count:
+                raw = process.stdout.read(frame_size)
+                if len(raw) < frame_size:
+                    break
+                decoded += 1
+                yield raw
+        finally:
+            process.stdout.close()
+            if decoded < count:
+                process.kill()
+            if process.wait() and not decoded:
+                stderr.seek(0)
+                raise VideoDecodeError(stderr.read().decode('utf-8', 'replace').strip() or 'ffmpeg failed')
+
+
+def encode_frame(raw, width, height, quality=FRAME_QUALITY):
+    """Returns the JPEG bytes of a raw RGB frame and the frame as a PIL image."""
+    img = PILImage.frombytes('RGB', (width, height), raw)
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue(), img
+
+
+def decode_frames(video, start, stop):
+    """
+    Decode frames ``[start, stop)`` of ``video`` into the cache and return
+    them as ``{frame_number: jpeg_bytes}``.
+
+    Decoding starts at the keyframe before ``start``; the frames between it
+    and ``start`` have to be decoded anyway, so they are cached as well.
+    """
+    first, seconds = keyframe_before(video.keyframes, start)
+    frames = {}
+    raw_frames = iter_raw_frames(video_source(video), seconds, stop - first, video.width, video.height)
+    for n, raw in enumerate(raw_frames, first):
+        data, _ = encode_frame(raw, video.width, video.height)
+        frame_cache.put(frame_key(video, n), data)
+        if n >= start:
+            frames[n] = data
+    return frames
+
+
+_prefetch_pool = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix='frame-prefetch')
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def _prefetch(video, start, stop):
+    try:
+        decode_frames(video, start, stop)
+    except Exception:
+        logger.warning('Prefetching frames %s-%s of video %s failed', start, stop, video.pk, exc_info=True)
+    finally:
+        with _pending_lock:
+            _pending.discard((str(video.pk), start))
+
+
+def prefetch(video, n):
+    """Decode the frames on either side of ``n`` in the background unless they are cached."""
+    last = video.frame_count - 1 if video.frame_count else n + PREFETCH_FRAMES
+    windows = []
+    # Checking the middle of each window keeps this cheap; a partly cached window is refilled
+    if n < last and frame_key(video, min(n + PREFETCH_FRAMES // 2, last)) not in frame_cache:
+        windows.append((n + 1, min(n + 1 + PREFETCH_FRAMES, last + 1)))
+    if n > 0 and frame_key(video, n - 1) not in frame_cache:
+        windows.append((max(0, n - PREFETCH_FRAMES), n))
+    for start, stop in windows:
+        with _pending_lock:
+            if (str(video.pk), start) in _pending:
+                continue
+            _pending.add((str(video.pk), start))
+        _prefetch_pool.submit(_prefetch, video, start, stop)
+
+
+def get_frame(video, n):
+    """JPEG bytes of frame ``n`` of an indexed ``video``."""
+    if n < 0 or (video.frame_count is not None and n >= video.frame_count):
+        raise FrameNotFound(f'Frame {n} is out of range')
+    data = frame_cache.get(frame_key(video, n))
+    if data is None:
+        data = decode_frames(video, n, n + 1).get(n)
+        if data is None:
+            raise FrameNotFound(f'Frame {n} is past the end of the video')
+    prefetch(video, n)
+    return data
+
+
+def frame_source(video):
+    """Frame descriptor handed to the canvas."""
+    return {
+        'width': video.width,
+        'height': video.height,
+        'fps': video.fps,
+        'duration': video.duration,
+        'frame_count': video.frame_count,
+        'keyframes': [frame for frame, _ in video.keyframes],
+    }
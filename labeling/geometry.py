@@ -0,0 +1,182 @@
+"""
+Packed storage for polygon, keypoint and segmentation geometry.
+
+``Annotation.geometry`` is one binary column instead of nested JSON lists.
+Its first byte says what follows:
+
+    ``P``  the points as little-endian float32 ``x, y`` pairs
+    ``R``  a mask as uint32 height and width, then its COCO run lengths
+
+``Annotation.points`` reads and writes it in the shapes the API has always
+used: ``[[x, y], ...]`` for points and ``{'size': [height, width],
+'counts': [...]}`` (COCO's uncompressed RLE, column-major, starting with a
+background run) for masks.
+
+Points decode straight into an ``array('f')``, and ``coco_geometry`` works
+on that array with builtins that loop in C, so exports compute true areas
+and bounding boxes without building a Python list per vertex.
+"""
+import math
+import struct
+import sys
+from array import array
+from operator import mul
+
+from .tracks import MAX_COORDINATE
+
+
+POINTS = b'P'
+RLE = b'R'
+MASK_SIZE = struct.Struct('<II')
+MAX_UINT32 = 2 ** 32 - 1
+# float32 keeps about 7 significant digits; coordinates are rounded to what survives
+PRECISION = 3
+
+
+class InvalidGeometry(ValueError):
+    pass
+
+
+def _little_endian(values):
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def _pack_points(points):
+    values = array('f')
+    for point in points:
+        if not isinstance(point, (list, tuple)) or len(point) != 2:
+            raise InvalidGeometry('each point must be [x, y]')
+        for value in point:
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+                raise InvalidGeometry('point coordinates must be numbers')
+            if abs(value) > MAX_COORDINATE:
+                # float32 would store it as infinity
+                raise InvalidGeometry('point coordinates must be within single precision range')
+        values.extend(point)
+    return POINTS + _little_endian(values).tobytes()
+
+
+def _pack_rle(mask):
+    size, counts = mask.get('size'), mask.get('counts')
+    if (
+        not isinstance(size, (list, tuple)) or len(size) != 2
+        or not all(
+            isinstance(value, int) and not isinstance(value, bool) and 0 <= value <= MAX_UINT32 for value in size
+        )
+    ):
+        raise InvalidGeometry('size must be [height, width]')
+    if not isinstance(counts, list) or not all(
+        isinstance(value, int) and not isinstance(value, bool) and 0 <= value <= MAX_UINT32 for value in counts
+    ):
+        raise InvalidGeometry('counts must be a list of run lengths')
+    height, width = size
+    if sum(counts) != height * width:
+        raise InvalidGeometry('counts must add up to height * width')
+    return RLE + MASK_SIZE.pack(height, width) + _little_endian(array('I', counts)).tobytes()
+
+
+def pack_geometry(value):
+    """Bytes for a list of ``[x, y]`` points or an RLE mask dict; None for None."""
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        return _pack_rle(value)
+    if isinstance(value, list):
+        return _pack_points(value)
+    raise InvalidGeometry('points must be a list of [x, y] or an RLE mask')
+
+
+def coordinates(data):
+    """Flat ``x0, y0, x1, y1, ...`` float32 array of packed points."""
+    values = array('f')
+    values.frombytes(bytes(data)[1:])
+    return _little_endian(values)
+
+
+def mask(data):
+    """``(height, width, counts)`` of a packed RLE mask."""
+    data = bytes(data)
+    height, width = MASK_SIZE.unpack_from(data, 1)
+    counts = array('I')
+    counts.frombytes(data[1 + MASK_SIZE.size:])
+    return height, width, _little_endian(counts)
+
+
+def unpack_geometry(data):
+    """The points or mask dict ``pack_geometry`` was given, or None."""
+    if data is None:
+        return None
+    if bytes(data[:1]) == RLE:
+        height, width, counts = mask(data)
+        return {'size': [height, width], 'counts': counts.tolist()}
+    values = [round(value, PRECISION) for value in coordinates(data)]
+    return [values[i:i + 2] for i in range(0, len(values), 2)]
+
+
+def polygon_area(values):
+    """Shoelace area of a closed polygon given as a flat coordinate array."""
+    xs, ys = values[0::2], values[1::2]
+    if len(xs) < 3:
+        return 0.0
+    return abs(sum(map(mul, xs, ys[1:] + ys[:1])) - sum(map(mul, ys, xs[1:] + xs[:1]))) / 2
+
+
+def points_bbox(values):
+    """``[x, y, width, height]`` enclosing a flat coordinate array."""
+    xs, ys = values[0::2], values[1::2]
+    if not xs:
+        return [0.0, 0.0, 0.0, 0.0]
+    left, top = min(xs), min(ys)
+    return [round(left, PRECISION), round(top, PRECISION),
+            round(max(xs) - left, PRECISION), round(max(ys) - top, PRECISION)]
+
+
+def mask_bbox(height, counts):
+    """``[x, y, width, height]`` enclosing the foreground runs of a column-major RLE."""
+    left = top = math.inf
+    right = bottom = -math.inf
+    position = 0
+    for index, length in enumerate(counts):
+        if index % 2 and length:
+            last = position + length - 1
+            first_column, last_column = position // height, last // height
+            left, right = min(left, first_column), max(right, last_column)
+            if first_column == last_column:
+                top, bottom = min(top, position % height), max(bottom, last % height)
+            else:
+                # A run wrapping into the next column reaches both the bottom and top rows
+                top, bottom = 0, height - 1
+        position += length
+    if left is math.inf:
+        return [0, 0, 0, 0]
+    return [left, top, right - left + 1, bottom - top + 1]
+
+
+def coco_geometry(annotation_type, data, x, y, width, height):
+    """
+    COCO ``bbox``, ``area`` and ``segmentation`` or ``keypoints`` for one
+    annotation. Boxes come from the packed geometry when there is any,
+    else from ``x, y, width, height``.
+    """
+    if data is None:
+        area = width * height if width is not None and height is not None else 0
+        return {'bbox': [x, y, width, height], 'area': area}
+    if bytes(data[:1]) == RLE:
+        mask_height, mask_width, counts = mask(data)
+        return {
+            'bbox': mask_bbox(mask_height, counts),
+            'area': sum(counts[1::2]),
+            'segmentation': {'size': [mask_height, mask_width], 'counts': counts.tolist()},
+        }
+    values = coordinates(data)
+    bbox = points_bbox(values)
+    flat = [round(value, PRECISION) for value in values]
+    if annotation_type == 'keypoint':
+        # 2: labeled and visible
+        keypoints = []
+        for i in range(0, len(flat), 2):
+            keypoints += [flat[i], flat[i + 1], 2]
+        return {'bbox': bbox, 'area': bbox[2] * bbox[3], 'keypoints': keypoints, 'num_keypoints': len(flat) // 2}
+    return {'bbox': bbox, 'area': round(polygon_area(values), PRECISION), 'segmentation': [flat]}
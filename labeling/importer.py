@@ -0,0 +1,359 @@
+"""
+Server-side import of image directories and archives into a dataset.
+
+Sources are listed up front in a stable order, then processed in batches:
+each file is hard-linked, moved or extracted into the ``upload_to_images``
+layout, inspected for its dimensions and hashes in a process pool, and
+the batch minus any content already in the dataset is inserted with
+``bulk_create``. A JSON checkpoint written after every
+committed batch lets an interrupted import resume where it stopped. The
+source listing is saved next to it once, at the start, and a resumed run
+works through that list: in ``move`` mode the files already imported are
+no longer in the source to be listed again.
+
+Files are only ever written to storage names that are free, or that the
+checkpoint records as placed by this import for a batch that was not
+committed yet; a file already in ``MEDIA_ROOT`` is never overwritten.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import tarfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Max
+from PIL import Image as PILImage
+
+from .dedup import drop_duplicates
+from .ingest import BULK_CREATE_BATCH_SIZE, inspect_image
+from .models import Image, count_new_images, upload_to_images
+from .uploads import allowed_extensions, upload_root
+
+
+IMPORT_BATCH_SIZE = 1000
+COPY_BUFFER_SIZE = 1024 * 1024
+TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+
+class ImportSourceError(ValueError):
+    pass
+
+
+def natural_key(name):
+    """Sort key that orders ``frame_2`` before ``frame_10``."""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', name)]
+
+
+def _is_image_name(name):
+    parts = name.replace('\\', '/').split('/')
+    if any(part.startswith('.') or part == '__MACOSX' for part in parts):
+        return False
+    return os.path.splitext(name)[1][1:].lower() in allowed_extensions('image')
+
+
+class DirectorySource:
+    """Image files below a directory, in natural filename order."""
+
+    def __init__(self, path):
+        self.root = path
+
+    def names(self):
+        names = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            relative = os.path.relpath(dirpath, self.root)
+            for filename in filenames:
+                name = filename if relative == '.' else os.path.join(relative, filename)
+                if _is_image_name(name):
+                    names.append(name)
+        return sorted(names, key=natural_key)
+
+    def place(self, name, target, mode, replace=False):
+        source = os.path.join(self.root, name)
+        if os.path.lexists(target):
+            if not replace:
+                raise FileExistsError(f'{target} already exists')
+            if mode == 'move' and not os.path.exists(source):
+                # Moved by an earlier, interrupted run
+                return
+            if mode == 'link' and os.path.samefile(source, target):
+                return
+            os.remove(target)
+        if mode == 'move':
+            shutil.move(source, target)
+            return
+        if mode == 'link':
+            try:
+                os.link(source, target)
+                return
+            except FileExistsError:
+                raise
+            except OSError:
+                # Different filesystem, or links not supported; fall back to a copy
+                pass
+        _copy(source, target)
+
+    def unplace(self, name, target, mode):
+        if mode == 'move':
+            shutil.move(target, os.path.join(self.root, name))
+        else:
+            os.remove(target)
+
+    def close(self):
+        pass
+
+
+def _copy(source, target):
+    with open(source, 'rb') as f:
+        _write(f, target, replace=False)
+
+
+def _write(source, target, replace):
+    """Copy file object ``source`` to ``target``, which must not exist unless ``replace``."""
+    with open(target, 'wb' if replace else 'xb') as output:
+        shutil.copyfileobj(source, output, COPY_BUFFER_SIZE)
+
+
+class ZipSource:
+    """Image members of a zip archive, in natural filename order."""
+
+    def __init__(self, path):
+        self.archive = zipfile.ZipFile(path)
+
+    def names(self):
+        names = [info.filename for info in self.archive.infolist() if not info.is_dir()]
+        return sorted((name for name in names if _is_image_name(name)), key=natural_key)
+
+    def place(self, name, target, mode, replace=False):
+        with self.archive.open(name) as source:
+            _write(source, target, replace)
+
+    def unplace(self, name, target, mode):
+        os.remove(target)
+
+    def close(self):
+        self.archive.close()
+
+
+class TarSource:
+    """
+    Image members of a (possibly compressed) tar archive, in archive order.
+
+    Compressed tars only read efficiently front to back, so members are
+    taken in the order they are stored rather than sorted.
+    """
+
+    def __init__(self, path):
+        self.archive = tarfile.open(path, 'r:*')
+        self.members = {
+            member.name: member for member in self.archive.getmembers()
+            if member.isfile() and _is_image_name(member.name)
+        }
+
+    def names(self):
+        return list(self.members)
+
+    def place(self, name, target, mode, replace=False):
+        with self.archive.extractfile(self.members[name]) as source:
+            _write(source, target, replace)
+
+    def unplace(self, name, target, mode):
+        os.remove(target)
+
+    def close(self):
+        self.archive.close()
+
+
+def open_source(path):
+    if os.path.isdir(path):
+        return DirectorySource(path)
+    try:
+        if path.lower().endswith('.zip'):
+            return ZipSource(path)
+        if path.lower().endswith(TAR_SUFFIXES):
+            return TarSource(path)
+    except (OSError, tarfile.TarError, zipfile.BadZipFile) as e:
+        raise ImportSourceError(f'Cannot read {path}: {e}')
+    raise ImportSourceError(f'{path} is not a directory, zip or tar archive')
+
+
+def default_checkpoint_path(dataset, path):
+    digest = hashlib.sha256(os.path.abspath(path).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(upload_root(), f'import-{dataset.pk}-{digest}.json')
+
+
+def _names_path(checkpoint):
+    return checkpoint + '.names'
+
+
+def _load_checkpoint(checkpoint, expected, listed):
+    """Checkpoint state and the source names it counts through, or ``None`` for a fresh import."""
+    try:
+        with open(checkpoint) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return None, listed
+    try:
+        with open(_names_path(checkpoint)) as f:
+            names = json.load(f)
+    except FileNotFoundError:
+        # Checkpoints without a saved listing resume against the current one
+        names = listed
+    if any(state.get(key) != value for key, value in expected.items()) or state.get('total') != len(names):
+        raise ImportSourceError(
+            f'Checkpoint {checkpoint} belongs to a different import; remove it or restart the import'
+        )
+    return state, names
+
+
+def _save_checkpoint(checkpoint, state):
+    os.makedirs(os.path.dirname(checkpoint), exist_ok=True)
+    temp = checkpoint + '.tmp'
+    with open(temp, 'w') as f:
+        json.dump(state, f)
+    os.replace(temp, checkpoint)
+
+
+def remove_checkpoint(checkpoint):
+    for path in (checkpoint, _names_path(checkpoint)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _inspect_path(path):
+    try:
+        with open(path, 'rb') as f:
+            return inspect_image(f), None
+    except (OSError, ValueError, PILImage.DecompressionBombError) as e:
+        return None, str(e)
+
+
+def _storage_name(dataset, name, taken):
+    """
+    Storage name for source file ``name``, avoiding filenames already in
+    the dataset and files already in storage.
+    """
+    storage_name = upload_to_images(Image(dataset=dataset), os.path.basename(name))
+    while os.path.basename(storage_name) in taken or default_storage.exists(storage_name):
+        storage_name = default_storage.get_available_name(storage_name)
+    taken.add(os.path.basename(storage_name))
+    return storage_name
+
+
+def import_images(dataset, path, mode='link', processes=None, batch_size=IMPORT_BATCH_SIZE, checkpoint=None):
+    """
+    Import every image under ``path`` into ``dataset``.
+
+    ``mode`` is ``'link'``, ``'move'`` or ``'copy'`` and only applies to
+    directories; archive members are always extracted. Yields
+    ``(done, total, images, errors)`` after each committed batch, where
+    ``errors`` lists ``(name, message)`` pairs for skipped files.
+    """
+    try:
+        default_storage.path('')
+    except NotImplementedError:
+        raise ImportSourceError('Server-side import needs a local filesystem storage backend')
+
+    source = open_source(path)
+    try:
+        names = source.names()
+        expected = {'dataset': str(dataset.pk), 'source': os.path.abspath(path), 'mode': mode}
+        state, names = _load_checkpoint(checkpoint, expected, names) if checkpoint else (None, names)
+        if state is None:
+            state = dict(expected, total=len(names), done=0, sequence_base=None, placing={})
+            if dataset.dataset_type == 'sequential':
+                last = dataset.images.aggregate(last=Max('sequence_number'))['last']
+                state['sequence_base'] = (last or 0) + 1
+            if checkpoint:
+                # Saved once, before the first file is moved out of the source
+                _save_checkpoint(_names_path(checkpoint), names)
+        sequence = {name: rank for rank, name in enumerate(sorted(names, key=natural_key))}
+
+        taken = set(Image.objects.filter(dataset=dataset).values_list('filename', flat=True))
+        # Storage names of a batch an interrupted run placed but did not commit; these it may overwrite
+        placing = state.get('placing') or {}
+        with ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=django.setup,
+        ) as pool:
+            for start in range(state['done'], len(names), batch_size):
+                batch = names[start:start + batch_size]
+                storage_names = {}
+                for name in batch:
+                    if name in placing and os.path.basename(placing[name]) not in taken:
+                        storage_names[name] = placing[name]
+                        taken.add(os.path.basename(placing[name]))
+                    else:
+                        storage_names[name] = _storage_name(dataset, name, taken)
+                if checkpoint:
+                    # Recorded before any file is written, so a resumed run knows which ones are its own
+                    state['placing'] = storage_names
+                    _save_checkpoint(checkpoint, state)
+
+                placed = []
+                errors = []
+                for name in batch:
+                    storage_name = storage_names[name]
+                    target = default_storage.path(storage_name)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    try:
+                        source.place(name, target, mode, replace=placing.get(name) == storage_name)
+                    except (OSError, tarfile.TarError, zipfile.BadZipFile) as e:
+                        errors.append((name, str(e)))
+                        continue
+                    placed.append((name, storage_name, target))
+
+                inspected = []
+                results = pool.map(_inspect_path, [target for _, _, target in placed], chunksize=32)
+                for (name, storage_name, target), (info, error) in zip(placed, results):
+                    if error:
+                        source.unplace(name, target, mode)
+                        errors.append((name, error))
+                        continue
+                    inspected.append((name, info[2], (name, storage_name, target, info)))
+
+                unique, duplicates = drop_duplicates(dataset, inspected)
+                targets = {name: target for name, _, target in placed}
+                for name, _ in duplicates:
+                    source.unplace(name, targets[name], mode)
+                errors.extend(duplicates)
+
+                images = []
+                for name, storage_name, target, (width, height, digest, phash) in unique:
+                    images.append(Image(
+                        dataset=dataset,
+                        file=storage_name,
+                        filename=os.path.basename(storage_name),
+                        width=width,
+                        height=height,
+                        size=os.path.getsize(target),
+                        sequence_number=(
+                            state['sequence_base'] + sequence[name] if state['sequence_base'] is not None else None
+                        ),
+                        content_hash=digest,
+                        perceptual_hash=phash,
+                    ))
+
+                with transaction.atomic():
+                    Image.objects.bulk_create(images, batch_size=BULK_CREATE_BATCH_SIZE)
+                    count_new_images(dataset.pk, len(images))
+                state['done'] = start + len(batch)
+                state['placing'] = placing = {}
+                if checkpoint:
+                    _save_checkpoint(checkpoint, state)
+                yield state['done'], len(names), images, errors
+    finally:
+        source.close()
+
+    if checkpoint:
+        remove_checkpoint(checkpoint)
@@ -0,0 +1,92 @@
+"""
+Batch ingestion of image files into a dataset.
+
+Inspecting (dimensions and hashes) and storage writes run in a thread
+pool: they operate on Django's upload objects, which cannot be handed to
+other processes. Files whose content is already in the dataset are
+skipped by hash before anything is written, and disk-backed uploads are
+moved into ``MEDIA_ROOT`` by rename through the storage backend. All rows are then inserted with one ``bulk_create`` in a
+single transaction, so a failed batch leaves no partial import behind.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image as PILImage
+
+from .dedup import content_hash, drop_duplicates, perceptual_hash
+from .models import Image, count_new_images
+
+
+INGEST_WORKERS = 8
+BULK_CREATE_BATCH_SIZE = 500
+
+
+def inspect_image(file):
+    """Return ``(width, height, content hash, perceptual hash)`` of an image file object."""
+    digest = content_hash(file)
+    file.seek(0)
+    with PILImage.open(file) as img:
+        width, height = img.size
+        phash = perceptual_hash(img)
+    file.seek(0)
+    return width, height, digest, phash
+
+
+def _store_upload(dataset, file, info):
+    width, height, digest, phash = info
+    image = Image(dataset=dataset, width=width, height=height, content_hash=digest, perceptual_hash=phash)
+    name = Image._meta.get_field('file').generate_filename(image, file.name)
+    # Storage picks a free name when another file already has this one
+    name = default_storage.save(name, file)
+    image.file.name = name
+    image.filename = os.path.basename(name)
+    image.size = file.size
+    return image
+
+
+def ingest_uploads(dataset, files, workers=INGEST_WORKERS):
+    """
+    Store ``files`` and create their ``Image`` rows in one transaction.
+
+    Files whose content is already in the dataset are skipped. Returns
+    ``(images, errors)`` where ``errors`` is a list of ``(file name,
+    message)`` pairs for files that were skipped.
+    """
+    errors = []
+    inspected = []
+    images = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [(file, pool.submit(inspect_image, file)) for file in files]
+        for file, future in futures:
+            try:
+                info = future.result()
+            except (OSError, ValueError, PILImage.DecompressionBombError) as e:
+                errors.append((file.name, str(e)))
+                continue
+            inspected.append((file.name, info[2], (file, info)))
+
+        unique, duplicates = drop_duplicates(dataset, inspected)
+        errors.extend(duplicates)
+
+        futures = [(file, pool.submit(_store_upload, dataset, file, info)) for file, info in unique]
+        for file, future in futures:
+            try:
+                images.append(future.result())
+            except OSError as e:
+                errors.append((file.name, str(e)))
+
+    if not images:
+        return images, errors
+
+    try:
+        with transaction.atomic():
+            Image.objects.bulk_create(images, batch_size=BULK_CREATE_BATCH_SIZE)
+            # bulk_create skips Image.save, so count the images and advance the revision once here
+            count_new_images(dataset.pk, len(images))
+    except Exception:
+        for image in images:
+            default_storage.delete(image.file.name)
+        raise
+    return images, errors
@@ -0,0 +1,452 @@
+"""
+Multi-annotator load test.
+
+``run_load_test`` drives the application in-process with Django's test
+client from one thread per simulated annotator. Each works through a
+dataset the way the annotation canvas does: it pages through the image
+list, opens an image, loads its annotations through the annotation API,
+draws and deletes boxes and saves them. Another thread requests a fresh
+export at a fixed interval, and that export is rebuilt because the
+annotators keep changing the dataset. Every request is timed, and time
+spent waiting on database locks is measured alongside it.
+
+``run_api_benchmark`` instead puts many clients on the annotation API alone,
+through either Django's WSGI request path, one thread per client, or its
+ASGI path, one coroutine per client on a single event loop, so the two can
+be compared at the same concurrency.
+
+Requests run against the configured database and really change the
+dataset, so point it at synthetic data (see ``manage.py seed_synthetic``).
+"""
+import asyncio
+import json
+import random
+import statistics
+import threading
+import time
+from collections import defaultdict
+
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.db import OperationalError, close_old_connections, connection, connections
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+
+
+WRITE_PREFIXES = ('INSERT', 'UPDATE', 'DELETE', 'SAVEPOINT', 'RELEASE', 'BEGIN', 'COMMIT')
+LOCK_ERRORS = ('database is locked', 'deadlock detected', 'could not obtain lock', 'lock timeout')
+LOCK_SAMPLE_INTERVAL = 0.05
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class LoadStats:
+    """Request timings and lock figures collected from every thread."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock_errors = 0
+        self.write_seconds = 0.0
+        self.lock_wait_seconds = None
+
+    def record(self, operation, seconds, ok):
+        with self.lock:
+            self.timings[operation].append(seconds)
+            if not ok:
+                self.errors[operation] += 1
+
+    def record_query(self, seconds, write, lock_error):
+        with self.lock:
+            if write:
+                self.write_seconds += seconds
+            if lock_error:
+                self.lock_errors += 1
+
+    def summary(self, elapsed):
+        operations = {}
+        for operation, timings in sorted(self.timings.items()):
+            timings = sorted(timings)
+            operations[operation] = {
+                'count': len(timings),
+                'errors': self.errors[operation],
+                'throughput': len(timings) / elapsed,
+                'mean': statistics.fmean(timings),
+                'p50': percentile(timings, 0.50),
+                'p95': percentile(timings, 0.95),
+                'p99': percentile(timings, 0.99),
+            }
+        total = sum(len(timings) for timings in self.timings.values())
+        return {
+            'elapsed': elapsed,
+            'requests': total,
+            'errors': sum(self.errors.values()),
+            'throughput': total / elapsed,
+            'operations': operations,
+            'locks': {
+                'lock_errors': self.lock_errors,
+                # Includes lock waits: SQLite blocks inside the statement that needs the lock
+                'write_statement_seconds': self.write_seconds,
+                # Sampled from pg_stat_activity; None where the database cannot report it
+                'lock_wait_seconds': self.lock_wait_seconds,
+            },
+        }
+
+
+class QueryTimer:
+    """``connection.execute_wrapper`` that times writes and counts lock errors."""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def __call__(self, execute, sql, params, many, context):
+        write = sql.lstrip().upper().startswith(WRITE_PREFIXES)
+        start = time.perf_counter()
+        lock_error = False
+        try:
+            return execute(sql, params, many, context)
+        except OperationalError as e:
+            lock_error = any(message in str(e).lower() for message in LOCK_ERRORS)
+            raise
+        finally:
+            self.stats.record_query(time.perf_counter() - start, write, lock_error)
+
+
+class LockSampler(threading.Thread):
+    """Estimate PostgreSQL lock waits by sampling how many backends are waiting on one."""
+
+    def __init__(self, stop):
+        super().__init__(daemon=True)
+        self.stop = stop
+        self.seconds = 0.0
+
+    def run(self):
+        try:
+            with connection.cursor() as cursor:
+                while not self.stop.wait(LOCK_SAMPLE_INTERVAL):
+                    cursor.execute(
+                        "SELECT count(*) FROM pg_stat_activity "
+                        "WHERE datname = current_database() AND wait_event_type = 'Lock'"
+                    )
+                    self.seconds += cursor.fetchone()[0] * LOCK_SAMPLE_INTERVAL
+        finally:
+            connection.close()
+
+
+class Worker(threading.Thread):
+    def __init__(self, stats, user, deadline, seed):
+        super().__init__(daemon=True)
+        self.stats = stats
+        self.deadline = deadline
+        self.rng = random.Random(seed)
+        self.client = Client(raise_request_exception=False)
+        self.client.force_login(user)
+        self.error = None
+
+    def request(self, operation, method, url, body=None, **extra):
+        if body is not None:
+            extra.update(data=json.dumps(body), content_type='application/json')
+        start = time.perf_counter()
+        response = getattr(self.client, method)(url, **extra)
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        self.stats.record(operation, time.perf_counter() - start, response.status_code < 400)
+        return response
+
+    def run(self):
+        try:
+            with connection.execute_wrapper(QueryTimer(self.stats)):
+                while time.monotonic() < self.deadline:
+                    self.step()
+        except Exception as e:
+            self.error = e
+        finally:
+            connection.close()
+
+
+class Annotator(Worker):
+    """Works through a dataset the way ``annotate.html`` does."""
+
+    def __init__(self, stats, user, deadline, seed, dataset, labels, boxes=5, images_per_page=5,
+                 think_time=0.0, per_annotation=False, page_size=50):
+        super().__init__(stats, user, deadline, seed)
+        self.dataset = dataset
+        self.labels = labels
+        self.boxes = boxes
+        self.images_per_page = images_per_page
+        self.think_time = think_time
+        self.per_annotation = per_annotation
+        self.page_size = page_size
+        self.cursor = None
+
+    def box(self, image):
+        width = self.rng.uniform(0.05, 0.3) * image['width']
+        height = self.rng.uniform(0.05, 0.3) * image['height']
+        return {
+            'label_id': self.rng.choice(self.labels),
+            'type': 'bbox',
+            'x': self.rng.uniform(0, image['width'] - width),
+            'y': self.rng.uniform(0, image['height'] - height),
+            'width': width,
+            'height': height,
+        }
+
+    def step(self):
+        params = {'limit': self.page_size}
+        if self.cursor:
+            params['cursor'] = self.cursor
+        page = self.request(
+            'browse', 'get', reverse('labeling:dataset_images_api', kwargs={'pk': self.dataset.pk}), data=params
+        ).json()
+        # Start over at the first page once the end is reached
+        self.cursor = page.get('next_cursor')
+        images = page.get('images', [])
+        for image in self.rng.sample(images, min(self.images_per_page, len(images))):
+            if time.monotonic() >= self.deadline:
+                return
+            self.annotate(image)
+            if self.think_time:
+                time.sleep(self.rng.expovariate(1 / self.think_time))
+
+    def annotate(self, image):
+        self.request('open', 'get', reverse('labeling:annotate_image', kwargs={'pk': image['id']}))
+        # Annotators can open the same image, so a delete occasionally loses the race and counts as an error
+        existing = self.request(
+            'load', 'get', reverse('labeling:annotation_api'), data={'image_id': image['id']}
+        ).json().get('annotations', [])
+        deleted = [annotation['id'] for annotation in self.rng.sample(existing, min(len(existing), self.boxes // 2))]
+        created = [dict(self.box(image), image_id=image['id']) for _ in range(self.boxes)]
+
+        if self.per_annotation:
+            for annotation in created:
+                self.request('create', 'post', reverse('labeling:annotation_api'), body=annotation)
+            for annotation_id in deleted:
+                self.request('delete', 'delete', reverse('labeling:annotation_api_detail', kwargs={'pk': annotation_id}))
+        else:
+            operations = [dict(annotation, op='create') for annotation in created]
+            operations += [{'op': 'delete', 'id': annotation_id} for annotation_id in deleted]
+            self.request('save', 'post', reverse('labeling:annotation_batch'), body={'operations': operations})
+
+
+class Exporter(Worker):
+    """Requests an export of the dataset every ``interval`` seconds."""
+
+    def __init__(self, stats, user, deadline, seed, dataset, interval, format='coco'):
+        super().__init__(stats, user, deadline, seed)
+        self.dataset = dataset
+        self.interval = interval
+        self.format = format
+
+    def step(self):
+        self.request('export', 'get', reverse(
+            'labeling:export_dataset', kwargs={'dataset_id': self.dataset.pk, 'format': self.format}
+        ))
+        time.sleep(max(0.0, min(self.interval, self.deadline - time.monotonic())))
+
+
+def run_load_test(dataset, annotators=4, duration=30.0, export_interval=10.0, seed=0, **options):
+    """
+    Run ``annotators`` annotator threads and, when ``export_interval`` is
+    set, an exporter thread against ``dataset`` for ``duration`` seconds.
+
+    Remaining ``options`` are passed to ``Annotator``. Returns the summary
+    from ``LoadStats.summary``.
+    """
+    user = dataset.project.owner
+    labels = [str(pk) for pk in dataset.project.labels.values_list('id', flat=True)]
+    if not labels:
+        raise ValueError(f'{dataset.project} has no label categories to annotate with.')
+    stats = LoadStats()
+
+    # The test client sends requests for "testserver"; DEBUG would record every query
+    with override_settings(ALLOWED_HOSTS=['testserver'], DEBUG=False):
+        deadline = time.monotonic() + duration
+        workers = [
+            Annotator(stats, user, deadline, seed + i, dataset, labels, **options)
+            for i in range(annotators)
+        ]
+        if export_interval:
+            workers.append(Exporter(stats, user, deadline, seed + annotators, dataset, export_interval))
+        # Sessions are created by force_login above, outside the measured window
+        stop = threading.Event()
+        sampler = LockSampler(stop) if connection.vendor == 'postgresql' else None
+
+        start = time.monotonic()
+        for worker in workers:
+            worker.start()
+        if sampler:
+            sampler.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.monotonic() - start
+        stop.set()
+        if sampler:
+            sampler.join()
+            stats.lock_wait_seconds = sampler.seconds
+
+    connections.close_all()
+    errors = [worker.error for worker in workers if worker.error]
+    if errors:
+        raise errors[0]
+    summary = stats.summary(elapsed)
+    summary.update(database=connection.vendor, annotators=annotators, dataset=str(dataset.pk))
+    return summary
+
+
+def operation_table(report):
+    """Lines of a per-operation table of ``report['operations']``."""
+    lines = [
+        f"{'operation':<10} {'count':>7} {'errors':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    ]
+    for operation, stats in report['operations'].items():
+        lines.append(
+            f"{operation:<10} {stats['count']:>7} {stats['errors']:>6} {stats['throughput']:>8.1f} "
+            f"{stats['p50'] * 1000:>8.1f} {stats['p95'] * 1000:>8.1f} {stats['p99'] * 1000:>8.1f}"
+        )
+    return lines
+
+
+def api_client(rng, image_ids, write_fraction):
+    """
+    The requests of one annotation API client: a generator that yields
+    ``(operation, method, url, kwargs)`` and is sent each response.
+
+    The client loads the annotations of random images, revalidating with
+    the ETag it got last time, and after ``write_fraction`` of the loads
+    moves one of the boxes.
+    """
+    url = reverse('labeling:annotation_api')
+    etags = {}
+    annotations = {}
+    while True:
+        image_id = rng.choice(image_ids)
+        extra = {'HTTP_IF_NONE_MATCH': etags[image_id]} if image_id in etags else {}
+        operation = 'revalidate' if extra else 'load'
+        response = yield operation, 'get', url, {'data': {'image_id': image_id}, **extra}
+        if response.status_code == 200:
+            etags[image_id] = response['ETag']
+            annotations[image_id] = [annotation['id'] for annotation in response.json()['annotations']]
+        if annotations.get(image_id) and rng.random() < write_fraction:
+            pk = rng.choice(annotations[image_id])
+            yield 'update', 'put', reverse('labeling:annotation_api_detail', kwargs={'pk': pk}), {
+                'data': json.dumps({'x': rng.uniform(0, 100)}), 'content_type': 'application/json',
+            }
+
+
+class ThreadSampler(threading.Thread):
+    """Tracks the most threads alive at once."""
+
+    def __init__(self, stop):
+        super().__init__(daemon=True)
+        self.stop = stop
+        self.peak = threading.active_count()
+
+    def run(self):
+        while not self.stop.wait(LOCK_SAMPLE_INTERVAL):
+            self.peak = max(self.peak, threading.active_count())
+
+
+def _run_wsgi(clients, deadline, stats):
+    errors = []
+
+    def run(client, requests):
+        try:
+            response = None
+            while time.monotonic() < deadline:
+                operation, method, url, kwargs = requests.send(response)
+                start = time.perf_counter()
+                response = getattr(client, method)(url, **kwargs)
+                stats.record(operation, time.perf_counter() - start, response.status_code < 400)
+                # As the WSGI handler does after every request
+                close_old_connections()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=run, args=client, daemon=True) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+def _run_asgi(clients, deadline, stats):
+    async def run(client, requests):
+        response = None
+        while time.monotonic() < deadline:
+            operation, method, url, kwargs = requests.send(response)
+            # As the ASGI handler does, give each request its own thread for synchronous code
+            async with ThreadSensitiveContext():
+                start = time.perf_counter()
+                response = await getattr(client, method)(url, **kwargs)
+                stats.record(operation, time.perf_counter() - start, response.status_code < 400)
+                await sync_to_async(close_old_connections)()
+
+    async def run_all():
+        return await asyncio.gather(*(run(*client) for client in clients), return_exceptions=True)
+
+    return [result for result in asyncio.run(run_all()) if isinstance(result, Exception)]
+
+
+def run_api_benchmark(dataset, interface='wsgi', clients=500, duration=30.0, write_fraction=0.1, seed=0,
+                      images=1000):
+    """
+    Run ``clients`` concurrent annotation API clients (see ``api_client``)
+    against the ``images`` most annotated images of ``dataset`` for
+    ``duration`` seconds, through the ``wsgi`` or ``asgi`` request path.
+
+    Both run in-process, without a server or network in between, so the
+    figures compare Django's two request paths and the views on them, not
+    particular servers. Returns the summary from ``LoadStats.summary``
+    plus the peak number of threads.
+    """
+    if interface not in ('wsgi', 'asgi'):
+        raise ValueError(f'Unknown interface {interface!r}; use wsgi or asgi.')
+    image_ids = [
+        str(pk) for pk in
+        dataset.images.order_by('-annotation_count').values_list('id', flat=True)[:images]
+    ]
+    if not image_ids:
+        raise ValueError(f'{dataset} has no images.')
+    user = dataset.project.owner
+    stats = LoadStats()
+
+    with override_settings(ALLOWED_HOSTS=['testserver'], DEBUG=False):
+        client_class = AsyncClient if interface == 'asgi' else Client
+        sessions = []
+        for i in range(clients):
+            client = client_class(raise_request_exception=False)
+            client.force_login(user)
+            sessions.append((client, api_client(random.Random(seed + i), image_ids, write_fraction)))
+        connections.close_all()
+
+        stop = threading.Event()
+        sampler = ThreadSampler(stop)
+        sampler.start()
+        deadline = time.monotonic() + duration
+        start = time.monotonic()
+        errors = (_run_asgi if interface == 'asgi' else _run_wsgi)(sessions, deadline, stats)
+        elapsed = time.monotonic() - start
+        stop.set()
+        sampler.join()
+
+    connections.close_all()
+    if errors:
+        raise errors[0]
+    summary = stats.summary(elapsed)
+    # Lock figures are only collected by run_load_test
+    del summary['locks']
+    summary.update(
+        interface=interface, clients=clients, peak_threads=sampler.peak,
+        database=connection.vendor, dataset=str(dataset.pk),
+    )
+    return summary
@@ -0,0 +1,83 @@
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from labeling.loadtest import operation_table, run_api_benchmark
+from labeling.models import Dataset
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare annotation API throughput and latency through the WSGI and the ASGI request paths '
+        'with many concurrent clients. Changes annotations; use synthetic data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dataset',
+            help='Dataset whose images are loaded (default: the one with the most images).'
+        )
+        parser.add_argument('--clients', type=int, default=500, help='Concurrent clients.')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds to run each interface for.')
+        parser.add_argument(
+            '--interface', choices=['wsgi', 'asgi', 'both'], default='both', help='Request path to benchmark.'
+        )
+        parser.add_argument(
+            '--write-fraction', type=float, default=0.1,
+            help='Share of annotation loads followed by moving a box.'
+        )
+        parser.add_argument('--images', type=int, default=1000, help='Most annotated images to spread clients over.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+        parser.add_argument('--json', help='Also write the full reports to this file.')
+
+    def handle(self, *args, **options):
+        if options['dataset']:
+            try:
+                dataset = Dataset.objects.select_related('project__owner').get(pk=options['dataset'])
+            except (Dataset.DoesNotExist, ValidationError):
+                raise CommandError(f"Dataset {options['dataset']} does not exist.")
+        else:
+            dataset = (
+                Dataset.objects.select_related('project__owner')
+                .filter(image_count__gt=0).order_by('-image_count').first()
+            )
+            if dataset is None:
+                raise CommandError('No dataset with images; run `manage.py seed_synthetic` first.')
+        if options['clients'] < 1 or options['duration'] <= 0:
+            raise CommandError('--clients and --duration must be positive.')
+
+        interfaces = ['wsgi', 'asgi'] if options['interface'] == 'both' else [options['interface']]
+        reports = {}
+        for interface in interfaces:
+            self.stdout.write(
+                f"\n{interface.upper()}: {options['clients']} clients against {dataset} for {options['duration']:g}s"
+            )
+            try:
+                report = reports[interface] = run_api_benchmark(
+                    dataset,
+                    interface=interface,
+                    clients=options['clients'],
+                    duration=options['duration'],
+                    write_fraction=min(1, max(0, options['write_fraction'])),
+                    seed=options['seed'],
+                    images=max(1, options['images']),
+                )
+            except ValueError as e:
+                raise CommandError(str(e))
+            for line in operation_table(report):
+                self.stdout.write(line)
+            self.stdout.write(
+                f"{report['requests']} requests in {report['elapsed']:.1f}s on {report['database']}: "
+                f"{report['throughput']:.1f} req/s, {report['errors']} errors, "
+                f"at most {report['peak_threads']} threads"
+            )
+
+        if len(reports) == 2 and reports['wsgi']['throughput']:
+            self.stdout.write(
+                f"\nASGI throughput is {reports['asgi']['throughput'] / reports['wsgi']['throughput']:.2f}x WSGI's"
+            )
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(reports, f, indent=2)
+            self.stdout.write(f"Report written to {options['json']}")
@@ -0,0 +1,48 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from labeling.derivatives import DERIVATIVE_SPECS, build_derivatives_parallel
+from labeling.models import Dataset, Image
+
+
+class Command(BaseCommand):
+    help = 'Render missing thumbnails and previews for existing images in parallel.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'dataset_ids', nargs='*',
+            help='Datasets to backfill (default: all datasets).'
+        )
+        parser.add_argument(
+            '--processes', type=int, default=os.cpu_count() or 1,
+            help='Number of worker processes (default: number of CPUs).'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=50,
+            help='Images handed to a worker process at a time.'
+        )
+
+    def handle(self, *args, **options):
+        images = Image.objects.all()
+        if options['dataset_ids']:
+            found = Dataset.objects.filter(pk__in=options['dataset_ids']).count()
+            if found != len(set(options['dataset_ids'])):
+                raise CommandError('One or more dataset ids do not exist.')
+            images = images.filter(dataset_id__in=options['dataset_ids'])
+
+        image_ids = list(images.order_by().values_list('id', flat=True))
+        self.stdout.write(
+            f"Rendering {', '.join(DERIVATIVE_SPECS)} for {len(image_ids)} images "
+            f"with {options['processes']} processes"
+        )
+
+        total_built = total_failed = 0
+        for built, failed in build_derivatives_parallel(
+            image_ids, processes=options['processes'], chunk_size=options['chunk_size']
+        ):
+            total_built += built
+            total_failed += failed
+            self.stdout.write(f'{total_built + total_failed}/{len(image_ids)} images processed')
+
+        self.stdout.write(self.style.SUCCESS(f'Done: {total_built} rendered, {total_failed} failed'))
@@ -0,0 +1,39 @@
+import os
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from labeling.models import UploadSession
+from labeling.uploads import discard_upload, part_path
+
+
+class Command(BaseCommand):
+    help = 'Delete resumable upload sessions that have not received data for a while.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours', type=float, default=24,
+            help='Age in hours after which an idle upload is abandoned (default: 24).'
+        )
+
+    def handle(self, *args, **options):
+        max_age = options['hours'] * 3600
+        cutoff = timezone.now() - timedelta(seconds=max_age)
+
+        abandoned = 0
+        for session in UploadSession.objects.filter(status='uploading', created_at__lt=cutoff):
+            # Chunks touch the part file, not the row, so its mtime is the last activity
+            try:
+                idle = time.time() - os.path.getmtime(part_path(session))
+            except FileNotFoundError:
+                idle = max_age
+            if idle >= max_age:
+                discard_upload(session)
+                abandoned += 1
+
+        completed, _ = UploadSession.objects.filter(status='completed', updated_at__lt=cutoff).delete()
+        self.stdout.write(self.style.SUCCESS(
+            f'Removed {abandoned} abandoned and {completed} completed upload sessions'
+        ))
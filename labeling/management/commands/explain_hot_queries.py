@@ -0,0 +1,119 @@
+import re
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Exists, OuterRef
+
+from labeling.models import Annotation, Dataset, Image, LabelCategory, Task
+from labeling.pagination import IMAGE_KEYSET_ORDERING, image_cursor, images_after
+
+
+PAGE_SIZE = 50
+# Tables large enough that a full scan of them on a hot path is a regression
+LARGE_TABLES = (Image._meta.db_table, Annotation._meta.db_table)
+FULL_SCAN_PATTERNS = {
+    'postgresql': re.compile(r'Seq Scan on "?(%s)"?\b' % '|'.join(LARGE_TABLES)),
+    'sqlite': re.compile(r'\bSCAN "?(%s)"?\b' % '|'.join(LARGE_TABLES)),
+}
+# Sorting instead of reading in index order; fine for small per-chunk sets, a
+# regression for dataset-wide pages, so reported but not failed on
+SORT_PATTERNS = {
+    'postgresql': re.compile(r'\bSort Key:'),
+    'sqlite': re.compile(r'USE TEMP B-TREE FOR ORDER BY'),
+}
+
+
+def hot_queries(dataset, image):
+    """
+    ``(name, queryset)`` for the queries behind dataset browsing, annotation
+    and export, built the way the views and exporters build them.
+    """
+    images = Image.objects.filter(dataset=dataset).order_by(*IMAGE_KEYSET_ORDERING)
+    page_fields = ('id', 'file', 'filename', 'width', 'height', 'sequence_number', 'is_annotated', 'annotation_count')
+    page_ids = list(images.values_list('id', flat=True)[:PAGE_SIZE])
+    label_id = (
+        LabelCategory.objects.filter(project_id=dataset.project_id)
+        .order_by('-annotation_count').values_list('id', flat=True).first()
+    )
+
+    queries = [
+        ('dataset images: first page', images.values(*page_fields)[:PAGE_SIZE + 1]),
+        ('dataset images: next page', images_after(images, image_cursor(image)).values(*page_fields)[:PAGE_SIZE + 1]),
+        ('dataset images: unannotated', images.filter(is_annotated=False).values(*page_fields)[:PAGE_SIZE + 1]),
+        ('dataset images: annotated', images.filter(is_annotated=True).values(*page_fields)[:PAGE_SIZE + 1]),
+        ('dataset detail: next unannotated', images.filter(is_annotated=False)[:1]),
+        ('dataset images: page boxes', Annotation.objects.filter(
+            image_id__in=page_ids, annotation_type='bbox'
+        ).order_by().values_list('image_id', 'label_category_id', 'x', 'y', 'width', 'height')),
+        ('annotate: image annotations', Annotation.objects.filter(image=image)),
+        ('COCO export: chunk annotations', Annotation.objects.filter(
+            image_id__in=page_ids
+        ).order_by('image_id', 'created_at', 'id').values_list('image_id', 'label_category_id', 'x', 'y', 'width', 'height')),
+        ('YOLO export: chunk boxes', Annotation.objects.filter(
+            image_id__in=page_ids, annotation_type='bbox'
+        ).order_by('image_id', 'created_at', 'id').values_list('image_id', 'label_category_id', 'x', 'y', 'width', 'height')),
+        ('task queue: claim', Task.objects.filter(status='pending').order_by('created_at').values_list('id', flat=True)[:1]),
+    ]
+    if label_id:
+        queries.append(('dataset images: by label', images.filter(Exists(
+            Annotation.objects.filter(image=OuterRef('pk'), label_category_id=label_id)
+        )).values(*page_fields)[:PAGE_SIZE + 1]))
+    return queries
+
+
+class Command(BaseCommand):
+    help = 'Run EXPLAIN on the hot image and annotation queries against the current database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dataset',
+            help='Dataset to build the queries for (default: the one with the most images).'
+        )
+        parser.add_argument(
+            '--analyze', action='store_true',
+            help='Execute the queries and report actual timings (PostgreSQL only).'
+        )
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Exit with an error if any query scans a whole image or annotation table.'
+        )
+
+    def handle(self, *args, **options):
+        if options['dataset']:
+            try:
+                dataset = Dataset.objects.get(pk=options['dataset'])
+            except (Dataset.DoesNotExist, ValidationError):
+                raise CommandError(f"Dataset {options['dataset']} does not exist.")
+        else:
+            dataset = Dataset.objects.filter(image_count__gt=0).order_by('-image_count').first()
+            if dataset is None:
+                raise CommandError('No dataset with images to explain against.')
+        # An image from the middle of the dataset gives the "next page" query a realistic cursor
+        middle = dataset.image_count // 2
+        image = next(iter(dataset.images.order_by(*IMAGE_KEYSET_ORDERING)[middle:middle + 1]), None)
+        if image is None:
+            raise CommandError(f'Image counters of {dataset} are stale; run `manage.py recount` first.')
+
+        explain_options = {}
+        if options['analyze']:
+            if connection.vendor != 'postgresql':
+                raise CommandError('--analyze is only supported on PostgreSQL.')
+            explain_options = {'analyze': True, 'buffers': True}
+
+        full_scan = FULL_SCAN_PATTERNS.get(connection.vendor)
+        sort = SORT_PATTERNS.get(connection.vendor)
+        scans = []
+        self.stdout.write(f'Explaining against {dataset} ({dataset.image_count} images) on {connection.vendor}')
+        for name, queryset in hot_queries(dataset, image):
+            plan = queryset.explain(**explain_options)
+            self.stdout.write(self.style.MIGRATE_HEADING(f'\n{name}'))
+            self.stdout.write(plan)
+            if full_scan and full_scan.search(plan):
+                scans.append(name)
+                self.stdout.write(self.style.WARNING('Full table scan'))
+            elif sort and sort.search(plan):
+                self.stdout.write(self.style.WARNING('Sorts instead of reading an index in order'))
+
+        if scans and options['check']:
+            raise CommandError(f"Full table scans in: {', '.join(scans)}")
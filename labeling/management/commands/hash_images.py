@@ -0,0 +1,45 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from labeling.dedup import hash_images_parallel
+from labeling.models import Dataset, Image
+
+
+class Command(BaseCommand):
+    help = 'Compute content and perceptual hashes for images that do not have them yet.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'dataset_ids', nargs='*',
+            help='Datasets to backfill (default: all datasets).'
+        )
+        parser.add_argument(
+            '--processes', type=int, default=os.cpu_count() or 1,
+            help='Number of worker processes (default: number of CPUs).'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=200,
+            help='Images handed to a worker process at a time.'
+        )
+
+    def handle(self, *args, **options):
+        images = Image.objects.filter(perceptual_hash__isnull=True)
+        if options['dataset_ids']:
+            found = Dataset.objects.filter(pk__in=options['dataset_ids']).count()
+            if found != len(set(options['dataset_ids'])):
+                raise CommandError('One or more dataset ids do not exist.')
+            images = images.filter(dataset_id__in=options['dataset_ids'])
+
+        image_ids = list(images.order_by().values_list('id', flat=True))
+        self.stdout.write(f"Hashing {len(image_ids)} images with {options['processes']} processes")
+
+        total_hashed = total_failed = 0
+        for hashed, failed in hash_images_parallel(
+            image_ids, processes=options['processes'], chunk_size=options['chunk_size']
+        ):
+            total_hashed += hashed
+            total_failed += failed
+            self.stdout.write(f'{total_hashed + total_failed}/{len(image_ids)} images processed')
+
+        self.stdout.write(self.style.SUCCESS(f'Done: {total_hashed} hashed, {total_failed} failed'))
@@ -0,0 +1,78 @@
+import os
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from labeling.importer import (
+    IMPORT_BATCH_SIZE, ImportSourceError, default_checkpoint_path, import_images, remove_checkpoint
+)
+from labeling.models import Dataset
+from labeling.tasks import enqueue_ingest
+
+
+class Command(BaseCommand):
+    help = 'Import images from a server-side directory, zip or tar archive into a dataset.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset_id', help='Dataset to import into.')
+        parser.add_argument('path', help='Directory or .zip/.tar(.gz/.bz2/.xz) archive of images.')
+        parser.add_argument(
+            '--mode', choices=['link', 'move', 'copy'], default='link',
+            help='How files from a directory reach MEDIA_ROOT: hard-link (default), move or copy. '
+                 'Links and moves fall back to copying across filesystems.'
+        )
+        parser.add_argument(
+            '--processes', type=int, default=os.cpu_count() or 1,
+            help='Number of processes reading and hashing images (default: number of CPUs).'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=IMPORT_BATCH_SIZE,
+            help='Images inserted and checkpointed at a time.'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='Checkpoint file used to resume an interrupted import (default: under UPLOAD_SESSION_DIR).'
+        )
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Ignore an existing checkpoint and start from the first file.'
+        )
+        parser.add_argument(
+            '--no-derivatives', action='store_true',
+            help='Do not queue thumbnail and tile rendering for imported images.'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            dataset = Dataset.objects.get(pk=options['dataset_id'])
+        except (Dataset.DoesNotExist, ValidationError, ValueError):
+            raise CommandError(f"Dataset {options['dataset_id']} does not exist.")
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f'{path} does not exist.')
+
+        checkpoint = options['checkpoint'] or default_checkpoint_path(dataset, path)
+        if options['restart']:
+            remove_checkpoint(checkpoint)
+
+        imported = skipped = 0
+        try:
+            for done, total, images, errors in import_images(
+                dataset,
+                path,
+                mode=options['mode'],
+                processes=max(1, options['processes']),
+                batch_size=max(1, options['batch_size']),
+                checkpoint=checkpoint,
+            ):
+                imported += len(images)
+                skipped += len(errors)
+                for name, error in errors:
+                    self.stderr.write(f'Skipped {name}: {error}')
+                if images and not options['no_derivatives']:
+                    enqueue_ingest(images)
+                self.stdout.write(f'{done}/{total} files processed')
+        except ImportSourceError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(f'Done: {imported} imported, {skipped} skipped'))
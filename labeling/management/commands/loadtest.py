@@ -0,0 +1,90 @@
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+
+from labeling.loadtest import operation_table, run_load_test
+from labeling.models import Dataset
+
+
+class Command(BaseCommand):
+    help = (
+        'Simulate concurrent annotators, plus periodic exports, against a dataset and report '
+        'throughput, latency percentiles and database lock waits. Changes the dataset; use synthetic data.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dataset',
+            help='Dataset to annotate (default: the one with the most images).'
+        )
+        parser.add_argument('--annotators', type=int, default=4, help='Concurrent annotators.')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds to run for.')
+        parser.add_argument(
+            '--export-every', type=float, default=10,
+            help='Seconds between exports; 0 disables the exporter.'
+        )
+        parser.add_argument('--boxes', type=int, default=5, help='Boxes drawn per image; half as many are deleted.')
+        parser.add_argument('--images-per-page', type=int, default=5, help='Images opened from each page browsed.')
+        parser.add_argument('--think-time', type=float, default=0, help='Mean seconds an annotator pauses per image.')
+        parser.add_argument(
+            '--per-annotation', action='store_true',
+            help='Save through one request per annotation instead of the batch endpoint.'
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+        parser.add_argument('--json', help='Also write the full report to this file.')
+
+    def handle(self, *args, **options):
+        if options['dataset']:
+            try:
+                dataset = Dataset.objects.select_related('project__owner').get(pk=options['dataset'])
+            except (Dataset.DoesNotExist, ValidationError):
+                raise CommandError(f"Dataset {options['dataset']} does not exist.")
+        else:
+            dataset = (
+                Dataset.objects.select_related('project__owner')
+                .filter(image_count__gt=0).order_by('-image_count').first()
+            )
+            if dataset is None:
+                raise CommandError('No dataset with images; run `manage.py seed_synthetic` first.')
+        if options['annotators'] < 1 or options['duration'] <= 0:
+            raise CommandError('--annotators and --duration must be positive.')
+
+        self.stdout.write(
+            f"Running {options['annotators']} annotators against {dataset} "
+            f"({dataset.image_count} images) for {options['duration']:g}s"
+        )
+        try:
+            report = run_load_test(
+                dataset,
+                annotators=options['annotators'],
+                duration=options['duration'],
+                export_interval=max(0, options['export_every']),
+                seed=options['seed'],
+                boxes=max(0, options['boxes']),
+                images_per_page=max(1, options['images_per_page']),
+                think_time=max(0, options['think_time']),
+                per_annotation=options['per_annotation'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write('')
+        for line in operation_table(report):
+            self.stdout.write(line)
+        self.stdout.write(
+            f"\n{report['requests']} requests in {report['elapsed']:.1f}s on {report['database']}: "
+            f"{report['throughput']:.1f} req/s, {report['errors']} errors"
+        )
+        locks = report['locks']
+        self.stdout.write(
+            f"Time in write statements: {locks['write_statement_seconds']:.2f}s, "
+            f"lock errors: {locks['lock_errors']}"
+        )
+        if locks['lock_wait_seconds'] is not None:
+            self.stdout.write(f"Backend time waiting on locks: {locks['lock_wait_seconds']:.2f}s")
+
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Report written to {options['json']}")
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from labeling.counters import recount_datasets, recount_images, recount_labels, recount_projects
+from labeling.models import Dataset, Image, LabelCategory, Project
+
+
+class Command(BaseCommand):
+    help = 'Recompute the denormalized image, dataset, label and project counters.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'dataset_ids', nargs='*',
+            help='Datasets to recount (default: every dataset, label and project).'
+        )
+
+    def handle(self, *args, **options):
+        datasets = Dataset.objects.all()
+        if options['dataset_ids']:
+            datasets = datasets.filter(pk__in=options['dataset_ids'])
+            if datasets.count() != len(set(options['dataset_ids'])):
+                raise CommandError('One or more dataset ids do not exist.')
+            project_ids = set(datasets.values_list('project', flat=True))
+            images = Image.objects.filter(dataset__in=datasets)
+            labels = LabelCategory.objects.filter(project_id__in=project_ids)
+            projects = Project.objects.filter(pk__in=project_ids)
+        else:
+            images = Image.objects.all()
+            labels = LabelCategory.objects.all()
+            projects = Project.objects.all()
+
+        image_count = recount_images(images)
+        dataset_count = recount_datasets(datasets)
+        recount_labels(labels)
+        recount_projects(projects)
+        self.stdout.write(self.style.SUCCESS(f'Recounted {image_count} images in {dataset_count} datasets'))
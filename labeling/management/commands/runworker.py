@@ -0,0 +1,124 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from labeling.models import Task
+from labeling.tasks import claim_tasks, heartbeat, run_task, worker_name
+
+
+class Command(BaseCommand):
+    help = 'Run queued background tasks in a pool of worker processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=os.cpu_count() or 1,
+            help='Number of worker processes (default: number of CPUs).'
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help='Seconds to wait between polls when the queue is empty.'
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once the queue is empty instead of polling forever.'
+        )
+
+    def handle(self, *args, **options):
+        self.processes = max(1, options['processes'])
+        self.poll_interval = options['poll_interval']
+        self.name = worker_name()
+        self.stdout.write(f'Worker {self.name} started with {self.processes} processes')
+
+        try:
+            while True:
+                # A crashed child breaks the whole pool; start a fresh one
+                if not self.run_pool(options['once']):
+                    break
+        except KeyboardInterrupt:
+            self.stdout.write('Shutting down')
+
+    def new_pool(self):
+        # Spawn rather than fork so children never share the parent's DB
+        # sockets. django.setup itself is the initializer because the child
+        # has to unpickle it before any app module can be imported.
+        return ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=django.setup,
+        )
+
+    def run_pool(self, once):
+        """Claim and run tasks until the queue drains (with ``once``) or the pool breaks."""
+        # future -> (task id, attempt number it was claimed with)
+        running = {}
+        with self.new_pool() as pool:
+            while True:
+                close_old_connections()
+                free = self.processes - len(running)
+                claimed = claim_tasks(free, worker=self.name) if free else []
+                if claimed:
+                    claimed = list(
+                        Task.objects.filter(pk__in=claimed, worker=self.name).values_list('id', 'attempts')
+                    )
+                try:
+                    for claim in claimed:
+                        running[pool.submit(run_task, claim[0])] = claim
+                        self.stdout.write(f'Started task {claim[0]}')
+                except BrokenProcessPool:
+                    # Claimed but never submitted; put them back in the queue
+                    submitted = set(running.values())
+                    for claim in claimed:
+                        if claim not in submitted:
+                            self.attempt(*claim).update(status='pending', worker='')
+                    self.fail_running(running)
+                    return True
+
+                if not running:
+                    if once:
+                        return False
+                    time.sleep(self.poll_interval)
+                    continue
+
+                done, _ = wait(running, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                heartbeat([task_id for future, (task_id, _) in running.items() if future not in done], self.name)
+                broken = False
+                for future in done:
+                    task_id, attempt = running.pop(future)
+                    try:
+                        succeeded = future.result()
+                    except Exception as e:
+                        # The child died before it could record anything
+                        self.attempt(task_id, attempt).update(
+                            status='failed',
+                            error=f'Worker process failed: {e}',
+                            finished_at=timezone.now(),
+                        )
+                        succeeded = False
+                        broken = broken or isinstance(e, BrokenProcessPool)
+                    self.stdout.write(f"Task {task_id} {'succeeded' if succeeded else 'failed'}")
+                if broken:
+                    self.fail_running(running)
+                    return True
+
+    def attempt(self, task_id, attempt):
+        """
+        The task row while it is still this worker's ``attempt``, matched the
+        way ``run_task`` matches it. Once the lease lapses and another worker
+        reclaims the task, this worker's failures no longer apply to it.
+        """
+        return Task.objects.filter(pk=task_id, status='running', worker=self.name, attempts=attempt)
+
+    def fail_running(self, running):
+        for task_id, attempt in running.values():
+            self.attempt(task_id, attempt).update(
+                status='failed',
+                error='Worker process pool broke while the task was running',
+                finished_at=timezone.now(),
+            )
@@ -0,0 +1,59 @@
+import re
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from labeling.synthetic import RENDER_WORKERS, SYNTHETIC_BATCH_SIZE, seed_synthetic
+
+
+class Command(BaseCommand):
+    help = 'Generate projects, label categories, image files and annotations for load and query testing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--owner', default='synthetic', help='Username owning the projects (created if missing).')
+        parser.add_argument('--password', help='Password to set on the owner, e.g. for logging in to a load test.')
+        parser.add_argument('--projects', type=int, default=1, help='Number of projects.')
+        parser.add_argument('--datasets', type=int, default=1, help='Datasets per project.')
+        parser.add_argument('--images', type=int, default=1000, help='Images per dataset.')
+        parser.add_argument('--annotations', type=int, default=10, help='Average annotations per image.')
+        parser.add_argument('--labels', type=int, default=10, help='Label categories per project.')
+        parser.add_argument('--image-size', default='1280x720', help='Image dimensions as WIDTHxHEIGHT.')
+        parser.add_argument(
+            '--no-files', action='store_true',
+            help='Only create database rows; image files are not written.'
+        )
+        parser.add_argument('--batch-size', type=int, default=SYNTHETIC_BATCH_SIZE, help='Images inserted at a time.')
+        parser.add_argument('--workers', type=int, default=RENDER_WORKERS, help='Threads rendering image files.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed; the same seed gives the same data.')
+
+    def handle(self, *args, **options):
+        match = re.fullmatch(r'(\d+)x(\d+)', options['image_size'])
+        if not match or not all(int(value) > 0 for value in match.groups()):
+            raise CommandError('--image-size must look like 1280x720.')
+        if options['labels'] < 1:
+            raise CommandError('--labels must be at least 1.')
+
+        owner, created = User.objects.get_or_create(username=options['owner'])
+        if options['password']:
+            owner.set_password(options['password'])
+            owner.save()
+        elif created:
+            owner.set_unusable_password()
+            owner.save()
+
+        for dataset, done, total in seed_synthetic(
+            owner,
+            projects=options['projects'],
+            datasets=options['datasets'],
+            images=options['images'],
+            labels=options['labels'],
+            seed=options['seed'],
+            annotations_per_image=max(0, options['annotations']),
+            image_size=tuple(int(value) for value in match.groups()),
+            write_files=not options['no_files'],
+            batch_size=max(1, options['batch_size']),
+            workers=max(1, options['workers']),
+        ):
+            self.stdout.write(f'{dataset}: {done}/{total} images')
+
+        self.stdout.write(self.style.SUCCESS(f'Done: data owned by {owner.username}'))
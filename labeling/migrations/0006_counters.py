@@ -0,0 +1,77 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:03
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def _count(queryset, field, distinct=False):
+    return Coalesce(
+        Subquery(
+            queryset.order_by().values(field).annotate(n=Count('pk', distinct=distinct)).values('n'),
+            output_field=IntegerField(),
+        ),
+        Value(0),
+    )
+
+
+def backfill_counters(apps, schema_editor):
+    Project = apps.get_model('labeling', 'Project')
+    LabelCategory = apps.get_model('labeling', 'LabelCategory')
+    Dataset = apps.get_model('labeling', 'Dataset')
+    Image = apps.get_model('labeling', 'Image')
+    Annotation = apps.get_model('labeling', 'Annotation')
+
+    Image.objects.update(annotation_count=_count(Annotation.objects.filter(image_id=OuterRef('pk')), 'image_id'))
+    Image.objects.update(is_annotated=Q(annotation_count__gt=0))
+    images = Image.objects.filter(dataset_id=OuterRef('pk'))
+    Dataset.objects.update(
+        image_count=_count(images, 'dataset_id'),
+        annotated_count=_count(images.filter(annotations__isnull=False), 'dataset_id', distinct=True),
+        annotation_count=_count(Annotation.objects.filter(image__dataset_id=OuterRef('pk')), 'image__dataset_id'),
+    )
+    LabelCategory.objects.update(
+        annotation_count=_count(Annotation.objects.filter(label_category_id=OuterRef('pk')), 'label_category_id')
+    )
+    Project.objects.update(dataset_count=_count(Dataset.objects.filter(project_id=OuterRef('pk')), 'project_id'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labeling', '0005_image_hashes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset',
+            name='annotated_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='dataset',
+            name='annotation_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='dataset',
+            name='image_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='annotation_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='labelcategory',
+            name='annotation_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='dataset_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:06
+
+import django.db.models.deletion
+import labeling.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labeling', '0006_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='annotation',
+            index=models.Index(fields=['image', 'created_at', 'id'], name='labeling_ann_image_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='annotation',
+            index=models.Index(condition=models.Q(('annotation_type', 'bbox')), fields=['image', 'created_at', 'id'], name='labeling_ann_image_bbox_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='annotation',
+            index=models.Index(fields=['video', 'frame_number'], name='labeling_ann_video_frame_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=labeling.models.NullsFirstIndex(fields=['dataset', 'sequence_number', 'filename', 'id'], name='labeling_image_keyset_idx', nulls_first=('sequence_number',)),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=labeling.models.NullsFirstIndex(condition=models.Q(('is_annotated', False)), fields=['dataset', 'sequence_number', 'filename', 'id'], name='labeling_image_todo_idx', nulls_first=('sequence_number',)),
+        ),
+        # Dropped only once the composite indexes that cover them exist
+        migrations.AlterField(
+            model_name='annotation',
+            name='image',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='annotations', to='labeling.image'),
+        ),
+        migrations.AlterField(
+            model_name='annotation',
+            name='video',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='annotations', to='labeling.video'),
+        ),
+    ]
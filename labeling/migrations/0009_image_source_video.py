@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labeling', '0008_video_frames'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='source_frame',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='source_video',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='extracted_images', to='labeling.video'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:24
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labeling', '0009_image_source_video'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Track',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('keyframe_data', models.BinaryField()),
+                ('start_frame', models.IntegerField(editable=False)),
+                ('end_frame', models.IntegerField(editable=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('annotator', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('label_category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tracks', to='labeling.labelcategory')),
+                ('video', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='tracks', to='labeling.video')),
+            ],
+            options={
+                'ordering': ['start_frame', 'created_at'],
+                'indexes': [models.Index(fields=['video', 'start_frame', 'end_frame'], name='labeling_track_frames_idx')],
+            },
+        ),
+    ]
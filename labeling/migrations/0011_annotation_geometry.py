@@ -0,0 +1,91 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:40
+
+import struct
+
+from django.db import migrations, models
+
+# The packed layouts of labeling.geometry as of this migration
+MASK_SIZE = struct.Struct('<II')
+
+
+def _pack(value):
+    if isinstance(value, dict):
+        height, width = value['size']
+        return b'R' + MASK_SIZE.pack(height, width) + struct.pack(f"<{len(value['counts'])}I", *value['counts'])
+    if value and not isinstance(value[0], (list, tuple)):
+        # A flat [x0, y0, x1, y1, ...] list
+        if len(value) % 2:
+            raise ValueError('odd number of coordinates')
+        value = [value[i:i + 2] for i in range(0, len(value), 2)]
+    if any(len(point) != 2 for point in value):
+        # Anything besides x and y would be lost
+        raise ValueError('points must be [x, y]')
+    coordinates = [float(number) for point in value for number in point]
+    return b'P' + struct.pack(f'<{len(coordinates)}f', *coordinates)
+
+
+def _unpack(data):
+    data = bytes(data)
+    if data[:1] == b'R':
+        height, width = MASK_SIZE.unpack_from(data, 1)
+        counts = data[1 + MASK_SIZE.size:]
+        return {'size': [height, width], 'counts': list(struct.unpack(f'<{len(counts) // 4}I', counts))}
+    values = [round(value, 3) for value in struct.unpack(f'<{(len(data) - 1) // 4}f', data[1:])]
+    return [values[i:i + 2] for i in range(0, len(values), 2)]
+
+
+def pack_points(apps, schema_editor):
+    Annotation = apps.get_model('labeling', 'Annotation')
+    annotations = Annotation.objects.exclude(points=None).only('id', 'points')
+    batch = []
+    failed = []
+    for annotation in annotations.iterator(chunk_size=1000):
+        try:
+            annotation.geometry = _pack(annotation.points)
+        except (KeyError, TypeError, ValueError, IndexError, OverflowError, struct.error):
+            failed.append(str(annotation.pk))
+            continue
+        batch.append(annotation)
+        if len(batch) == 1000:
+            Annotation.objects.bulk_update(batch, ['geometry'])
+            batch = []
+    if failed:
+        # The points column is dropped next; stop rather than lose them
+        raise ValueError(
+            f'The points of {len(failed)} annotations are not a polygon, keypoint list or mask and cannot be '
+            'converted. Correct or delete these annotations, then migrate again:\n' + '\n'.join(failed)
+        )
+    Annotation.objects.bulk_update(batch, ['geometry'])
+
+
+def unpack_points(apps, schema_editor):
+    Annotation = apps.get_model('labeling', 'Annotation')
+    annotations = Annotation.objects.exclude(geometry=None).only('id', 'geometry')
+    batch = []
+    for annotation in annotations.iterator(chunk_size=1000):
+        annotation.points = _unpack(annotation.geometry)
+        batch.append(annotation)
+        if len(batch) == 1000:
+            Annotation.objects.bulk_update(batch, ['points'])
+            batch = []
+    Annotation.objects.bulk_update(batch, ['points'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labeling', '0010_track'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='annotation',
+            name='geometry',
+            field=models.BinaryField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(pack_points, unpack_points),
+        migrations.RemoveField(
+            model_name='annotation',
+            name='points',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labeling', '0011_annotation_geometry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='annotation_revision',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:37
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_datasets(apps, schema_editor):
+    Annotation = apps.get_model('labeling', 'Annotation')
+    Image = apps.get_model('labeling', 'Image')
+    Video = apps.get_model('labeling', 'Video')
+    Dataset = apps.get_model('labeling', 'Dataset')
+
+    Annotation.objects.filter(image__isnull=False).update(
+        dataset=Subquery(Image.objects.filter(pk=OuterRef('image_id')).values('dataset_id'))
+    )
+    Annotation.objects.filter(image__isnull=True, video__isnull=False).update(
+        dataset=Subquery(Video.objects.filter(pk=OuterRef('video_id')).values('dataset_id'))
+    )
+    # Existing annotations all count as changed at their dataset's current revision
+    Annotation.objects.filter(dataset__isnull=False).update(
+        revision=Subquery(Dataset.objects.filter(pk=OuterRef('dataset_id')).order_by().values('revision'))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('labeling', '0012_image_annotation_revision'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnnotationTombstone',
+            fields=[
+                ('id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('revision', models.PositiveBigIntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='annotation',
+            name='dataset',
+            field=models.ForeignKey(blank=True, db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='annotations', to='labeling.dataset'),
+        ),
+        migrations.AddField(
+            model_name='annotation',
+            name='revision',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_datasets, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='annotation',
+            index=models.Index(fields=['dataset', 'revision', 'id'], name='labeling_ann_changes_idx'),
+        ),
+        migrations.AddField(
+            model_name='annotationtombstone',
+            name='dataset',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='annotation_tombstones', to='labeling.dataset'),
+        ),
+        migrations.AddIndex(
+            model_name='annotationtombstone',
+            index=models.Index(fields=['dataset', 'revision', 'id'], name='labeling_tombstone_changes_idx'),
+        ),
+    ]
@@ -1,9 +1,13 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.core.validators import FileExtensionValidator
+from collections import defaultdict
 import uuid
 import os
 
+from .geometry import pack_geometry, unpack_geometry
+from .tracks import interpolate, pack_keyframes, unpack_keyframes
+
 
 def upload_to_images(instance, filename):
     return os.path.join('images', str(instance.dataset.id), filename)
@@ -13,11 +17,175 @@ def upload_to_videos(instance, filename):
     return os.path.join('videos', str(instance.dataset.id), filename)
 
 
-class Project(models.Model):
+class NullsFirstIndex(models.Index):
+    """
+    Index whose ``nulls_first`` columns sort NULLs first, to back orderings
+    like ``F('sequence_number').asc(nulls_first=True)``. PostgreSQL puts
+    NULLs last in ascending indexes unless told otherwise; SQLite already
+    sorts them first and rejects the clause, so it is only emitted there.
+    """
+
+    def __init__(self, *args, nulls_first=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.nulls_first = tuple(nulls_first)
+
+    def deconstruct(self):
+        path, args, kwargs = super().deconstruct()
+        kwargs['nulls_first'] = self.nulls_first
+        return path, args, kwargs
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        if schema_editor.connection.vendor != 'postgresql':
+            return super().create_sql(model, schema_editor, using=using, **kwargs)
+        index = self.clone()
+        index.fields_orders = [
+            (field, f"{order or 'ASC'} NULLS FIRST" if field in self.nulls_first else order)
+            for field, order in self.fields_orders
+        ]
+        return super(NullsFirstIndex, index).create_sql(model, schema_editor, using=using, **kwargs)
+
+
+def touch_datasets(**lookup):
+    """Advance the revision of every dataset matching ``lookup``."""
+    Dataset.objects.filter(**lookup).update(revision=models.F('revision') + 1)
+
+
+def touch_images(**lookup):
+    """Advance the annotation revision of every image matching ``lookup``."""
+    Image.objects.filter(**lookup).update(annotation_revision=models.F('annotation_revision') + 1)
+
+
+def _dataset_revision(dataset_id):
+    return models.Subquery(Dataset.objects.filter(pk=dataset_id).order_by().values('revision'))
+
+
+def stamp_annotations(**lookup):
+    """
+    Record on the annotations matching ``lookup`` that they changed at
+    their dataset's current revision. Call in the same transaction as, and
+    after, advancing that revision: the advance locks the dataset row until
+    commit, so revisions become visible to ``annotation_changes`` in order.
+    """
+    Annotation.objects.filter(**lookup).update(revision=_dataset_revision(models.OuterRef('dataset_id')))
+
+
+def bury_annotations(annotations):
+    """
+    Leave tombstones for deleted ``(annotation id, dataset id)`` pairs at
+    their dataset's current revision; see ``stamp_annotations``.
+    """
+    AnnotationTombstone.objects.bulk_create([
+        AnnotationTombstone(id=annotation_id, dataset_id=dataset_id, revision=_dataset_revision(dataset_id))
+        for annotation_id, dataset_id in annotations if dataset_id
+    ], ignore_conflicts=True)
+
+
+def count_new_images(dataset_id, count):
+    """Add ``count`` freshly inserted images to a dataset's counter and advance its revision."""
+    Dataset.objects.filter(pk=dataset_id).update(
+        image_count=models.F('image_count') + count,
+        revision=models.F('revision') + 1,
+    )
+
+
+def _group_by_delta(deltas):
+    groups = defaultdict(list)
+    for key, delta in deltas.items():
+        if delta:
+            groups[delta].append(key)
+    return groups.items()
+
+
+def _normalize_deltas(deltas):
+    """Sum ``deltas`` by UUID, so string and UUID keys for one row add up."""
+    normalized = defaultdict(int)
+    for key, delta in (deltas or {}).items():
+        normalized[uuid.UUID(str(key))] += delta
+    return {key: delta for key, delta in normalized.items() if delta}
+
+
+def update_annotation_counters(image_deltas=None, label_deltas=None):
+    """
+    Apply changes in annotation counts to the denormalized counters.
+
+    ``image_deltas`` maps image ids and ``label_deltas`` label ids to the
+    number of annotations added (or removed, if negative). Images also get
+    ``is_annotated`` refreshed and their annotation revision advanced, and
+    their datasets get their counters adjusted and their revision advanced. Rows that change by the same
+    amount share one UPDATE, so cost follows the number of distinct
+    changes rather than the number of rows.
+    """
+    image_deltas = _normalize_deltas(image_deltas)
+    label_deltas = _normalize_deltas(label_deltas)
+
+    with transaction.atomic():
+        if image_deltas:
+            image_groups = defaultdict(list)
+            dataset_deltas = defaultdict(lambda: [0, 0])
+            rows = (
+                Image.objects.select_for_update().filter(pk__in=image_deltas)
+                .order_by().values_list('id', 'dataset_id', 'annotation_count')
+            )
+            for image_id, dataset_id, count in rows:
+                delta = image_deltas[image_id]
+                annotated = count + delta > 0
+                image_groups[(delta, annotated)].append(image_id)
+                dataset_deltas[dataset_id][0] += delta
+                dataset_deltas[dataset_id][1] += annotated - (count > 0)
+
+            for (delta, annotated), ids in image_groups.items():
+                Image.objects.filter(pk__in=ids).update(
+                    annotation_count=models.F('annotation_count') + delta,
+                    is_annotated=annotated,
+                    annotation_revision=models.F('annotation_revision') + 1,
+                )
+            dataset_groups = defaultdict(list)
+            for dataset_id, change in dataset_deltas.items():
+                dataset_groups[tuple(change)].append(dataset_id)
+            for (annotations, annotated), ids in dataset_groups.items():
+                Dataset.objects.filter(pk__in=ids).update(
+                    annotation_count=models.F('annotation_count') + annotations,
+                    annotated_count=models.F('annotated_count') + annotated,
+                    revision=models.F('revision') + 1,
+                )
+
+        for delta, ids in _group_by_delta(label_deltas):
+            LabelCategory.objects.filter(pk__in=ids).update(annotation_count=models.F('annotation_count') + delta)
+
+
+def _label_counts(annotations):
+    """Annotations in ``annotations`` per label id, for decrementing before a cascade."""
+    return dict(
+        annotations.order_by().values('label_category').annotate(n=models.Count('id')).values_list('label_category', 'n')
+    )
+
+
+class CounterFieldsMixin:
+    """
+    Leave ``counter_fields`` out of full saves of existing rows.
+
+    Counters only move through ``UPDATE ... SET n = n + delta``, so a full
+    save from an instance loaded before such an update would write the
+    stale value back.
+    """
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None and not args:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.counter_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+class Project(CounterFieldsMixin, models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=200)
     description = models.TextField(blank=True)
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
+    dataset_count = models.PositiveIntegerField(default=0, editable=False)
+    counter_fields = ['dataset_count']
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -28,7 +196,7 @@ class Project(models.Model):
         ordering = ['-created_at']
 
 
-class LabelCategory(models.Model):
+class LabelCategory(CounterFieldsMixin, models.Model):
     ANNOTATION_TYPES = [
         ('bbox', 'Bounding Box'),
         ('polygon', 'Polygon'),
@@ -42,8 +210,35 @@ class LabelCategory(models.Model):
     name = models.CharField(max_length=100)
     color = models.CharField(max_length=7, default='#FF0000')
     annotation_type = models.CharField(max_length=20, choices=ANNOTATION_TYPES, default='bbox')
+    annotation_count = models.PositiveIntegerField(default=0, editable=False)
+    counter_fields = ['annotation_count']
     created_at = models.DateTimeField(auto_now_add=True)
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            touch_datasets(project_id=self.project_id)
+            if not adding:
+                # Annotation payloads carry the label's name and colour
+                touch_images(annotations__label_category=self)
+                stamp_annotations(label_category=self)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            # The cascade removes this label's annotations from their images
+            image_deltas = {
+                image_id: -count for image_id, count in
+                Annotation.objects.filter(label_category=self, image__isnull=False).order_by()
+                .values('image').annotate(n=models.Count('id')).values_list('image', 'n')
+            }
+            deleted = list(self.annotation_set.values_list('id', 'dataset_id'))
+            result = super().delete(*args, **kwargs)
+            update_annotation_counters(image_deltas)
+            touch_datasets(project_id=self.project_id)
+            bury_annotations(deleted)
+        return result
+
     def __str__(self):
         return f"{self.project.name} - {self.name}"
 
@@ -52,7 +247,7 @@ class LabelCategory(models.Model):
         ordering = ['name']
 
 
-class Dataset(models.Model):
+class Dataset(CounterFieldsMixin, models.Model):
     DATASET_TYPES = [
         ('image', 'Image Dataset'),
         ('video', 'Video Dataset'),
@@ -64,9 +259,33 @@ class Dataset(models.Model):
     name = models.CharField(max_length=200)
     description = models.TextField(blank=True)
     dataset_type = models.CharField(max_length=20, choices=DATASET_TYPES, default='image')
+    # Moves on every image, annotation or label change; keys cached exports
+    revision = models.PositiveBigIntegerField(default=0, editable=False)
+    # Maintained alongside image and annotation writes; `manage.py recount` repairs them
+    image_count = models.PositiveIntegerField(default=0, editable=False)
+    annotated_count = models.PositiveIntegerField(default=0, editable=False)
+    annotation_count = models.PositiveIntegerField(default=0, editable=False)
+    counter_fields = ['revision', 'image_count', 'annotated_count', 'annotation_count']
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                Project.objects.filter(pk=self.project_id).update(dataset_count=models.F('dataset_count') + 1)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            labels = _label_counts(
+                Annotation.objects.filter(models.Q(image__dataset=self) | models.Q(video__dataset=self))
+            )
+            result = super().delete(*args, **kwargs)
+            Project.objects.filter(pk=self.project_id).update(dataset_count=models.F('dataset_count') - 1)
+            update_annotation_counters(label_deltas={label_id: -count for label_id, count in labels.items()})
+        return result
+
     def __str__(self):
         return f"{self.project.name} - {self.name}"
 
@@ -74,7 +293,7 @@ class Dataset(models.Model):
         ordering = ['-created_at']
 
 
-class Image(models.Model):
+class Image(CounterFieldsMixin, models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, related_name='images')
     file = models.ImageField(
@@ -88,12 +307,46 @@ class Image(models.Model):
     sequence_number = models.IntegerField(null=True, blank=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
     is_annotated = models.BooleanField(default=False)
+    annotation_count = models.PositiveIntegerField(default=0, editable=False)
+    # Advanced by every write to the image's annotations; versions its cached annotation payloads
+    annotation_revision = models.PositiveBigIntegerField(default=0, editable=False)
+    counter_fields = ['annotation_count', 'is_annotated', 'annotation_revision']
+    # SHA-256 of the file and 64-bit difference hash of the pixels; see labeling.dedup
+    content_hash = models.CharField(max_length=64, blank=True, editable=False)
+    perceptual_hash = models.BigIntegerField(null=True, blank=True, editable=False)
+    # Set on frames extracted from a video; see labeling.extraction
+    source_video = models.ForeignKey(
+        'Video', on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='extracted_images'
+    )
+    source_frame = models.IntegerField(null=True, blank=True, editable=False)
 
     def save(self, *args, **kwargs):
+        adding = self._state.adding
         if self.file:
             self.filename = os.path.basename(self.file.name)
             self.size = self.file.size
-        super().save(*args, **kwargs)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                count_new_images(self.dataset_id, 1)
+            else:
+                touch_datasets(pk=self.dataset_id)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            labels = _label_counts(self.annotations.all())
+            count = sum(labels.values())
+            deleted = list(self.annotations.values_list('id', 'dataset_id')) if count else []
+            result = super().delete(*args, **kwargs)
+            Dataset.objects.filter(pk=self.dataset_id).update(
+                image_count=models.F('image_count') - 1,
+                annotated_count=models.F('annotated_count') - (1 if count else 0),
+                annotation_count=models.F('annotation_count') - count,
+                revision=models.F('revision') + 1,
+            )
+            update_annotation_counters(label_deltas={label_id: -n for label_id, n in labels.items()})
+            bury_annotations(deleted)
+        return result
 
     def __str__(self):
         return f"{self.dataset.name} - {self.filename}"
@@ -101,6 +354,23 @@ class Image(models.Model):
     class Meta:
         ordering = ['sequence_number', 'filename']
         unique_together = ['dataset', 'filename']
+        indexes = [
+            models.Index(fields=['dataset', 'content_hash'], name='labeling_image_content_idx'),
+            models.Index(fields=['dataset', 'perceptual_hash'], name='labeling_image_phash_idx'),
+            # Keyset pagination (IMAGE_KEYSET_ORDERING) within a dataset, and
+            # the same walk restricted to images still to be annotated
+            NullsFirstIndex(
+                fields=['dataset', 'sequence_number', 'filename', 'id'],
+                nulls_first=['sequence_number'],
+                name='labeling_image_keyset_idx',
+            ),
+            NullsFirstIndex(
+                fields=['dataset', 'sequence_number', 'filename', 'id'],
+                nulls_first=['sequence_number'],
+                condition=models.Q(is_annotated=False),
+                name='labeling_image_todo_idx',
+            ),
+        ]
 
 
 class Video(models.Model):
@@ -115,6 +385,9 @@ class Video(models.Model):
     fps = models.FloatField(null=True, blank=True)
     width = models.IntegerField(null=True, blank=True)
     height = models.IntegerField(null=True, blank=True)
+    frame_count = models.IntegerField(null=True, blank=True)
+    # [frame_number, seconds] of every keyframe, filled in by labeling.frames.index_video
+    keyframes = models.JSONField(default=list, blank=True, editable=False)
     size = models.BigIntegerField()
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
@@ -124,6 +397,17 @@ class Video(models.Model):
             self.size = self.file.size
         super().save(*args, **kwargs)
 
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            labels = _label_counts(self.annotations.all())
+            deleted = list(self.annotations.values_list('id', 'dataset_id')) if labels else []
+            result = super().delete(*args, **kwargs)
+            update_annotation_counters(label_deltas={label_id: -count for label_id, count in labels.items()})
+            if deleted:
+                touch_datasets(pk=self.dataset_id)
+                bury_annotations(deleted)
+        return result
+
     def __str__(self):
         return f"{self.dataset.name} - {self.filename}"
 
@@ -141,10 +425,22 @@ class Annotation(models.Model):
     ]
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    image = models.ForeignKey(Image, on_delete=models.CASCADE, related_name='annotations', null=True, blank=True)
-    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='annotations', null=True, blank=True)
+    # Looked up through the composite indexes in Meta rather than plain FK indexes
+    image = models.ForeignKey(
+        Image, on_delete=models.CASCADE, related_name='annotations', null=True, blank=True, db_index=False
+    )
+    video = models.ForeignKey(
+        Video, on_delete=models.CASCADE, related_name='annotations', null=True, blank=True, db_index=False
+    )
     frame_number = models.IntegerField(null=True, blank=True)
     timestamp = models.FloatField(null=True, blank=True)
+    # The image's or video's dataset, so changes can be read per dataset (labeling_ann_changes_idx)
+    dataset = models.ForeignKey(
+        Dataset, on_delete=models.CASCADE, related_name='annotations', null=True, blank=True,
+        editable=False, db_index=False
+    )
+    # The dataset revision this annotation last changed at; see stamp_annotations
+    revision = models.PositiveBigIntegerField(default=0, editable=False)
     
     label_category = models.ForeignKey(LabelCategory, on_delete=models.CASCADE)
     annotation_type = models.CharField(max_length=20, choices=ANNOTATION_TYPES)
@@ -155,8 +451,8 @@ class Annotation(models.Model):
     width = models.FloatField(null=True, blank=True)
     height = models.FloatField(null=True, blank=True)
     
-    # Polygon/segmentation points stored as JSON
-    points = models.JSONField(null=True, blank=True)
+    # Polygon, keypoint or mask geometry, packed (see labeling.geometry); read and written through ``points``
+    geometry = models.BinaryField(null=True, blank=True, editable=False)
     
     # Additional metadata
     confidence = models.FloatField(null=True, blank=True)
@@ -166,12 +462,144 @@ class Annotation(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remembered so a label change can move the label usage counts
+        instance._loaded_label_category_id = instance.__dict__.get('label_category_id')
+        return instance
+
+    @property
+    def points(self):
+        """``[[x, y], ...]`` points or an RLE mask dict, or None."""
+        return unpack_geometry(self.geometry)
+
+    @points.setter
+    def points(self, value):
+        self.geometry = pack_geometry(value)
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        previous_label_id = getattr(self, '_loaded_label_category_id', self.label_category_id)
+        if self.dataset_id is None and (self.image_id or self.video_id):
+            self.dataset_id = (self.image if self.image_id else self.video).dataset_id
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                update_annotation_counters({self.image_id: 1} if self.image_id else None, {self.label_category_id: 1})
+            elif previous_label_id != self.label_category_id:
+                update_annotation_counters(label_deltas={previous_label_id: -1, self.label_category_id: 1})
+            if not (adding and self.image_id):
+                self.touch_revisions()
+            stamp_annotations(pk=self.pk)
+        self._loaded_label_category_id = self.label_category_id
+
+    def delete(self, *args, **kwargs):
+        pk = self.pk
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            update_annotation_counters({self.image_id: -1} if self.image_id else None, {self.label_category_id: -1})
+            if not self.image_id:
+                self.touch_revisions()
+            bury_annotations([(pk, self.dataset_id)])
+        return result
+
+    def touch_revisions(self):
+        if self.image_id:
+            touch_images(pk=self.image_id)
+        if self.dataset_id:
+            touch_datasets(pk=self.dataset_id)
+
     def __str__(self):
         target = self.image.filename if self.image else f"{self.video.filename}:{self.frame_number}"
         return f"{target} - {self.label_category.name}"
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # An image's annotations newest first (the default ordering, read
+            # backwards) and in export order (image, created_at, id)
+            models.Index(fields=['image', 'created_at', 'id'], name='labeling_ann_image_idx'),
+            # Boxes for dataset pages and YOLO export skip other annotation types
+            models.Index(
+                fields=['image', 'created_at', 'id'],
+                condition=models.Q(annotation_type='bbox'),
+                name='labeling_ann_image_bbox_idx',
+            ),
+            models.Index(fields=['video', 'frame_number'], name='labeling_ann_video_frame_idx'),
+            # Changes to a dataset in sync order (see AnnotationChangesView)
+            models.Index(fields=['dataset', 'revision', 'id'], name='labeling_ann_changes_idx'),
+        ]
+
+
+class AnnotationTombstone(models.Model):
+    """
+    Left behind by a deleted annotation, so that clients syncing a
+    dataset's changes learn of the deletion.
+    """
+    # The deleted annotation's id
+    id = models.UUIDField(primary_key=True, editable=False)
+    # Looked up through labeling_tombstone_changes_idx rather than a plain FK index
+    dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, related_name='annotation_tombstones', db_index=False)
+    revision = models.PositiveBigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['dataset', 'revision', 'id'], name='labeling_tombstone_changes_idx'),
+        ]
+
+
+class Track(models.Model):
+    """
+    One object followed through a video: its label once, and its box at
+    keyframes only, packed into ``keyframe_data`` (see labeling.tracks).
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    # Looked up through labeling_track_frames_idx rather than a plain FK index
+    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='tracks', db_index=False)
+    label_category = models.ForeignKey(LabelCategory, on_delete=models.CASCADE, related_name='tracks')
+    keyframe_data = models.BinaryField(editable=False)
+    # First and last keyframe, so the tracks present at a frame can be found without unpacking
+    start_frame = models.IntegerField(editable=False)
+    end_frame = models.IntegerField(editable=False)
+    annotator = models.ForeignKey(User, on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def keyframes(self):
+        return unpack_keyframes(self.keyframe_data)
+
+    @keyframes.setter
+    def keyframes(self, keyframes):
+        self.keyframe_data = pack_keyframes(keyframes)
+        self.start_frame = keyframes[0][0]
+        self.end_frame = keyframes[-1][0]
+
+    def boxes(self, frames=None):
+        """Interpolated ``(frame, x, y, width, height)`` for ``frames``, or every frame the object is visible in."""
+        return interpolate(self.keyframes, frames)
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            touch_datasets(videos=self.video_id)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            touch_datasets(videos=self.video_id)
+        return result
+
+    def __str__(self):
+        return f"{self.video.filename}:{self.start_frame}-{self.end_frame} - {self.label_category.name}"
+
+    class Meta:
+        ordering = ['start_frame', 'created_at']
+        indexes = [
+            models.Index(fields=['video', 'start_frame', 'end_frame'], name='labeling_track_frames_idx'),
+        ]
 
 
 class AnnotationSession(models.Model):
@@ -187,3 +615,67 @@ class AnnotationSession(models.Model):
 
     class Meta:
         ordering = ['-start_time']
+
+
+class Task(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    progress = models.FloatField(default=0)
+    message = models.CharField(max_length=255, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='tasks')
+    worker = models.CharField(max_length=255, blank=True)
+    attempts = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Renewed while the task runs; a running task whose lease lapses is reclaimed
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.kind} ({self.get_status_display()})"
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='labeling_task_queue_idx'),
+        ]
+
+
+class UploadSession(models.Model):
+    KIND_CHOICES = [
+        ('image', 'Image'),
+        ('video', 'Video'),
+    ]
+    STATUS_CHOICES = [
+        ('uploading', 'Uploading'),
+        ('completed', 'Completed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, related_name='upload_sessions')
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, default='image')
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='uploading')
+    image = models.ForeignKey(Image, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    video = models.ForeignKey(Video, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.get_status_display()})"
+
+    class Meta:
+        ordering = ['-created_at']
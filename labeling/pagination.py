@@ -0,0 +1,118 @@
+import base64
+import json
+import uuid
+
+from django.db.models import F, Q
+
+
+IMAGE_KEYSET_ORDERING = (
+    F('sequence_number').asc(nulls_first=True),
+    F('filename').asc(),
+    F('id').asc(),
+)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    """Encode a keyset position as an opaque URL-safe token."""
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(f'Malformed cursor: {e}')
+    if not isinstance(values, list):
+        raise InvalidCursor('Malformed cursor')
+    return values
+
+
+def image_cursor(image):
+    """Cursor pointing just after ``image`` (a model instance or values() dict)."""
+    if isinstance(image, dict):
+        return encode_cursor([image['sequence_number'], image['filename'], str(image['id'])])
+    return encode_cursor([image.sequence_number, image.filename, str(image.id)])
+
+
+def images_after(queryset, token):
+    """
+    Restrict ``queryset`` to rows strictly after ``token`` in
+    (sequence_number NULLS FIRST, filename, id) order.
+
+    Seeking instead of OFFSET keeps every page a bounded index range scan,
+    however deep into the dataset the client has scrolled.
+    """
+    values = decode_cursor(token)
+    if len(values) != 3:
+        raise InvalidCursor('Malformed cursor')
+    sequence_number, filename, image_id = values
+    try:
+        image_id = uuid.UUID(str(image_id))
+    except ValueError:
+        raise InvalidCursor('Malformed cursor')
+    if sequence_number is not None and not isinstance(sequence_number, int):
+        raise InvalidCursor('Malformed cursor')
+
+    tail = Q(filename__gt=filename) | Q(filename=filename, id__gt=image_id)
+    if sequence_number is None:
+        condition = Q(sequence_number__isnull=True) & tail | Q(sequence_number__isnull=False)
+    else:
+        condition = (
+            Q(sequence_number__gt=sequence_number)
+            | Q(sequence_number=sequence_number) & tail
+        )
+    return queryset.filter(condition)
+
+
+def iter_image_chunks(queryset, fields, chunk_size=1000):
+    """
+    Walk ``queryset`` in keyset order, yielding lists of ``values()`` dicts.
+
+    Each chunk is a separate bounded query, so callers can join per-chunk
+    data (annotations, counts) without holding the whole dataset in memory.
+    """
+    fields = tuple(dict.fromkeys(tuple(fields) + ('id', 'sequence_number', 'filename')))
+    ordered = queryset.order_by(*IMAGE_KEYSET_ORDERING)
+    cursor = None
+    while True:
+        page = ordered if cursor is None else images_after(ordered, cursor)
+        rows = list(page.values(*fields)[:chunk_size])
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        cursor = image_cursor(rows[-1])
+
+
+def change_cursor(revision, pk):
+    """Cursor pointing just after the change to ``pk`` at ``revision``."""
+    return encode_cursor([revision, str(pk)])
+
+
+def decode_change_cursor(token):
+    """``(revision, id)`` of a ``change_cursor`` token."""
+    values = decode_cursor(token)
+    if len(values) != 2 or not isinstance(values[0], int):
+        raise InvalidCursor('Malformed cursor')
+    try:
+        return values[0], uuid.UUID(str(values[1]))
+    except ValueError:
+        raise InvalidCursor('Malformed cursor')
+
+
+def changes_after(queryset, revision, pk=None):
+    """
+    Restrict ``queryset`` (annotations or tombstones) to rows strictly after
+    ``(revision, pk)`` in (revision, id) order, or after ``revision`` when
+    ``pk`` is None.
+    """
+    if pk is None:
+        return queryset.filter(revision__gt=revision)
+    return queryset.filter(Q(revision__gt=revision) | Q(revision=revision, id__gt=pk))
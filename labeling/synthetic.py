@@ -0,0 +1,179 @@
+"""
+Synthetic projects for sizing hardware and load testing.
+
+``seed_synthetic`` fills projects with label categories, image files and
+annotations at whatever scale is asked for. Each image is drawn with its
+annotations as filled boxes on a plain background, so files are valid,
+distinct (and so pass duplicate detection) and match their labels. Rows
+are inserted with ``bulk_create`` a batch at a time, keeping the
+denormalized counters in step, and a fixed random seed makes runs
+repeatable.
+"""
+import io
+import random
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image as PILImage, ImageDraw
+
+from .dedup import content_hash, perceptual_hash
+from .models import (
+    Annotation, Dataset, Image, LabelCategory, Project, count_new_images, stamp_annotations,
+    update_annotation_counters
+)
+
+
+SYNTHETIC_BATCH_SIZE = 1000
+RENDER_WORKERS = 8
+LABEL_NAMES = [
+    'car', 'person', 'bicycle', 'truck', 'bus', 'motorcycle', 'traffic light', 'stop sign',
+    'dog', 'cat', 'bird', 'tree', 'building', 'sign', 'pole', 'bench',
+]
+# Share of annotations that are polygons; the rest are bounding boxes
+POLYGON_RATIO = 0.2
+
+
+def _color(rng):
+    return '#%02x%02x%02x' % (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+
+
+def _plan_annotations(rng, width, height, labels, mean_annotations):
+    """Random boxes and polygons for one image, as ``(label, type, x, y, w, h, points)``."""
+    annotations = []
+    for _ in range(rng.randint(0, 2 * mean_annotations)):
+        w = rng.uniform(0.05, 0.4) * width
+        h = rng.uniform(0.05, 0.4) * height
+        x = rng.uniform(0, width - w)
+        y = rng.uniform(0, height - h)
+        label = rng.choice(labels)
+        if rng.random() < POLYGON_RATIO:
+            points = [[x, y], [x + w, y + h * rng.random()], [x + w * rng.random(), y + h]]
+            annotations.append((label, 'polygon', None, None, None, None, points))
+        else:
+            annotations.append((label, 'bbox', x, y, w, h, None))
+    return annotations
+
+
+def render_image(width, height, background, annotations, colors):
+    """Encode a JPEG showing ``annotations``; returns ``(bytes, content hash, perceptual hash)``."""
+    img = PILImage.new('RGB', (width, height), background)
+    draw = ImageDraw.Draw(img)
+    for label, annotation_type, x, y, w, h, points in annotations:
+        if annotation_type == 'bbox':
+            draw.rectangle([x, y, x + w, y + h], fill=colors[label.pk])
+        else:
+            draw.polygon([tuple(point) for point in points], fill=colors[label.pk])
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=85)
+    data = buffer.getvalue()
+    return data, content_hash(io.BytesIO(data)), perceptual_hash(img)
+
+
+def _store_image(name, width, height, background, annotations, colors):
+    data, digest, phash = render_image(width, height, background, annotations, colors)
+    return default_storage.save(name, ContentFile(data)), len(data), digest, phash
+
+
+def create_labels(project, count, rng):
+    names = LABEL_NAMES[:count] + [f'class-{i}' for i in range(len(LABEL_NAMES), count)]
+    return LabelCategory.objects.bulk_create([
+        LabelCategory(project=project, name=name, color=_color(rng), annotation_type='bbox')
+        for name in names
+    ])
+
+
+def seed_dataset(dataset, labels, owner, images, annotations_per_image=10, image_size=(1280, 720),
+                 write_files=True, batch_size=SYNTHETIC_BATCH_SIZE, seed=0, workers=RENDER_WORKERS):
+    """
+    Add ``images`` synthetic images with about ``annotations_per_image``
+    annotations each to ``dataset``, yielding ``(done, total)`` after each
+    batch.
+
+    Without ``write_files`` only the rows are created, pointing at files
+    that do not exist; that is enough for most query and load testing and
+    much faster.
+    """
+    rng = random.Random(seed)
+    colors = {label.pk: label.color for label in labels}
+    width, height = image_size
+    upload_to = Image._meta.get_field('file')
+    # Continue numbering after earlier runs against the same dataset
+    offset = dataset.images.count()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, images, batch_size):
+            planned = []
+            for number in range(offset + start, offset + min(start + batch_size, images)):
+                image = Image(
+                    dataset=dataset,
+                    filename=f'synthetic_{number:07}.jpg',
+                    width=width,
+                    height=height,
+                    size=0,
+                    sequence_number=number if dataset.dataset_type == 'sequential' else None,
+                )
+                planned.append((
+                    image, _color(rng), _plan_annotations(rng, width, height, labels, annotations_per_image)
+                ))
+
+            if write_files:
+                futures = [
+                    pool.submit(
+                        _store_image, upload_to.generate_filename(image, image.filename),
+                        width, height, background, annotations, colors
+                    )
+                    for image, background, annotations in planned
+                ]
+                for (image, _, _), future in zip(planned, futures):
+                    image.file.name, image.size, image.content_hash, image.perceptual_hash = future.result()
+            else:
+                for image, _, _ in planned:
+                    image.file.name = upload_to.generate_filename(image, image.filename)
+
+            rows = []
+            image_deltas = Counter()
+            label_deltas = Counter()
+            for image, _, annotations in planned:
+                for label, annotation_type, x, y, w, h, points in annotations:
+                    rows.append(Annotation(
+                        image=image, dataset=dataset, label_category=label, annotation_type=annotation_type,
+                        x=x, y=y, width=w, height=h, points=points, annotator=owner,
+                    ))
+                    image_deltas[image.pk] += 1
+                    label_deltas[label.pk] += 1
+
+            with transaction.atomic():
+                Image.objects.bulk_create([image for image, _, _ in planned], batch_size=500)
+                count_new_images(dataset.pk, len(planned))
+                Annotation.objects.bulk_create(rows, batch_size=500)
+                update_annotation_counters(image_deltas, label_deltas)
+                # Rows inserted above are the only ones without a revision yet
+                stamp_annotations(dataset=dataset, revision=0)
+            yield start + len(planned), images
+
+
+def seed_synthetic(owner, projects=1, datasets=1, images=1000, labels=10, seed=0, **options):
+    """
+    Create ``projects`` projects with ``labels`` label categories and
+    ``datasets`` datasets of ``images`` images each, owned by ``owner``.
+
+    Yields ``(dataset, done, total)`` as each batch of images is inserted;
+    remaining ``options`` are passed on to ``seed_dataset``.
+    """
+    rng = random.Random(seed)
+    for p in range(projects):
+        project = Project.objects.create(
+            name=f'Synthetic {p + 1}', description='Generated by seed_synthetic', owner=owner
+        )
+        project_labels = create_labels(project, labels, rng)
+        for d in range(datasets):
+            dataset = Dataset.objects.create(
+                project=project, name=f'Synthetic {p + 1}.{d + 1}', dataset_type='sequential'
+            )
+            for done, total in seed_dataset(
+                dataset, project_labels, owner, images, seed=rng.randrange(2 ** 32), **options
+            ):
+                yield dataset, done, total
@@ -0,0 +1,237 @@
+"""
+Database-backed background tasks.
+
+Tasks are rows in ``Task``; ``manage.py runworker`` claims pending rows and
+runs their handlers in a process pool. Handlers are plain functions
+registered with ``@task('kind')`` that take the ``Task`` and a
+``report(progress, message='')`` callback and return a JSON-serializable
+result. No broker is involved, so this works on SQLite and PostgreSQL.
+
+A running task holds a lease that its worker renews (``heartbeat``) while
+it runs. If the worker dies, the lease lapses after ``TASK_LEASE_SECONDS``
+and the task is claimed again, up to ``TASK_MAX_ATTEMPTS`` attempts in all,
+after which it is failed. Each claim counts as an attempt, and a worker
+only records the outcome of the attempt it claimed, so one that was
+presumed dead cannot overwrite the result of the retry.
+"""
+import os
+import socket
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.urls import reverse
+from django.utils import timezone
+
+from .derivatives import ensure_derivatives
+from .export_cache import export_cache
+from .exporters import iter_export
+from .extraction import extract_frames
+from .frames import index_video
+from .models import Dataset, Image, Task, Video
+from .tiles import TILE_THRESHOLD, ensure_pyramid
+
+
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_MAX_ATTEMPTS = 3
+
+TASK_HANDLERS = {}
+
+
+def task(kind):
+    def decorator(func):
+        TASK_HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+def enqueue(kind, payload=None, owner=None):
+    if kind not in TASK_HANDLERS:
+        raise ValueError(f'Unknown task kind: {kind}')
+    return Task.objects.create(kind=kind, payload=payload or {}, owner=owner)
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def lease_expiry():
+    """Running tasks last renewed before this have lost their worker."""
+    return timezone.now() - timedelta(seconds=getattr(settings, 'TASK_LEASE_SECONDS', DEFAULT_LEASE_SECONDS))
+
+
+def claimable():
+    """Pending tasks, and running tasks whose lease has lapsed."""
+    return Q(status='pending') | Q(status='running', heartbeat_at__lt=lease_expiry())
+
+
+def fail_abandoned():
+    """Fail the lapsed running tasks that have used up their attempts; returns how many."""
+    return Task.objects.filter(
+        status='running',
+        heartbeat_at__lt=lease_expiry(),
+        attempts__gte=getattr(settings, 'TASK_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS),
+    ).update(
+        status='failed',
+        error='The worker running the task stopped responding',
+        finished_at=timezone.now(),
+    )
+
+
+def claim_tasks(limit, worker=None):
+    """
+    Mark up to ``limit`` pending or abandoned tasks as running and return
+    their ids.
+
+    ``skip_locked`` lets several workers poll PostgreSQL without blocking
+    on each other; the conditional UPDATE keeps the claim exclusive on
+    SQLite, where row locks are not available.
+    """
+    worker = worker or worker_name()
+    claimed = []
+    fail_abandoned()
+    with transaction.atomic():
+        candidates = list(
+            Task.objects.select_for_update(skip_locked=True)
+            .filter(claimable())
+            .order_by('created_at')
+            .values_list('id', flat=True)[:limit]
+        )
+        for task_id in candidates:
+            now = timezone.now()
+            updated = Task.objects.filter(claimable(), pk=task_id).update(
+                status='running',
+                started_at=now,
+                heartbeat_at=now,
+                worker=worker,
+                attempts=F('attempts') + 1,
+            )
+            if updated:
+                claimed.append(task_id)
+    return claimed
+
+
+def heartbeat(task_ids, worker):
+    """Renew the leases of the running ``task_ids`` that ``worker`` still holds."""
+    return Task.objects.filter(pk__in=task_ids, status='running', worker=worker).update(
+        heartbeat_at=timezone.now()
+    )
+
+
+def run_task(task_id):
+    """Run a claimed task to completion, recording its result or traceback."""
+    close_old_connections()
+    try:
+        task = Task.objects.get(pk=task_id)
+        handler = TASK_HANDLERS.get(task.kind)
+        # Only this attempt's row; after a reclaim, the retry owns the task
+        attempt = Task.objects.filter(pk=task_id, status='running', worker=task.worker, attempts=task.attempts)
+
+        def report(progress, message=''):
+            attempt.update(
+                progress=max(0.0, min(1.0, progress)), message=message[:255], heartbeat_at=timezone.now()
+            )
+
+        try:
+            if handler is None:
+                raise ValueError(f'Unknown task kind: {task.kind}')
+            result = handler(task, report)
+        except Exception:
+            attempt.update(
+                status='failed',
+                error=traceback.format_exc(),
+                finished_at=timezone.now(),
+            )
+            return False
+
+        attempt.update(
+            status='succeeded',
+            progress=1.0,
+            result=result,
+            finished_at=timezone.now(),
+        )
+        return True
+    finally:
+        close_old_connections()
+
+
+@task('export_dataset')
+def export_dataset(task, report):
+    """Build an export into the artifact cache so the download is a file read."""
+    dataset = Dataset.objects.get(pk=task.payload['dataset_id'])
+    format = task.payload['format']
+    options = task.payload.get('options', {})
+
+    key = export_cache.key(dataset, format, options)
+    if not export_cache.get(dataset, format, options, key):
+        def progress(done, total):
+            report(done / total if total else 1.0, f'{done}/{total} images')
+
+        for _ in export_cache.stream_and_store(
+            dataset, format, options, key, iter_export(dataset, format, options, progress=progress)
+        ):
+            pass
+
+    url = reverse('labeling:export_dataset', kwargs={'dataset_id': dataset.pk, 'format': format})
+    if options.get('include_images'):
+        url += '?include_images=true'
+    return {'download_url': url, 'etag': f'"{key}"'}
+
+
+@task('build_derivatives')
+def build_derivatives(task, report):
+    """Render thumbnails and previews for a batch of freshly ingested images."""
+    image_ids = task.payload['image_ids']
+    built, failed = ensure_derivatives(image_ids, task.payload.get('specs'))
+    return {'built': built, 'failed': failed}
+
+
+def enqueue_derivatives(image_ids, owner=None, batch_size=50):
+    """Queue derivative rendering in batches so the worker pool can spread them out."""
+    image_ids = [str(image_id) for image_id in image_ids]
+    return [
+        enqueue('build_derivatives', {'image_ids': image_ids[i:i + batch_size]}, owner=owner)
+        for i in range(0, len(image_ids), batch_size)
+    ]
+
+
+def enqueue_ingest(images, owner=None):
+    """Queue the follow-up work for freshly stored images."""
+    for image in images:
+        if max(image.width, image.height) > TILE_THRESHOLD:
+            enqueue('build_tiles', {'image_id': str(image.pk)}, owner=owner)
+    return enqueue_derivatives([image.pk for image in images], owner=owner)
+
+
+@task('build_tiles')
+def build_tiles(task, report):
+    """Cut the tile pyramid of a large image ahead of its first annotation session."""
+    image = Image.objects.values('id', 'file', 'size').get(pk=task.payload['image_id'])
+    ensure_pyramid(image, task.payload.get('format', 'jpg'))
+    return {'image_id': str(image['id'])}
+
+
+@task('index_video')
+def index_video_task(task, report):
+    """Probe a freshly uploaded video and index its keyframes so frames can be served by seeking."""
+    video = index_video(Video.objects.get(pk=task.payload['video_id']))
+    return {'video_id': str(video.pk), 'frame_count': video.frame_count, 'keyframes': len(video.keyframes)}
+
+
+@task('extract_video')
+def extract_video(task, report):
+    """Sample frames of a video into a sequential dataset using a process pool."""
+    video = Video.objects.get(pk=task.payload['video_id'])
+    dataset = Dataset.objects.get(pk=task.payload['dataset_id'])
+    extracted = 0
+    for extracted, total in extract_frames(
+        video, dataset,
+        stride=task.payload.get('stride'),
+        fps=task.payload.get('fps'),
+        start=task.payload.get('start'),
+        end=task.payload.get('end'),
+    ):
+        report(extracted / total, f'{extracted}/{total} frames')
+    return {'dataset_id': str(dataset.pk), 'extracted': extracted}
@@ -1,3 +1,1491 @@
-from django.test import TestCase
+import io
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from datetime import timedelta
+import tracemalloc
+import uuid
+import warnings
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 
-# Create your tests here.
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+from PIL import Image as PILImage
+
+from . import urls
+from .counters import recount_datasets, recount_images, recount_labels, recount_projects
+from .dedup import HashIndex, hash_index, near_duplicates
+from .export_cache import export_cache
+from .extraction import extract_frames
+from .frames import frame_cache, frame_key
+from .geometry import InvalidGeometry, pack_geometry, unpack_geometry
+from .importer import import_images, remove_checkpoint
+from .management.commands import runworker
+from .tasks import TASK_HANDLERS, claim_tasks, heartbeat, run_task
+from .tracks import InvalidKeyframes, pack_keyframes, parse_keyframes, unpack_keyframes
+from .models import (
+    Annotation, Dataset, Image, LabelCategory, Project, Task, Track, UploadSession, Video, count_new_images
+)
+
+
+SEED_IMAGES = 10_000
+SEED_ANNOTATIONS_PER_IMAGE = 10
+SEED_LABELS = 8
+SEED_BATCH_SIZE = 5000
+
+# Most queries each request may make against the seeded 10k image / 100k
+# annotation dataset, as measured on SQLite. Loading the session and user
+# takes two of every budget and savepoints count too. Exports grow with
+# dataset size / EXPORT_CHUNK_SIZE and batch inserts with SQLite's limit on
+# query parameters; everything else must stay flat however large the
+# dataset is.
+QUERY_BUDGETS = {
+    'project_list': 3,
+    'project_create': 2,
+    'project_detail': 8,
+    'project_edit': 3,
+    'dataset_create': 3,
+    'dataset_detail': 6,
+    'dataset_edit': 4,
+    'image_upload': 4,
+    'image_upload:post': 9,
+    'image_detail': 4,
+    'annotate_image': 5,
+    'image_duplicates': 6,
+    'image_derivative': 3,
+    'image_tile_source': 3,
+    'image_tile': 3,
+    'video_frame_source': 3,
+    'video_frame': 3,
+    'video_extract:post': 8,
+    'video_tracks': 4,
+    'video_tracks:frame': 4,
+    'video_tracks:post': 8,
+    'track_detail': 3,
+    'track_detail:put': 7,
+    'track_detail:delete': 7,
+    'dataset_images_api': 6,
+    'dataset_images_api:cursor': 6,
+    'dataset_images_api:label': 6,
+    'annotation_api': 4,
+    'annotation_api:columnar': 4,
+    'annotation_api:cached': 3,
+    'annotation_api:not_modified': 3,
+    'annotation_api:post': 14,
+    'annotation_api_detail': 3,
+    'annotation_api_detail:put': 9,
+    'annotation_api_detail:delete': 13,
+    'annotation_batch': 30,
+    'annotation_changes': 5,
+    'annotation_changes:cursor': 5,
+    'annotation_events': 4,
+    'export_dataset:coco': 37,
+    'export_dataset:yolo': 26,
+    'export_dataset:yolo_images': 7,
+    'export_dataset:not_modified': 3,
+    'export_dataset:post': 4,
+    'upload_session_list': 4,
+    'upload_session_list:post': 4,
+    'upload_session': 3,
+    'upload_session:put': 3,
+    'upload_session:post': 15,
+    'upload_session:delete': 4,
+    'task_list': 3,
+    'task_detail': 3,
+    'login': 0,
+    'logout': 4,
+}
+
+BENCHMARK_ROUNDS = 5
+# Set to a path to write wall-clock and peak-memory results there
+BENCHMARK_OUTPUT = os.environ.get('LABELING_BENCHMARK_OUTPUT')
+# Set to a previously written file to fail on slowdowns beyond the tolerance
+BENCHMARK_BASELINE = os.environ.get('LABELING_BENCHMARK_BASELINE')
+BENCHMARK_TOLERANCE = float(os.environ.get('LABELING_BENCHMARK_TOLERANCE', '0.5'))
+
+
+def image_bytes(color, size=(64, 48), format='PNG'):
+    buffer = io.BytesIO()
+    PILImage.new('RGB', size, color).save(buffer, format)
+    return buffer.getvalue()
+
+
+class LabelingTestCase(TestCase):
+    """
+    A logged-in owner with a project, its labels, a few images with real
+    files, an indexed video with a track and a task. Media and caches are
+    kept in a temporary directory.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.settings_override = override_settings(
+            MEDIA_ROOT=os.path.join(cls.tmpdir, 'media'),
+            EXPORT_CACHE_DIR=os.path.join(cls.tmpdir, 'export_cache'),
+            TILE_CACHE_DIR=os.path.join(cls.tmpdir, 'tile_cache'),
+            UPLOAD_SESSION_DIR=os.path.join(cls.tmpdir, 'upload_sessions'),
+        )
+        cls.settings_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.settings_override.disable()
+        shutil.rmtree(cls.tmpdir, ignore_errors=True)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('annotator', password='secret')
+        cls.project = Project.objects.create(name='Synthetic', owner=cls.user)
+        cls.labels = LabelCategory.objects.bulk_create([
+            LabelCategory(project=cls.project, name=f'label-{i}', annotation_type='bbox')
+            for i in range(SEED_LABELS)
+        ])
+
+        # A few images with real files for the views that decode pixels
+        cls.file_dataset = Dataset.objects.create(project=cls.project, name='Files')
+        cls.file_images = []
+        for i, color in enumerate(['red', 'green', 'blue']):
+            image = Image(dataset=cls.file_dataset, width=64, height=48)
+            image.file.save(f'file-{i}.png', ContentFile(image_bytes(color)), save=False)
+            image.save()
+            cls.file_images.append(image)
+        Annotation.objects.create(
+            image=cls.file_images[0], label_category=cls.labels[0], annotation_type='bbox',
+            x=1, y=1, width=10, height=10, annotator=cls.user,
+        )
+        # An already indexed two-frame video; its frames are put in the cache
+        # by clear_caches, so serving them needs no ffmpeg
+        cls.video = Video(
+            dataset=cls.file_dataset, width=64, height=48, fps=25, duration=0.08, frame_count=2,
+            keyframes=[[0, 0.0]],
+        )
+        cls.video.file.save('clip.mp4', ContentFile(b'not decoded'), save=False)
+        cls.video.save()
+        cls.track = Track(video=cls.video, label_category=cls.labels[0], annotator=cls.user)
+        cls.track.keyframes = [(0, 0, 0, 10, 10, False), (1, 10, 20, 30, 40, False)]
+        cls.track.save()
+        cls.task = Task.objects.create(kind='export_dataset', owner=cls.user, payload={})
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.clear_caches()
+
+    def clear_caches(self):
+        # Cached exports and tiles outlive the per-test rollback
+        for directory in (settings.EXPORT_CACHE_DIR, settings.TILE_CACHE_DIR):
+            shutil.rmtree(directory, ignore_errors=True)
+        frame_cache.clear()
+        cache.clear()
+        for n, color in enumerate(['red', 'blue']):
+            frame_cache.put(frame_key(self.video, n), image_bytes(color, format='JPEG'))
+
+    def request(self, name, method='get', url_kwargs=None, data=None, body=None, **extra):
+        url = reverse(f"labeling:{name.split(':')[0]}", kwargs=url_kwargs)
+        if body is not None:
+            data = json.dumps(body)
+            extra['content_type'] = 'application/json'
+        response = getattr(self.client, method)(url, data, **extra)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+
+class ViewBudgetTests(LabelingTestCase):
+    """
+    Query budgets and latency/memory baselines for every URL in
+    ``labeling.urls``, against a synthetic project large enough that any
+    per-row query shows up as a blown budget.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.dataset = Dataset.objects.create(project=cls.project, name='Large', dataset_type='sequential')
+        images = [
+            Image(
+                dataset=cls.dataset,
+                file=f'images/{cls.dataset.pk}/{i:06}.jpg',
+                filename=f'{i:06}.jpg',
+                width=1920,
+                height=1080,
+                size=250_000,
+                sequence_number=i,
+                perceptual_hash=i * 7919,
+            )
+            for i in range(SEED_IMAGES)
+        ]
+        Image.objects.bulk_create(images, batch_size=SEED_BATCH_SIZE)
+        count_new_images(cls.dataset.pk, len(images))
+        annotations = [
+            Annotation(
+                image=image,
+                dataset=cls.dataset,
+                label_category=cls.labels[(i + j) % SEED_LABELS],
+                annotation_type='bbox' if j % 4 else 'polygon',
+                x=10 * j, y=20, width=100, height=50,
+                points=None if j % 4 else [[0, 0], [10, 0], [10, 10]],
+                annotator=cls.user,
+            )
+            # Every other image is left unannotated for the is_annotated filters
+            for i, image in enumerate(images[::2])
+            for j in range(SEED_ANNOTATIONS_PER_IMAGE * 2)
+        ]
+        Annotation.objects.bulk_create(annotations, batch_size=SEED_BATCH_SIZE)
+        recount_images(Image.objects.filter(dataset=cls.dataset))
+        recount_datasets(Dataset.objects.filter(pk=cls.dataset.pk))
+        recount_labels(LabelCategory.objects.filter(project=cls.project))
+        cls.image = images[0]
+
+    def assertWithinBudget(self, name, *args, status=200, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.request(name, *args, **kwargs)
+        self.assertEqual(response.status_code, status, name)
+        self.assertLessEqual(
+            len(queries), QUERY_BUDGETS[name],
+            f'{name} made {len(queries)} queries (budget {QUERY_BUDGETS[name]}):\n'
+            + '\n'.join(query['sql'] for query in queries.captured_queries)
+        )
+        return response
+
+    def read_cases(self):
+        """``(name, request kwargs)`` for the GET requests that leave no state behind."""
+        return [
+            ('project_list', {}),
+            ('project_create', {}),
+            ('project_detail', {'url_kwargs': {'pk': self.project.pk}}),
+            ('project_edit', {'url_kwargs': {'pk': self.project.pk}}),
+            ('dataset_create', {'url_kwargs': {'project_id': self.project.pk}}),
+            ('dataset_detail', {'url_kwargs': {'pk': self.dataset.pk}}),
+            ('dataset_edit', {'url_kwargs': {'pk': self.dataset.pk}}),
+            ('image_upload', {'url_kwargs': {'pk': self.dataset.pk}}),
+            ('image_detail', {'url_kwargs': {'pk': self.image.pk}}),
+            ('annotate_image', {'url_kwargs': {'pk': self.image.pk}}),
+            ('image_duplicates', {'url_kwargs': {'pk': self.image.pk}, 'data': {'distance': 16}}),
+            ('image_derivative', {'url_kwargs': {'pk': self.file_images[0].pk, 'spec': 'thumb'}}),
+            ('image_tile_source', {'url_kwargs': {'pk': self.file_images[0].pk}}),
+            ('image_tile', {'url_kwargs': {'pk': self.file_images[0].pk, 'level': 0, 'x': 0, 'y': 0, 'fmt': 'jpg'}}),
+            ('video_frame_source', {'url_kwargs': {'pk': self.video.pk}}),
+            ('video_frame', {'url_kwargs': {'pk': self.video.pk, 'frame': 1}}),
+            ('video_tracks', {'url_kwargs': {'pk': self.video.pk}}),
+            ('video_tracks:frame', {'url_kwargs': {'pk': self.video.pk}, 'data': {'frame': 1}}),
+            ('track_detail', {'url_kwargs': {'pk': self.track.pk}}),
+            ('dataset_images_api', {'url_kwargs': {'pk': self.dataset.pk}, 'data': {'limit': 200}}),
+            ('dataset_images_api:label', {
+                'url_kwargs': {'pk': self.dataset.pk},
+                'data': {'limit': 200, 'label': str(self.labels[0].pk), 'is_annotated': 'true'},
+            }),
+            ('annotation_api', {'data': {'image_id': str(self.image.pk)}}),
+            ('annotation_api:columnar', {'data': {'image_id': str(self.image.pk), 'shape': 'columnar'}}),
+            ('annotation_api_detail', {'url_kwargs': {'pk': self.image.annotations.first().pk}}),
+            ('annotation_changes', {'data': {'dataset_id': str(self.dataset.pk), 'limit': 1000}}),
+            ('export_dataset:coco', {'url_kwargs': {'dataset_id': self.dataset.pk, 'format': 'coco'}}),
+            ('export_dataset:yolo', {'url_kwargs': {'dataset_id': self.dataset.pk, 'format': 'yolo'}}),
+            ('export_dataset:yolo_images', {
+                'url_kwargs': {'dataset_id': self.file_dataset.pk, 'format': 'yolo'},
+                'data': {'include_images': 'true'},
+            }),
+            ('upload_session_list', {'url_kwargs': {'pk': self.dataset.pk}}),
+            ('task_list', {}),
+            ('task_detail', {'url_kwargs': {'pk': self.task.pk}}),
+        ]
+
+    def test_every_url_has_a_budget(self):
+        names = {pattern.name for pattern in urls.urlpatterns if isinstance(pattern, URLPattern)}
+        budgeted = {name.split(':')[0] for name in QUERY_BUDGETS}
+        self.assertEqual(names - budgeted, set(), 'URLs without a query budget')
+
+    def test_read_budgets(self):
+        for name, kwargs in self.read_cases():
+            with self.subTest(name):
+                self.assertWithinBudget(name, **kwargs)
+
+    def test_export_cache_hit_budget(self):
+        kwargs = {'url_kwargs': {'dataset_id': self.dataset.pk, 'format': 'coco'}}
+        etag = self.request('export_dataset:coco', **kwargs)['ETag']
+        self.assertWithinBudget('export_dataset:not_modified', status=304, HTTP_IF_NONE_MATCH=etag, **kwargs)
+
+    def test_dataset_images_cursor_budget(self):
+        kwargs = {'url_kwargs': {'pk': self.dataset.pk}}
+        cursor = self.request('dataset_images_api', data={'limit': 200}, **kwargs).json()['next_cursor']
+        # Deep pages must cost the same as the first one
+        for _ in range(3):
+            response = self.assertWithinBudget(
+                'dataset_images_api:cursor', data={'limit': 200, 'cursor': cursor}, **kwargs
+            )
+            cursor = response.json()['next_cursor']
+
+    def test_annotation_cache_budgets(self):
+        kwargs = {'data': {'image_id': str(self.image.pk)}}
+        etag = self.request('annotation_api', **kwargs)['ETag']
+        self.assertWithinBudget('annotation_api:cached', **kwargs)
+        self.assertWithinBudget('annotation_api:not_modified', status=304, HTTP_IF_NONE_MATCH=etag, **kwargs)
+
+    def test_annotation_changes_cursor_budget(self):
+        data = {'dataset_id': str(self.dataset.pk), 'limit': 200}
+        data['cursor'] = self.request('annotation_changes', data=data).json()['next_cursor']
+        # Deep pages must cost the same as the first one
+        for _ in range(3):
+            response = self.assertWithinBudget('annotation_changes:cursor', data=data)
+            data['cursor'] = response.json()['next_cursor']
+
+    def test_annotation_events_budget(self):
+        self.async_client.force_login(self.user)
+
+        async def open_stream():
+            response = await self.async_client.get(
+                reverse('labeling:annotation_events'), {'dataset_id': str(self.dataset.pk)}
+            )
+            events = response.streaming_content
+            await anext(events)
+            await events.aclose()
+            return response
+
+        with CaptureQueriesContext(connection) as queries:
+            response = async_to_sync(open_stream)()
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(queries), QUERY_BUDGETS['annotation_events'])
+
+    def test_async_annotation_budget(self):
+        self.async_client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = async_to_sync(self.async_client.get)(
+                reverse('labeling:annotation_api'), {'image_id': str(self.image.pk)}
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(queries), QUERY_BUDGETS['annotation_api'])
+
+    def test_annotation_write_budgets(self):
+        response = self.assertWithinBudget('annotation_api:post', 'post', body={
+            'image_id': str(self.image.pk), 'label_id': str(self.labels[1].pk),
+            'type': 'bbox', 'x': 1, 'y': 2, 'width': 3, 'height': 4,
+        })
+        annotation_id = response.json()['id']
+        self.assertWithinBudget(
+            'annotation_api_detail:put', 'put', url_kwargs={'pk': annotation_id}, body={'x': 5}
+        )
+        self.assertWithinBudget('annotation_api_detail:delete', 'delete', url_kwargs={'pk': annotation_id})
+
+    def test_annotation_batch_budget(self):
+        existing = list(Annotation.objects.filter(image__dataset=self.dataset).values_list('id', flat=True)[:200])
+        operations = [
+            {'op': 'create', 'image_id': str(image_id), 'label_id': str(self.labels[2].pk), 'type': 'bbox',
+             'x': 1, 'y': 1, 'width': 5, 'height': 5}
+            for image_id in self.dataset.images.values_list('id', flat=True)[:300]
+        ]
+        operations += [{'op': 'update', 'id': str(pk), 'label_id': str(self.labels[3].pk)} for pk in existing[:100]]
+        operations += [{'op': 'delete', 'id': str(pk)} for pk in existing[100:]]
+        self.assertWithinBudget('annotation_batch', 'post', body={'operations': operations})
+
+    def test_image_upload_budget(self):
+        files = [
+            ContentFile(image_bytes(color), name=f'upload-{color}.png')
+            for color in ['white', 'black', 'yellow', 'purple']
+        ]
+        self.assertWithinBudget(
+            'image_upload:post', 'post', url_kwargs={'pk': self.file_dataset.pk},
+            data={'images': files}, status=302,
+        )
+
+    def test_queued_export_budget(self):
+        self.assertWithinBudget(
+            'export_dataset:post', 'post', url_kwargs={'dataset_id': self.dataset.pk, 'format': 'coco'}, status=202
+        )
+
+    def test_video_extract_budget(self):
+        self.assertWithinBudget(
+            'video_extract:post', 'post', url_kwargs={'pk': self.video.pk}, body={'fps': 2, 'start': 0}, status=202
+        )
+
+    def test_track_budgets(self):
+        response = self.assertWithinBudget(
+            'video_tracks:post', 'post', url_kwargs={'pk': self.video.pk}, status=201,
+            body={'label_id': str(self.labels[1].pk), 'keyframes': [[0, 1, 2, 3, 4], [1, 5, 6, 7, 8, True]]},
+        )
+        track = {'pk': response.json()['id']}
+        self.assertWithinBudget('track_detail:put', 'put', url_kwargs=track, body={'keyframe': [1, 9, 9, 9, 9]})
+        self.assertWithinBudget('track_detail:delete', 'delete', url_kwargs=track)
+
+    def test_upload_session_budgets(self):
+        content = image_bytes('orange')
+        response = self.assertWithinBudget(
+            'upload_session_list:post', 'post', url_kwargs={'pk': self.file_dataset.pk},
+            body={'filename': 'resumable.png', 'size': len(content), 'kind': 'image'}, status=201,
+        )
+        session = {'pk': response.json()['id']}
+        self.assertWithinBudget('upload_session', url_kwargs=session)
+        self.assertWithinBudget(
+            'upload_session:put', 'put', url_kwargs=session, data=content, content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes 0-{len(content) - 1}/{len(content)}',
+        )
+        self.assertWithinBudget('upload_session:post', 'post', url_kwargs=session)
+
+        abandoned = UploadSession.objects.create(
+            dataset=self.file_dataset, owner=self.user, kind='image', filename='abandoned.png', size=10
+        )
+        self.assertWithinBudget('upload_session:delete', 'delete', url_kwargs={'pk': abandoned.pk})
+
+    def test_auth_budgets(self):
+        self.assertWithinBudget('logout', 'post', status=302)
+        self.assertWithinBudget('login')
+
+    def measure(self, name, kwargs):
+        timings = []
+        for _ in range(BENCHMARK_ROUNDS):
+            self.clear_caches()
+            start = time.perf_counter()
+            self.request(name, **kwargs)
+            timings.append(time.perf_counter() - start)
+        # Memory is traced in a separate run since tracing slows everything down
+        self.clear_caches()
+        tracemalloc.start()
+        try:
+            self.request(name, **kwargs)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return {'seconds': statistics.median(timings), 'peak_bytes': peak}
+
+    def test_benchmark_baselines(self):
+        if not (BENCHMARK_OUTPUT or BENCHMARK_BASELINE):
+            self.skipTest('Set LABELING_BENCHMARK_OUTPUT or LABELING_BENCHMARK_BASELINE to run benchmarks')
+
+        results = {
+            'database': connection.vendor,
+            'images': SEED_IMAGES,
+            'annotations': Annotation.objects.count(),
+            'rounds': BENCHMARK_ROUNDS,
+            'views': {name: self.measure(name, kwargs) for name, kwargs in self.read_cases()},
+        }
+        if BENCHMARK_OUTPUT:
+            with open(BENCHMARK_OUTPUT, 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+
+        if BENCHMARK_BASELINE:
+            with open(BENCHMARK_BASELINE) as f:
+                baseline = json.load(f)
+            regressions = []
+            for name, measured in results['views'].items():
+                expected = baseline['views'].get(name)
+                if expected is None:
+                    continue
+                for metric in ('seconds', 'peak_bytes'):
+                    if measured[metric] > expected[metric] * (1 + BENCHMARK_TOLERANCE):
+                        regressions.append(f'{name} {metric}: {expected[metric]:.4g} -> {measured[metric]:.4g}')
+            self.assertEqual(regressions, [], f'Slower than baseline by more than {BENCHMARK_TOLERANCE:.0%}')
+
+
+class VideoFrameTests(LabelingTestCase):
+    def test_cached_frame(self):
+        response = self.request('video_frame', url_kwargs={'pk': self.video.pk, 'frame': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        red, green, blue = PILImage.open(io.BytesIO(response.content)).getpixel((32, 24))
+        self.assertGreater(blue, 200)
+        self.assertLess(red, 50)
+
+    def test_frame_out_of_range(self):
+        response = self.request('video_frame', url_kwargs={'pk': self.video.pk, 'frame': 2})
+        self.assertEqual(response.status_code, 404)
+
+    def test_unindexed_video(self):
+        video = Video(dataset=self.file_dataset)
+        video.file.save('unindexed.mp4', ContentFile(b'not decoded'))
+        source = {'url_kwargs': {'pk': video.pk}}
+        frame = {'url_kwargs': {'pk': video.pk, 'frame': 0}}
+        response = self.request('video_frame_source', **source)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response['Retry-After'], '2')
+        task = Task.objects.get(pk=response.json()['id'])
+        self.assertEqual((task.kind, task.payload), ('index_video', {'video_id': str(video.pk)}))
+        # Queued once, however many requests wait for it
+        self.assertEqual(self.request('video_frame', **frame).json()['id'], str(task.pk))
+        self.assertEqual(Task.objects.filter(kind='index_video').count(), 1)
+
+        Task.objects.filter(pk=task.pk).update(status='failed', error='moov atom not found')
+        response = self.request('video_frame_source', **source)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['task']['error'], 'moov atom not found')
+
+        Task.objects.filter(pk=task.pk).update(status='succeeded')
+        Video.objects.filter(pk=video.pk).update(frame_count=2, fps=25, keyframes=[[0, 0.0]])
+        response = self.request('video_frame_source', **source)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['keyframes'], [0])
+
+
+
+class FrameExtractionTests(LabelingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dataset = Dataset.objects.create(project=self.project, name='Frames', dataset_type='sequential')
+        # Decode in threads from made-up frames; there is no ffmpeg to run here
+        for target, replacement in [
+            ('labeling.extraction.ProcessPoolExecutor', lambda **kwargs: ThreadPoolExecutor(kwargs['max_workers'])),
+            ('labeling.extraction.iter_raw_frames', self.raw_frames),
+        ]:
+            patcher = mock.patch(target, replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def raw_frames(source, seconds, count, width, height):
+        for n in range(count):
+            yield PILImage.new('RGB', (width, height), ['red', 'blue'][n % 2]).tobytes()
+
+    def frame_files(self):
+        directory = os.path.join(settings.MEDIA_ROOT, 'images', str(self.dataset.pk))
+        return sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+
+    def test_extract_frames(self):
+        # A file of that name is already in storage, so the first frame is saved under another
+        default_storage.save(f'images/{self.dataset.pk}/clip_0000000.jpg', ContentFile(b'unrelated'))
+        self.assertEqual(list(extract_frames(self.video, self.dataset, processes=1)), [(2, 2)])
+        images = list(self.dataset.images.order_by('sequence_number'))
+        self.assertEqual([image.source_frame for image in images], [0, 1])
+        for image in images:
+            self.assertEqual(image.filename, os.path.basename(image.file.name))
+            self.assertTrue(default_storage.exists(image.file.name))
+        self.assertNotEqual(images[0].filename, 'clip_0000000.jpg')
+        self.assertEqual(images[1].filename, 'clip_0000001.jpg')
+
+        # Extracted frames are skipped when run again
+        self.assertEqual(list(extract_frames(self.video, self.dataset, processes=1)), [])
+        self.assertEqual(self.dataset.images.count(), 2)
+
+    def test_failed_registration_removes_frames(self):
+        with mock.patch.object(Image.objects, 'bulk_create', side_effect=IntegrityError('duplicate')), \
+                self.assertRaises(IntegrityError):
+            list(extract_frames(self.video, self.dataset, processes=1))
+        self.assertEqual(self.frame_files(), [])
+        self.assertEqual(Dataset.objects.get(pk=self.dataset.pk).image_count, 0)
+
+    def test_invalid_dataset_id(self):
+        response = self.request(
+            'video_extract:post', 'post', url_kwargs={'pk': self.video.pk}, body={'fps': 2, 'dataset_id': 'frames'}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'dataset_id must be a sequential dataset of the same project')
+
+class TrackTests(LabelingTestCase):
+    def test_interpolated_at_frame(self):
+        track = Track(video=self.video, label_category=self.labels[1], annotator=self.user)
+        track.keyframes = [(0, 0, 0, 10, 10, False), (4, 40, 20, 10, 10, False)]
+        track.save()
+        response = self.request('video_tracks:frame', url_kwargs={'pk': self.video.pk}, data={'frame': 1})
+        boxes = {data['id']: data['box'] for data in response.json()['tracks']}
+        self.assertEqual(boxes, {str(self.track.pk): [10, 20, 30, 40], str(track.pk): [10, 5, 10, 10]})
+
+    def test_parse_keyframes(self):
+        keyframes = parse_keyframes([[5, 1, 2, 3, 4], [0.0, 0, 0, 1, 1, True], ['2', '1.5', 0, 1, 1], [5, 9, 9, 9, 9]])
+        self.assertEqual(keyframes, [(0, 0, 0, 1, 1, True), (2, 1.5, 0, 1, 1, False), (5, 9, 9, 9, 9, False)])
+        edge = [(2 ** 31 - 1, -3.4e38, 0, 3.4e38, 0, False)]
+        self.assertEqual(len(unpack_keyframes(pack_keyframes(parse_keyframes(edge)))), 1)
+
+        for invalid in [
+            [1.5, 0, 0, 1, 1], [2 ** 31, 0, 0, 1, 1], [-1, 0, 0, 1, 1], [float('nan'), 0, 0, 1, 1],
+            [0, 1e39, 0, 1, 1], [0, 0, float('inf'), 1, 1], [0, 0, 0, float('nan'), 1], [0, 0, 0, 1, -1],
+            [0, 'x', 0, 1, 1], [0, 0, 0, 1], None,
+        ]:
+            with self.subTest(invalid), self.assertRaises(InvalidKeyframes):
+                parse_keyframes([invalid])
+
+    def test_invalid_keyframes_rejected(self):
+        track = {'url_kwargs': {'pk': self.track.pk}}
+        for keyframe in [[2 ** 31, 0, 0, 1, 1], [1, 1e39, 0, 1, 1], [1.5, 0, 0, 1, 1], [1, float('nan'), 0, 1, 1]]:
+            with self.subTest(keyframe):
+                response = self.request(
+                    'video_tracks:post', 'post', url_kwargs={'pk': self.video.pk},
+                    body={'label_id': str(self.labels[1].pk), 'keyframes': [keyframe]},
+                )
+                self.assertEqual(response.status_code, 400)
+                response = self.request('track_detail:put', 'put', body={'keyframe': keyframe}, **track)
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(Track.objects.get(pk=self.track.pk).keyframes, self.track.keyframes)
+
+    def test_tracks_materialized_in_coco_export(self):
+        track = Track(video=self.video, label_category=self.labels[1], annotator=self.user)
+        # Visible at 0 and 2, interpolated at 1, out of view at 3, back at 4
+        track.keyframes = [
+            (0, 0, 0, 10, 10, False), (2, 20, 20, 30, 30, False), (3, 0, 0, 0, 0, True), (4, 5, 5, 5, 5, False)
+        ]
+        track.save()
+        response = self.client.get(
+            reverse('labeling:export_dataset', kwargs={'dataset_id': self.file_dataset.pk, 'format': 'coco'})
+        )
+        export = json.loads(b''.join(response.streaming_content))
+
+        self.assertEqual(export['videos'], [{'id': 1, 'file_name': 'clip.mp4', 'width': 64, 'height': 48}])
+        frames = {image['frame_id']: image['id'] for image in export['images'] if 'frame_id' in image}
+        self.assertEqual(sorted(frames), [0, 1, 2, 4])
+        boxes = {
+            (annotation['track_id'], frame): annotation['bbox']
+            for annotation in export['annotations'] if 'track_id' in annotation
+            for frame, image_id in frames.items() if image_id == annotation['image_id']
+        }
+        self.assertEqual(len(boxes), 6)
+        self.assertEqual(boxes[2, 1], [10, 10, 20, 20])
+        self.assertNotIn((2, 3), boxes)
+        self.assertEqual(boxes[1, 1], [10, 20, 30, 40])
+
+
+class GeometryExportTests(LabelingTestCase):
+    def test_geometry_in_coco_export(self):
+        image = str(self.file_images[1].pk)
+        label = str(self.labels[2].pk)
+        # A mask of a 4x3 image whose run wraps from the bottom of column 0 into column 1
+        mask = {'size': [4, 3], 'counts': [2, 3, 7]}
+        response = self.client.post(reverse('labeling:annotation_batch'), json.dumps({'operations': [
+            {'op': 'create', 'image_id': image, 'label_id': label, 'type': 'polygon',
+             'points': [[2, 2], [12, 2], [12, 7.1]]},
+            {'op': 'create', 'image_id': image, 'label_id': label, 'type': 'segmentation', 'points': mask},
+            {'op': 'create', 'image_id': image, 'label_id': label, 'type': 'keypoint', 'points': [[3, 4]]},
+            {'op': 'create', 'image_id': image, 'label_id': label, 'type': 'polygon', 'points': [[1, 'x']]},
+        ]}), content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['index'], 3)
+
+        response = self.client.post(reverse('labeling:annotation_batch'), json.dumps({'operations': [
+            {'op': 'create', 'image_id': image, 'label_id': label, 'type': 'polygon',
+             'points': [[2, 2], [12, 2], [12, 7.1]]},
+            {'op': 'create', 'image_id': image, 'label_id': label, 'type': 'segmentation', 'points': mask},
+            {'op': 'create', 'image_id': image, 'label_id': label, 'type': 'keypoint', 'points': [[3, 4]]},
+        ]}), content_type='application/json')
+        polygon_id = response.json()['results'][0]['id']
+        self.assertEqual(Annotation.objects.get(pk=polygon_id).points, [[2, 2], [12, 2], [12, 7.1]])
+
+        response = self.client.get(
+            reverse('labeling:export_dataset', kwargs={'dataset_id': self.file_dataset.pk, 'format': 'coco'})
+        )
+        export = json.loads(b''.join(response.streaming_content))
+        polygon, segmentation, keypoint = (
+            annotation for annotation in export['annotations'] if annotation['category_id'] == 3
+        )
+        self.assertEqual(polygon['segmentation'], [[2, 2, 12, 2, 12, 7.1]])
+        self.assertEqual(polygon['bbox'], [2, 2, 10, 5.1])
+        self.assertAlmostEqual(polygon['area'], 25.5, places=3)
+        self.assertEqual(segmentation['segmentation'], mask)
+        self.assertEqual(segmentation['bbox'], [0, 0, 2, 4])
+        self.assertEqual(segmentation['area'], 3)
+        self.assertEqual(keypoint['keypoints'], [3, 4, 2])
+        self.assertEqual(keypoint['num_keypoints'], 1)
+
+
+    def test_out_of_range_geometry_rejected(self):
+        # The largest float32 still round trips
+        (x, y), = unpack_geometry(pack_geometry([[3.4e38, -3.4e38]]))
+        self.assertAlmostEqual(x / 3.4e38, 1)
+        self.assertAlmostEqual(y / -3.4e38, 1)
+        cases = [
+            ('polygon', [[1e39, 2]]),
+            ('keypoint', [[0, -1e39]]),
+            ('segmentation', {'size': [2 ** 32, 1], 'counts': [0, 2 ** 32]}),
+            ('segmentation', {'size': [1, 2 ** 32], 'counts': [2 ** 32]}),
+            ('segmentation', {'size': [2 ** 16, 2 ** 16], 'counts': [2 ** 32]}),
+        ]
+        image, label = str(self.file_images[1].pk), str(self.labels[2].pk)
+        for annotation_type, points in cases:
+            with self.subTest(points=points):
+                with self.assertRaises(InvalidGeometry):
+                    pack_geometry(points)
+                response = self.request('annotation_batch', 'post', body={'operations': [
+                    {'op': 'create', 'image_id': image, 'label_id': label, 'type': annotation_type, 'points': points},
+                ]})
+                self.assertEqual(response.status_code, 400)
+        self.assertFalse(Annotation.objects.filter(image=self.file_images[1]).exists())
+
+class AnnotationSerializationTests(LabelingTestCase):
+    def test_columnar_annotations_match_rows(self):
+        image = str(self.file_images[1].pk)
+        self.request('annotation_batch', 'post', body={'operations': [
+            {'op': 'create', 'image_id': image, 'label_id': str(self.labels[n % 3].pk), 'type': 'bbox',
+             'x': n, 'y': 2 * n, 'width': 5, 'height': 5}
+            for n in range(6)
+        ] + [
+            {'op': 'create', 'image_id': image, 'label_id': str(self.labels[4].pk), 'type': 'polygon',
+             'points': [[0, 0], [10, 0], [10, 10]]},
+        ]})
+        rows = self.request('annotation_api', data={'image_id': image}).json()['annotations']
+        columns = self.request('annotation_api:columnar', data={'image_id': image, 'shape': 'columnar'}).json()
+        self.assertEqual(len(rows), 7)
+        self.assertEqual(columns['ids'], [row['id'] for row in rows])
+        self.assertEqual([columns['labels'][i]['id'] for i in columns['label_index']], [row['label_id'] for row in rows])
+        self.assertEqual(columns['types'], [row['type'] for row in rows])
+        self.assertEqual(columns['x'], [row['x'] for row in rows])
+        self.assertEqual(columns['points'], [row['points'] for row in rows])
+
+
+class AnnotationCacheTests(LabelingTestCase):
+    def test_annotation_etag(self):
+        kwargs = {'data': {'image_id': str(self.file_images[0].pk)}}
+        response = self.request('annotation_api', **kwargs)
+        etag = response['ETag']
+        self.assertEqual(self.request('annotation_api:cached', **kwargs).content, response.content)
+        self.assertEqual(self.request('annotation_api', HTTP_IF_NONE_MATCH=etag, **kwargs).status_code, 304)
+
+        annotation = response.json()['annotations'][0]
+        self.request('annotation_batch', 'post', body={'operations': [{'op': 'update', 'id': annotation['id'], 'x': 7}]})
+        response = self.request('annotation_api', HTTP_IF_NONE_MATCH=etag, **kwargs)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['annotations'][0]['x'], 7)
+
+        # Renaming a label changes the payload of every image using it
+        etag = response['ETag']
+        label = LabelCategory.objects.get(pk=annotation['label_id'])
+        label.name = 'renamed'
+        label.save()
+        response = self.request('annotation_api', HTTP_IF_NONE_MATCH=etag, **kwargs)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['annotations'][0]['label_name'], 'renamed')
+
+
+class AnnotationChangesTests(LabelingTestCase):
+    def test_annotation_changes(self):
+        kwargs = {'data': {'dataset_id': str(self.file_dataset.pk)}}
+        response = self.request('annotation_changes', **kwargs).json()
+        self.assertEqual(len(response['changes']), 1)
+        self.assertIsNone(response['next_cursor'])
+        since = response['revision']
+        self.assertEqual(self.request('annotation_changes', data={**kwargs['data'], 'since': since}).json()['changes'], [])
+
+        image, label = str(self.file_images[1].pk), str(self.labels[1].pk)
+        created = self.request('annotation_batch', 'post', body={'operations': [
+            {'op': 'create', 'image_id': image, 'label_id': label, 'type': 'bbox', 'x': n, 'y': 0, 'width': 1, 'height': 1}
+            for n in range(5)
+        ]}).json()['results']
+        deleted, updated = created[0]['id'], created[1]['id']
+        self.request('annotation_batch', 'post', body={'operations': [
+            {'op': 'delete', 'id': deleted}, {'op': 'update', 'id': updated, 'x': 9},
+        ]})
+        self.request('annotation_api_detail', 'delete', url_kwargs={'pk': created[2]['id']})
+
+        # Page through everything since the first sync, two changes at a time
+        changes, tombstones = {}, {}
+        data = {**kwargs['data'], 'since': since, 'limit': 2}
+        for _ in range(5):
+            response = self.request('annotation_changes:cursor', data=data).json()
+            changes.update((change['id'], change) for change in response['changes'])
+            tombstones.update((tombstone['id'], tombstone['revision']) for tombstone in response['deleted'])
+            if not response['next_cursor']:
+                break
+            data['cursor'] = response['next_cursor']
+        self.assertIsNone(response['next_cursor'])
+        self.assertEqual(set(changes), {created[1]['id'], created[3]['id'], created[4]['id']})
+        self.assertEqual(changes[updated]['x'], 9)
+        self.assertEqual(set(tombstones), {deleted, created[2]['id']})
+        self.assertGreater(changes[updated]['revision'], changes[created[3]['id']]['revision'])
+        self.assertGreater(response['revision'], since)
+
+
+class AnnotationEventsTests(LabelingTestCase):
+    def test_annotation_events(self):
+        annotation = self.file_images[0].annotations.get()
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.request('annotation_batch', 'post', body={'operations': [
+                {'op': 'update', 'id': str(annotation.pk), 'x': 9},
+                {
+                    'op': 'create', 'image_id': str(self.file_images[1].pk), 'label_id': str(self.labels[1].pk),
+                    'type': 'bbox', 'x': 1, 'y': 2, 'width': 3, 'height': 4,
+                },
+            ]})
+        self.async_client.force_login(self.user)
+
+        async def receive(**params):
+            response = await self.async_client.get(reverse('labeling:annotation_events'), params)
+            events = response.streaming_content
+            ready = await anext(events)
+            for callback in callbacks:
+                callback()
+            message = await anext(events)
+            await events.aclose()
+            return ready, message
+
+        def operations(message):
+            event, data = message.decode('utf-8').strip().splitlines()
+            self.assertEqual(event, 'event: annotations')
+            return json.loads(data.removeprefix('data: '))
+
+        ready, message = async_to_sync(receive)(image_id=str(self.file_images[0].pk))
+        revision = Dataset.objects.get(pk=self.file_dataset.pk).revision
+        self.assertEqual(ready, b'event: ready\ndata: {"revision":%d}\n\n' % revision)
+        # Updates carry only the fields that changed
+        self.assertEqual(operations(message), [
+            {'op': 'update', 'id': str(annotation.pk), 'image_id': str(self.file_images[0].pk), 'x': 9}
+        ])
+
+        _, message = async_to_sync(receive)(dataset_id=str(self.file_dataset.pk))
+        by_op = {operation['op']: operation for operation in operations(message)}
+        self.assertEqual(set(by_op), {'create', 'update'})
+        create = by_op['create']
+        self.assertEqual(create['image_id'], str(self.file_images[1].pk))
+        self.assertEqual(create['label_id'], str(self.labels[1].pk))
+        self.assertEqual(create['points'], None)
+
+    def test_events_need_asgi(self):
+        # WSGI workers are threads; they do not hold streams open
+        response = self.request('annotation_events', data={'image_id': str(self.file_images[0].pk)})
+        self.assertEqual(response.status_code, 501)
+
+
+class AsyncViewTests(LabelingTestCase):
+    def test_async_matches_sync(self):
+        self.async_client.force_login(self.user)
+        for name, data in [
+            ('annotation_api', {'image_id': str(self.file_images[0].pk)}),
+            ('annotation_changes', {'dataset_id': str(self.file_dataset.pk)}),
+            ('task_list', {}),
+        ]:
+            with self.subTest(name):
+                response = async_to_sync(self.async_client.get)(reverse(f'labeling:{name}'), data)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.content, self.request(name, data=data).content)
+
+    def test_async_requires_login(self):
+        response = async_to_sync(self.async_client.get)(
+            reverse('labeling:annotation_api'), {'image_id': str(self.file_images[0].pk)}
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].startswith(reverse(settings.LOGIN_URL)))
+
+
+class CounterTests(LabelingTestCase):
+    def counters(self):
+        return {
+            'projects': list(Project.objects.order_by('pk').values_list('pk', 'dataset_count')),
+            'datasets': list(Dataset.objects.order_by('pk').values_list(
+                'pk', 'image_count', 'annotated_count', 'annotation_count'
+            )),
+            'labels': list(LabelCategory.objects.order_by('pk').values_list('pk', 'annotation_count')),
+            'images': list(Image.objects.order_by('pk').values_list('pk', 'annotation_count', 'is_annotated')),
+        }
+
+    def assertCountersMatchRecount(self):
+        # Counters kept up to date incrementally; a full recount must not find anything to change
+        counters = self.counters()
+        recount_images()
+        recount_datasets()
+        recount_labels()
+        recount_projects()
+        self.assertEqual(self.counters(), counters)
+
+    def test_counters_follow_creates_and_deletes(self):
+        self.assertCountersMatchRecount()
+        dataset = Dataset.objects.create(project=self.project, name='Counted')
+        images = []
+        for n in range(3):
+            image = Image(dataset=dataset, width=64, height=48)
+            image.file.save(f'counted-{n}.png', ContentFile(image_bytes('white')), save=False)
+            image.save()
+            images.append(image)
+        annotations = [
+            Annotation.objects.create(
+                image=images[n % 2], label_category=self.labels[n % 3], annotation_type='bbox',
+                x=n, y=0, width=1, height=1, annotator=self.user,
+            )
+            for n in range(5)
+        ]
+        self.assertCountersMatchRecount()
+        dataset.refresh_from_db()
+        self.assertEqual((dataset.image_count, dataset.annotated_count, dataset.annotation_count), (3, 2, 5))
+
+        # Through the API: batch writes, a label change and single deletes
+        self.request('annotation_batch', 'post', body={'operations': [
+            {'op': 'create', 'image_id': str(images[2].pk), 'label_id': str(self.labels[4].pk), 'type': 'bbox',
+             'x': 1, 'y': 1, 'width': 2, 'height': 2},
+            {'op': 'update', 'id': str(annotations[0].pk), 'label_id': str(self.labels[5].pk)},
+            {'op': 'delete', 'id': str(annotations[1].pk)},
+        ]})
+        self.request('annotation_api_detail', 'delete', url_kwargs={'pk': annotations[3].pk})
+        self.assertCountersMatchRecount()
+
+        annotations[2].label_category = self.labels[6]
+        annotations[2].save()
+        images[0].delete()
+        self.assertCountersMatchRecount()
+        self.labels[4].delete()
+        self.assertCountersMatchRecount()
+        dataset.delete()
+        self.assertCountersMatchRecount()
+
+    def test_stale_save_keeps_counters(self):
+        dataset = Dataset.objects.get(pk=self.file_dataset.pk)
+        Annotation.objects.create(
+            image=self.file_images[1], label_category=self.labels[1], annotation_type='bbox',
+            x=1, y=1, width=1, height=1, annotator=self.user,
+        )
+        dataset.name = 'Renamed'
+        dataset.save()
+        dataset.refresh_from_db()
+        self.assertEqual((dataset.name, dataset.annotated_count, dataset.annotation_count), ('Renamed', 2, 2))
+        self.assertCountersMatchRecount()
+
+    def test_recount_command(self):
+        other = Dataset.objects.create(project=self.project, name='Other')
+        Dataset.objects.filter(pk__in=[self.file_dataset.pk, other.pk]).update(
+            image_count=99, annotated_count=99, annotation_count=99
+        )
+        LabelCategory.objects.update(annotation_count=99)
+        Project.objects.update(dataset_count=99)
+
+        call_command('recount', str(self.file_dataset.pk), stdout=io.StringIO())
+        dataset = Dataset.objects.get(pk=self.file_dataset.pk)
+        self.assertEqual((dataset.image_count, dataset.annotated_count, dataset.annotation_count), (3, 1, 1))
+        self.assertEqual(LabelCategory.objects.get(pk=self.labels[0].pk).annotation_count, 1)
+        self.assertEqual(Project.objects.get(pk=self.project.pk).dataset_count, 2)
+        # Only the named datasets are recounted
+        self.assertEqual(Dataset.objects.get(pk=other.pk).image_count, 99)
+
+        call_command('recount', stdout=io.StringIO())
+        self.assertEqual(Dataset.objects.get(pk=other.pk).image_count, 0)
+        self.assertCountersMatchRecount()
+
+        with self.assertRaises(CommandError):
+            call_command('recount', str(uuid.uuid4()), stdout=io.StringIO())
+
+
+class ExportTests(LabelingTestCase):
+    def export(self, format, **data):
+        response = self.client.get(
+            reverse('labeling:export_dataset', kwargs={'dataset_id': self.file_dataset.pk, 'format': format}), data
+        )
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def open_zip(self, content):
+        archive = zipfile.ZipFile(io.BytesIO(content))
+        self.assertIsNone(archive.testzip())
+        return archive
+
+    def test_coco_export(self):
+        export = json.loads(self.export('coco'))
+        self.assertEqual([category['name'] for category in export['categories']], [label.name for label in self.labels])
+        images = {image['file_name']: image for image in export['images'] if 'frame_id' not in image}
+        self.assertEqual(set(images), {image.filename for image in self.file_images})
+        self.assertEqual(len({image['id'] for image in export['images']}), len(export['images']))
+        (annotation,) = (annotation for annotation in export['annotations'] if 'track_id' not in annotation)
+        self.assertEqual(annotation['image_id'], images[self.file_images[0].filename]['id'])
+        self.assertEqual(annotation['category_id'], 1)
+        self.assertEqual(annotation['bbox'], [1, 1, 10, 10])
+        self.assertEqual(annotation['area'], 100)
+
+    def test_yolo_export(self):
+        archive = self.open_zip(self.export('yolo'))
+        names = set(archive.namelist())
+        self.assertLessEqual({'classes.txt', 'data.yaml', 'README.txt'}, names)
+        self.assertFalse(any(name.startswith('images/') for name in names))
+        self.assertEqual(archive.read('classes.txt').decode(), ''.join(f'{label.name}\n' for label in self.labels))
+        labels = [f"labels/{os.path.splitext(image.filename)[0]}.txt" for image in self.file_images]
+        self.assertEqual(archive.read(labels[0]), b'0 0.093750 0.125000 0.156250 0.208333\n')
+        self.assertEqual(archive.read(labels[1]), b'')
+
+    def test_yolo_export_with_images(self):
+        archive = self.open_zip(self.export('yolo', include_images='true'))
+        for image in self.file_images:
+            with default_storage.open(image.file.name, 'rb') as f:
+                self.assertEqual(archive.read(f'images/{image.filename}'), f.read())
+        self.assertNotIn('missing_images.txt', archive.namelist())
+
+    def test_yolo_export_with_unreadable_images(self):
+        missing, failing = self.file_images[1], self.file_images[2]
+        default_storage.delete(missing.file.name)
+        storage_open = default_storage.open
+
+        class FailingReader(io.BytesIO):
+            def read(self, size=-1):
+                if self.tell():
+                    raise OSError('Input/output error')
+                return super().read(size)
+
+        def open_failing(name, mode='rb'):
+            if name != failing.file.name:
+                return storage_open(name, mode)
+            with storage_open(name, mode) as f:
+                return File(FailingReader(f.read()), name=name)
+
+        # Small blocks, so the failing image breaks after its entry has started
+        with mock.patch('labeling.exporters.FILE_READ_SIZE', 16), \
+                mock.patch('labeling.exporters.default_storage.open', open_failing), \
+                self.assertLogs('labeling.exporters', 'WARNING'):
+            archive = self.open_zip(self.export('yolo', include_images='true'))
+        names = archive.namelist()
+        self.assertIn(f'images/{self.file_images[0].filename}', names)
+        self.assertNotIn(f'images/{missing.filename}', names)
+        self.assertEqual(len(archive.read(f'images/{failing.filename}')), 16)
+        report = dict(line.split(': ', 1) for line in archive.read('missing_images.txt').decode().splitlines())
+        self.assertEqual(set(report), {f'images/{missing.filename}', f'images/{failing.filename}'})
+        self.assertTrue(report[f'images/{missing.filename}'].startswith('unreadable'))
+        self.assertTrue(report[f'images/{failing.filename}'].startswith('truncated'))
+
+
+    def test_asgi_streams_chunks(self):
+        self.async_client.force_login(self.user)
+        expected = self.export('coco')
+
+        async def fetch(name, url_kwargs):
+            response = await self.async_client.get(reverse(f'labeling:{name}', kwargs=url_kwargs))
+            self.assertEqual(response.status_code, 200)
+            # A sync iterator here would be read whole with sync_to_async(list)
+            self.assertTrue(response.is_async)
+            return response, b''.join([chunk async for chunk in response.streaming_content])
+
+        export = {'dataset_id': self.file_dataset.pk, 'format': 'coco'}
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            # Served from the cache, then built again after an edit
+            response, content = async_to_sync(fetch)('export_dataset', export)
+            self.assertEqual(content, expected)
+            self.assertEqual(int(response['Content-Length']), len(expected))
+            Dataset.objects.filter(pk=self.file_dataset.pk).update(revision=F('revision') + 1)
+            response, content = async_to_sync(fetch)('export_dataset', export)
+            self.assertNotIn('Content-Length', response)
+            self.assertEqual(json.loads(content)['images'], json.loads(expected)['images'])
+            response, content = async_to_sync(fetch)(
+                'image_derivative', {'pk': self.file_images[0].pk, 'spec': 'thumb'}
+            )
+            self.assertEqual(PILImage.open(io.BytesIO(content)).size, (64, 48))
+
+
+class ExportCacheTests(LabelingTestCase):
+    def store(self, dataset, content):
+        key = export_cache.key(dataset, 'coco', {})
+        self.assertEqual(b''.join(export_cache.stream_and_store(dataset, 'coco', {}, key, [content])), content)
+        return key
+
+    def test_newer_entries_survive_older_exports(self):
+        older = Dataset.objects.get(pk=self.file_dataset.pk)
+        newer = Dataset.objects.get(pk=self.file_dataset.pk)
+        newer.revision += 1
+        older_key = self.store(older, b'older')
+        newer_key = self.store(newer, b'newer')
+        self.assertIsNone(export_cache.get(older, 'coco', {}, older_key))
+
+        # A slow export of the older revision finishing last leaves the newer entry alone
+        older_key = self.store(older, b'older')
+        with open(export_cache.get(newer, 'coco', {}, newer_key), 'rb') as f:
+            self.assertEqual(f.read(), b'newer')
+        self.assertIsNone(export_cache.get(older, 'coco', {}, older_key))
+
+
+class UploadSessionTests(LabelingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.content = image_bytes('orange')
+        response = self.request(
+            'upload_session_list', 'post', url_kwargs={'pk': self.file_dataset.pk},
+            body={'filename': 'resumable.png', 'size': len(self.content), 'kind': 'image'},
+        )
+        self.assertEqual(response.status_code, 201)
+        self.session = {'pk': response.json()['id']}
+
+    def put(self, start, end, data=None, **extra):
+        data = self.content[start:end + 1] if data is None else data
+        return self.request(
+            'upload_session', 'put', url_kwargs=self.session, data=data, content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {start}-{end}/{len(self.content)}', **extra
+        )
+
+    def offset(self):
+        return self.request('upload_session', url_kwargs=self.session).json()['offset']
+
+    def test_resume_upload(self):
+        size = len(self.content)
+        self.assertEqual(self.put(0, 49).json(), {'offset': 50, 'size': size})
+        # A restarted client asks where to continue from
+        offset = self.offset()
+        self.assertEqual(offset, 50)
+        self.assertEqual(self.put(offset, size - 1).json(), {'offset': size, 'size': size})
+        response = self.request('upload_session', 'post', url_kwargs=self.session)
+        self.assertEqual(response.json()['status'], 'completed')
+        image = Image.objects.get(pk=response.json()['image_id'])
+        with image.file.open('rb') as f:
+            self.assertEqual(f.read(), self.content)
+
+    def test_offset_mismatch(self):
+        self.put(0, 49)
+        for start, end in [(0, 49), (80, 99)]:
+            with self.subTest(start=start):
+                response = self.put(start, end)
+                self.assertEqual(response.status_code, 409)
+                self.assertEqual(response.json()['offset'], 50)
+        self.assertEqual(self.offset(), 50)
+        # Finalizing early reports where to continue from
+        response = self.request('upload_session', 'post', url_kwargs=self.session)
+        self.assertEqual((response.status_code, response.json()['offset']), (409, 50))
+
+    def test_invalid_content_length(self):
+        for length in ['many', '-', '1e3']:
+            with self.subTest(length):
+                response = self.put(0, 49, CONTENT_LENGTH=length)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json()['offset'], 0)
+        self.assertEqual(self.put(0, 49, CONTENT_LENGTH='40').status_code, 400)
+
+
+class TaskQueueTests(LabelingTestCase):
+    def setUp(self):
+        super().setUp()
+        handlers = mock.patch.dict(TASK_HANDLERS, {'echo': self.echo, 'fail': self.fail_task})
+        handlers.start()
+        self.addCleanup(handlers.stop)
+
+    @staticmethod
+    def echo(task, report):
+        report(0.5, 'halfway')
+        return task.payload
+
+    @staticmethod
+    def fail_task(task, report):
+        raise RuntimeError('broken payload')
+
+    def test_claim_tasks(self):
+        tasks = [Task.objects.create(kind='echo', payload={'n': n}) for n in range(3)]
+        first = claim_tasks(2, worker='first')
+        # Oldest first; the fixture's task predates these
+        self.assertEqual(first, [self.task.pk, tasks[0].pk])
+        self.assertEqual(claim_tasks(5, worker='second'), [tasks[1].pk, tasks[2].pk])
+        self.assertEqual(claim_tasks(5, worker='third'), [])
+        task = Task.objects.get(pk=tasks[0].pk)
+        self.assertEqual((task.status, task.worker, task.attempts), ('running', 'first', 1))
+        self.assertIsNotNone(task.heartbeat_at)
+
+    def test_lapsed_tasks_are_reclaimed(self):
+        Task.objects.filter(pk=self.task.pk).update(status='succeeded')
+        lapsed = timezone.now() - timedelta(seconds=301)
+        alive, dead, exhausted = (
+            Task.objects.create(kind='echo', status='running', worker=worker, attempts=attempts, heartbeat_at=at)
+            for worker, attempts, at in [('alive', 1, timezone.now()), ('dead', 1, lapsed), ('dead', 3, lapsed)]
+        )
+        self.assertEqual(heartbeat([alive.pk, dead.pk], 'alive'), 1)
+        self.assertEqual(claim_tasks(5, worker='new'), [dead.pk])
+        dead.refresh_from_db()
+        self.assertEqual((dead.status, dead.worker, dead.attempts), ('running', 'new', 2))
+        exhausted.refresh_from_db()
+        self.assertEqual(exhausted.status, 'failed')
+        self.assertIsNotNone(exhausted.finished_at)
+        alive.refresh_from_db()
+        self.assertEqual(alive.worker, 'alive')
+
+    def test_run_task(self):
+        task = Task.objects.create(kind='echo', payload={'n': 1})
+        claim_tasks(5, worker='worker')
+        self.assertTrue(run_task(task.pk))
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.progress, task.result), ('succeeded', 1.0, {'n': 1}))
+        self.assertEqual(task.message, 'halfway')
+        self.assertIsNotNone(task.finished_at)
+
+    def test_run_task_failure(self):
+        task = Task.objects.create(kind='fail')
+        claim_tasks(5, worker='worker')
+        self.assertFalse(run_task(task.pk))
+        task.refresh_from_db()
+        self.assertEqual(task.status, 'failed')
+        self.assertIn('RuntimeError: broken payload', task.error)
+
+    def test_reclaimed_task_keeps_the_retry_outcome(self):
+        task = Task.objects.create(kind='echo')
+
+        def reclaimed(task, report):
+            # Another worker took the task over while this one was presumed dead
+            Task.objects.filter(pk=task.pk).update(worker='retry', attempts=F('attempts') + 1)
+            report(0.9)
+            return 'stale'
+
+        claim_tasks(5, worker='worker')
+        with mock.patch.dict(TASK_HANDLERS, {'echo': reclaimed}):
+            run_task(task.pk)
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.worker, task.result, task.progress), ('running', 'retry', None, 0))
+
+    def test_reclaimed_task_survives_worker_failures(self):
+        Task.objects.filter(pk=self.task.pk).update(status='succeeded')
+        task = Task.objects.create(kind='echo')
+        command = runworker.Command(stdout=io.StringIO())
+        command.processes, command.poll_interval, command.name = 1, 0.01, 'parent'
+        wait = runworker.wait
+
+        def reclaimed_while_waiting(*args, **kwargs):
+            # The parent's lease lapsed and another worker took the task over
+            result = wait(*args, **kwargs)
+            Task.objects.filter(pk=task.pk).update(worker='retry', attempts=F('attempts') + 1)
+            return result
+
+        def child_died(task_id):
+            raise RuntimeError('child died')
+
+        with mock.patch.object(command, 'new_pool', lambda: ThreadPoolExecutor(1)), \
+                mock.patch.object(runworker, 'run_task', child_died), \
+                mock.patch.object(runworker, 'wait', reclaimed_while_waiting):
+            self.assertFalse(command.run_pool(once=True))
+        self.assertIn(f'Task {task.pk} failed', command.stdout.getvalue())
+        # Neither the failed future nor the broken pool path touches the retry
+        command.fail_running({None: (task.pk, 1)})
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.worker, task.attempts), ('running', 'retry', 2))
+
+        command.name = 'retry'
+        command.fail_running({None: (task.pk, 2)})
+        task.refresh_from_db()
+        self.assertEqual(task.status, 'failed')
+
+
+@skipUnlessDBFeature('has_select_for_update_skip_locked')
+class TaskClaimLockingTests(TransactionTestCase):
+    def test_claim_skips_locked_tasks(self):
+        locked, free = Task.objects.create(kind='echo'), Task.objects.create(kind='echo')
+        claimed = []
+
+        def claim():
+            try:
+                claimed.extend(claim_tasks(5, worker='other'))
+            finally:
+                connection.close()
+
+        with transaction.atomic():
+            # Another worker is in the middle of claiming this one
+            Task.objects.select_for_update().get(pk=locked.pk)
+            thread = threading.Thread(target=claim)
+            thread.start()
+            thread.join(10)
+        self.assertEqual(claimed, [free.pk])
+
+
+class ImportTests(LabelingTestCase):
+    def setUp(self):
+        super().setUp()
+        self.dataset = Dataset.objects.create(project=self.project, name='Imported', dataset_type='sequential')
+        self.source = tempfile.mkdtemp(dir=self.tmpdir)
+        self.checkpoint = os.path.join(self.tmpdir, 'import-checkpoint.json')
+        self.addCleanup(remove_checkpoint, self.checkpoint)
+        colors = ['red', 'green', 'blue', 'white', 'black']
+        for n, color in enumerate(colors):
+            with open(os.path.join(self.source, f'frame_{n * 5}.png'), 'wb') as f:
+                f.write(image_bytes(color))
+
+    def run_import(self, **kwargs):
+        return list(import_images(self.dataset, self.source, processes=1, checkpoint=self.checkpoint, **kwargs))
+
+    def imported(self):
+        return list(self.dataset.images.order_by('sequence_number').values_list('filename', 'sequence_number'))
+
+    def test_import_directory(self):
+        with open(os.path.join(self.source, 'zz-copy.png'), 'wb') as f:
+            f.write(image_bytes('red'))
+        with open(os.path.join(self.source, 'broken.png'), 'wb') as f:
+            f.write(b'not an image')
+        with open(os.path.join(self.source, 'notes.txt'), 'w') as f:
+            f.write('not listed')
+
+        (done, total, images, errors), = self.run_import()
+        self.assertEqual((done, total, len(images)), (7, 7, 5))
+        self.assertEqual(sorted(name for name, _ in errors), ['broken.png', 'zz-copy.png'])
+        # Natural filename order numbers the sequence
+        self.assertEqual(self.imported(), [
+            ('frame_0.png', 2), ('frame_5.png', 3), ('frame_10.png', 4), ('frame_15.png', 5), ('frame_20.png', 6)
+        ])
+        self.assertEqual(Dataset.objects.get(pk=self.dataset.pk).image_count, 5)
+        self.assertFalse(os.path.exists(self.checkpoint))
+        # Hard links by default: the source stays where it was
+        image = self.dataset.images.get(filename='frame_0.png')
+        self.assertTrue(os.path.samefile(image.file.path, os.path.join(self.source, 'frame_0.png')))
+
+    def test_resume_from_checkpoint(self):
+        for mode in ('link', 'move'):
+            with self.subTest(mode):
+                self.dataset = Dataset.objects.create(project=self.project, name=mode, dataset_type='sequential')
+                batches = import_images(
+                    self.dataset, self.source, mode=mode, processes=1, batch_size=2, checkpoint=self.checkpoint
+                )
+                self.assertEqual(next(batches)[:2], (2, 5))
+                # Interrupted after the first batch was committed
+                batches.close()
+                with open(self.checkpoint) as f:
+                    self.assertEqual(json.load(f)['done'], 2)
+                if mode == 'move':
+                    self.assertEqual(len(os.listdir(self.source)), 3)
+
+                progress = [(done, total) for done, total, *_ in self.run_import(mode=mode, batch_size=2)]
+                self.assertEqual(progress, [(4, 5), (5, 5)])
+                self.assertEqual(self.imported(), [
+                    ('frame_0.png', 1), ('frame_5.png', 2), ('frame_10.png', 3), ('frame_15.png', 4),
+                    ('frame_20.png', 5),
+                ])
+                self.assertFalse(os.path.exists(self.checkpoint))
+                self.assertFalse(os.path.exists(self.checkpoint + '.names'))
+        self.assertEqual(os.listdir(self.source), [])
+
+    def test_only_overwrites_own_files(self):
+        directory = os.path.join(settings.MEDIA_ROOT, 'images', str(self.dataset.pk))
+        os.makedirs(directory)
+        # Left half-written by this import before it was interrupted, and a file that is not its own
+        with open(os.path.join(directory, 'frame_0.png'), 'wb') as f:
+            f.write(b'partial')
+        with open(os.path.join(directory, 'frame_5.png'), 'wb') as f:
+            f.write(b'someone else')
+        with open(self.checkpoint, 'w') as f:
+            json.dump({
+                'dataset': str(self.dataset.pk), 'source': os.path.abspath(self.source), 'mode': 'copy', 'total': 5,
+                'done': 0, 'sequence_base': 1, 'placing': {'frame_0.png': f'images/{self.dataset.pk}/frame_0.png'},
+            }, f)
+
+        self.run_import(mode='copy')
+        files = dict(self.dataset.images.values_list('filename', 'file'))
+        self.assertEqual(files['frame_0.png'], f'images/{self.dataset.pk}/frame_0.png')
+        with open(os.path.join(directory, 'frame_0.png'), 'rb') as f:
+            self.assertEqual(f.read(), image_bytes('red'))
+        with open(os.path.join(directory, 'frame_5.png'), 'rb') as f:
+            self.assertEqual(f.read(), b'someone else')
+        self.assertNotIn('frame_5.png', files)
+        self.assertEqual(len(files), 5)
+
+    def test_command(self):
+        stdout = io.StringIO()
+        call_command(
+            'import_images', str(self.dataset.pk), self.source, '--processes', '1', '--no-derivatives',
+            '--checkpoint', self.checkpoint, stdout=stdout, stderr=io.StringIO(),
+        )
+        self.assertIn('Done: 5 imported, 0 skipped', stdout.getvalue())
+        for dataset_id in ['not-a-uuid', str(uuid.uuid4())]:
+            with self.subTest(dataset_id), self.assertRaises(CommandError):
+                call_command('import_images', dataset_id, self.source, stdout=io.StringIO())
+
+
+def flip_bits(value, bits):
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+
+class NearDuplicateTests(LabelingTestCase):
+    def test_matches_at_radius(self):
+        value = 0x0123_4567_89AB_CDEF
+        index = HashIndex([(value, 'exact')])
+        self.assertEqual(index.search(value, 0), [('exact', 0)])
+        for radius in (0, 3, 4, 8, 16):
+            # Spread over every band, and all in one band, where only the other bands still agree
+            for bits in ([i % 4 * 16 + i // 4 for i in range(radius)], list(range(radius))):
+                with self.subTest(radius=radius, bits=list(bits)):
+                    query = flip_bits(value, bits)
+                    self.assertEqual(index.search(query, radius), [('exact', radius)])
+                    further = flip_bits(query, [63 - bit for bit in range(radius + 1) if 63 - bit not in bits][:1])
+                    self.assertEqual(index.search(further, radius), [])
+
+    def test_matches_brute_force(self):
+        rng = random.Random(7)
+        base = [rng.getrandbits(64) for _ in range(20)]
+        # Clusters of near misses around a few hashes, plus unrelated ones
+        hashes = base + [flip_bits(rng.choice(base), rng.sample(range(64), rng.randint(1, 20))) for _ in range(2000)]
+        index = HashIndex((value, n) for n, value in enumerate(hashes))
+        for query in base[:5] + [rng.getrandbits(64)]:
+            for radius in (0, 5, 8, 12, 16):
+                expected = sorted((n, (value ^ query).bit_count()) for n, value in enumerate(hashes)
+                                  if (value ^ query).bit_count() <= radius)
+                self.assertEqual(sorted(index.search(query, radius)), expected)
+
+    def test_index_follows_uploads(self):
+        # Stored as signed 64-bit integers
+        hashes = [0x7000_0000_0000_0000, -1, 0x7000_0000_0000_000F]
+        for image, value in zip(self.file_images, hashes):
+            Image.objects.filter(pk=image.pk).update(perceptual_hash=value)
+        scope = {'dataset_id': self.file_dataset.pk}
+        index = hash_index(**scope)
+        self.assertEqual(len(index), 3)
+        image = Image.objects.get(pk=self.file_images[0].pk)
+        self.assertEqual(near_duplicates(image, 4, **scope), [(self.file_images[2].pk, 4)])
+
+        added = Image(dataset=self.file_dataset, width=64, height=48, perceptual_hash=hashes[0] ^ 1)
+        added.file.save('added.png', ContentFile(image_bytes('red')), save=False)
+        added.save()
+        # Extended in place rather than rebuilt
+        self.assertIs(hash_index(**scope), index)
+        self.assertEqual(len(index), 4)
+        self.assertEqual(near_duplicates(image, 4, **scope), [(added.pk, 1), (self.file_images[2].pk, 4)])
+
+        added.delete()
+        self.assertIsNot(hash_index(**scope), index)
+        self.assertEqual(near_duplicates(image, 4, **scope), [(self.file_images[2].pk, 4)])
+
+
+class GeometryMigrationTests(TransactionTestCase):
+    before = [('labeling', '0010_track')]
+    after = [('labeling', '0011_annotation_geometry')]
+
+    def setUp(self):
+        self.migrate(self.before)
+        self.addCleanup(self.migrate, MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def create_annotations(self, points):
+        apps = MigrationExecutor(connection).loader.project_state(self.before).apps
+        user = apps.get_model('auth', 'User').objects.create(username='migrator')
+        project = apps.get_model('labeling', 'Project').objects.create(name='Old', owner_id=user.pk)
+        label = apps.get_model('labeling', 'LabelCategory').objects.create(project_id=project.pk, name='old')
+        dataset = apps.get_model('labeling', 'Dataset').objects.create(project_id=project.pk, name='Old')
+        image = apps.get_model('labeling', 'Image').objects.create(
+            dataset_id=dataset.pk, file='images/old.png', filename='old.png', width=10, height=10, size=100,
+        )
+        Annotation = apps.get_model('labeling', 'Annotation')
+        return [
+            Annotation.objects.create(
+                image_id=image.pk, label_category_id=label.pk, annotation_type='polygon', annotator_id=user.pk,
+                x=0, y=0, width=1, height=1, points=value,
+            ).pk
+            for value in points
+        ]
+
+    def test_points_are_packed(self):
+        polygon, flat, mask = self.create_annotations([
+            [[1, 2], [3, 4.5]], [1, 2, 3, 4], {'size': [2, 2], 'counts': [1, 3]},
+        ])
+        Annotation = self.migrate(self.after).get_model('labeling', 'Annotation')
+        geometry = dict(Annotation.objects.values_list('pk', 'geometry'))
+        self.assertEqual(unpack_geometry(geometry[polygon]), [[1, 2], [3, 4.5]])
+        self.assertEqual(unpack_geometry(geometry[flat]), [[1, 2], [3, 4]])
+        self.assertEqual(unpack_geometry(geometry[mask]), {'size': [2, 2], 'counts': [1, 3]})
+
+    def test_unconvertible_points_stop_the_migration(self):
+        valid, *invalid = self.create_annotations([
+            [[1, 2]], [[1, 2, 2]], [1, 2, 3], 'outline', {'counts': [4]},
+        ])
+        with self.assertRaises(ValueError) as raised:
+            self.migrate(self.after)
+        message = str(raised.exception)
+        self.assertIn('4 annotations', message)
+        for pk in invalid:
+            self.assertIn(str(pk), message)
+        self.assertNotIn(str(valid), message)
+        # Nothing was dropped
+        Annotation = MigrationExecutor(connection).loader.project_state(self.before).apps.get_model(
+            'labeling', 'Annotation'
+        )
+        self.assertEqual(Annotation.objects.get(pk=invalid[0]).points, [[1, 2, 2]])
+        # Once they are dealt with, the migration goes through
+        Annotation.objects.filter(pk__in=invalid).delete()
+        self.migrate(self.after)
@@ -0,0 +1,193 @@
+"""
+DeepZoom-style tile pyramids for very large images.
+
+Level ``max_level`` is the original resolution and every level below it
+halves both dimensions (rounding up) down to a single pixel at level 0.
+Tiles are ``TILE_SIZE`` pixels square without overlap, so the tile at
+(level, x, y) covers full-resolution pixels
+``[x * TILE_SIZE * 2**(max_level - level), ...)``. Annotation coordinates
+therefore stay in full-resolution pixel space; only the display changes.
+
+A whole pyramid is cut from a single decode of the original and kept in
+``TILE_CACHE_DIR``, one directory per image, evicted least recently used
+first once the cache grows past ``TILE_CACHE_MAX_BYTES``.
+"""
+import hashlib
+import math
+import os
+import shutil
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from PIL import Image as PILImage
+
+from .derivatives import to_display_mode
+
+
+TILE_SIZE = 256
+TILE_FORMATS = {
+    'jpg': ('JPEG', 'image/jpeg', {'quality': 85}),
+    'png': ('PNG', 'image/png', {}),
+    'webp': ('WEBP', 'image/webp', {'quality': 85}),
+}
+# Images whose longest edge exceeds this are shown tiled in the annotation canvas
+TILE_THRESHOLD = 4096
+# Bump to invalidate every cached pyramid after changing how tiles are rendered
+TILE_VERSION = 1
+
+DEFAULT_MAX_BYTES = 20 * 1024 ** 3
+BUILD_WAIT_SECONDS = 120
+STALE_LOCK_SECONDS = 30 * 60
+
+
+def max_level(width, height):
+    return max(0, math.ceil(math.log2(max(width, height, 1))))
+
+
+def level_size(width, height, level):
+    scale = 2 ** (max_level(width, height) - level)
+    return math.ceil(width / scale), math.ceil(height / scale)
+
+
+def tile_source(width, height):
+    """Pyramid descriptor handed to the canvas."""
+    top = max_level(width, height)
+    return {
+        'width': width,
+        'height': height,
+        'tile_size': TILE_SIZE,
+        'max_level': top,
+        'levels': [level_size(width, height, level) for level in range(top + 1)],
+    }
+
+
+def _cache_root():
+    return str(getattr(settings, 'TILE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'labeling_tile_cache')))
+
+
+def pyramid_dir(image, fmt):
+    """Cache directory for ``image`` (a values() dict with id, file and size)."""
+    digest = hashlib.sha256(
+        f"{image['file']}:{image['size']}:{fmt}:{TILE_SIZE}:{TILE_VERSION}".encode('utf-8')
+    ).hexdigest()[:16]
+    return os.path.join(_cache_root(), f"{image['id']}-{digest}")
+
+
+def tile_path(directory, level, x, y, fmt):
+    return os.path.join(directory, str(level), f'{x}_{y}.{fmt}')
+
+
+def build_pyramid(image, fmt='jpg'):
+    """
+    Decode ``image`` once and write every tile of every level.
+
+    Tiles go into a temporary directory that is renamed into place when
+    complete, so readers never see a half-built pyramid.
+    """
+    pil_format, _, save_options = TILE_FORMATS[fmt]
+    directory = pyramid_dir(image, fmt)
+    root = _cache_root()
+    os.makedirs(root, exist_ok=True)
+    work_dir = tempfile.mkdtemp(dir=root, prefix='.building-')
+    try:
+        with default_storage.open(image['file'], 'rb') as source:
+            with PILImage.open(source) as original:
+                original.load()
+                level_image = to_display_mode(original)
+                if pil_format == 'JPEG' and level_image.mode not in ('RGB', 'L'):
+                    level_image = level_image.convert('RGB')
+
+        width, height = level_image.size
+        total = 0
+        for level in range(max_level(width, height), -1, -1):
+            level_dir = os.path.join(work_dir, str(level))
+            os.makedirs(level_dir)
+            level_width, level_height = level_image.size
+            for y in range(math.ceil(level_height / TILE_SIZE)):
+                for x in range(math.ceil(level_width / TILE_SIZE)):
+                    tile = level_image.crop((
+                        x * TILE_SIZE,
+                        y * TILE_SIZE,
+                        min((x + 1) * TILE_SIZE, level_width),
+                        min((y + 1) * TILE_SIZE, level_height),
+                    ))
+                    path = tile_path(work_dir, level, x, y, fmt)
+                    tile.save(path, pil_format, **save_options)
+                    total += os.path.getsize(path)
+            if level:
+                level_image = level_image.reduce(2)
+
+        with open(os.path.join(work_dir, '.complete'), 'w') as f:
+            f.write(str(total))
+        try:
+            os.rename(work_dir, directory)
+        except OSError:
+            # Another process finished the same pyramid first
+            shutil.rmtree(work_dir, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise
+    evict()
+    return directory
+
+
+def ensure_pyramid(image, fmt='jpg'):
+    """Return the pyramid directory for ``image``, building it if needed."""
+    directory = pyramid_dir(image, fmt)
+    if os.path.exists(os.path.join(directory, '.complete')):
+        # Directory mtime is the LRU clock
+        os.utime(directory)
+        return directory
+
+    # One builder per pyramid; everyone else waits for it to land
+    lock = directory + '.lock'
+    os.makedirs(_cache_root(), exist_ok=True)
+    try:
+        if time.time() - os.path.getmtime(lock) > STALE_LOCK_SECONDS:
+            os.remove(lock)
+    except FileNotFoundError:
+        pass
+    try:
+        fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        deadline = time.monotonic() + BUILD_WAIT_SECONDS
+        while time.monotonic() < deadline:
+            if os.path.exists(os.path.join(directory, '.complete')):
+                return directory
+            time.sleep(0.2)
+        raise TimeoutError('Timed out waiting for the tile pyramid to be built')
+
+    try:
+        os.close(fd)
+        return build_pyramid(image, fmt)
+    finally:
+        try:
+            os.remove(lock)
+        except FileNotFoundError:
+            pass
+
+
+def evict():
+    root = _cache_root()
+    entries = []
+    total = 0
+    for entry in os.scandir(root):
+        if not entry.is_dir() or entry.name.startswith('.'):
+            continue
+        try:
+            with open(os.path.join(entry.path, '.complete')) as f:
+                size = int(f.read() or 0)
+            mtime = entry.stat().st_mtime
+        except (FileNotFoundError, ValueError):
+            continue
+        entries.append((mtime, size, entry.path))
+        total += size
+
+    max_bytes = getattr(settings, 'TILE_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
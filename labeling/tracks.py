@@ -0,0 +1,126 @@
+"""
+Keyframe storage and interpolation for video object tracks.
+
+A ``Track`` stores an object's label and identity once, and its boxes only
+at keyframes, packed back to back into one binary column instead of one
+``Annotation`` row per frame. A keyframe is ``(frame, x, y, width, height,
+outside)``; between two keyframes the box moves linearly, and an
+``outside`` keyframe means the object is out of view until the next
+keyframe. A track ends at its last keyframe.
+
+Per-frame boxes are only materialized on demand, by ``interpolate``, for
+the canvas and for exports.
+"""
+import bisect
+import math
+import struct
+
+
+# frame number, x, y, width, height, flags
+KEYFRAME = struct.Struct('<i4fB')
+OUTSIDE = 1
+# Largest values the packed int32 frame and float32 coordinates can hold
+MAX_FRAME = 2 ** 31 - 1
+MAX_COORDINATE = 3.4028234663852886e38
+# float32 keeps about 7 significant digits; coordinates are rounded to what survives
+PRECISION = 3
+
+
+class InvalidKeyframes(ValueError):
+    pass
+
+
+def _frame(value):
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise InvalidKeyframes('frame numbers must be whole numbers')
+        value = int(value)
+    frame = int(value)
+    if not 0 <= frame <= MAX_FRAME:
+        raise InvalidKeyframes(f'frame numbers must be between 0 and {MAX_FRAME}')
+    return frame
+
+
+def _coordinate(value):
+    number = float(value)
+    if not math.isfinite(number) or abs(number) > MAX_COORDINATE:
+        raise InvalidKeyframes('box coordinates must be finite and within single precision range')
+    return number
+
+
+def parse_keyframes(values):
+    """
+    Validate ``[frame, x, y, width, height, outside?]`` lists (as sent by
+    the canvas) into sorted keyframe tuples; a later duplicate frame wins.
+    Anything ``pack_keyframes`` could not store exactly as given, such as a
+    fractional or out of range frame or a non-finite coordinate, is rejected.
+    """
+    if not isinstance(values, list) or not values:
+        raise InvalidKeyframes('keyframes must be a non-empty list')
+    keyframes = {}
+    for value in values:
+        if not isinstance(value, (list, tuple)) or len(value) not in (5, 6):
+            raise InvalidKeyframes('each keyframe must be [frame, x, y, width, height, outside?]')
+        try:
+            frame = _frame(value[0])
+            x, y, width, height = (_coordinate(number) for number in value[1:5])
+        except InvalidKeyframes:
+            raise
+        except (TypeError, ValueError, OverflowError):
+            raise InvalidKeyframes('keyframe values must be numbers')
+        if width < 0 or height < 0:
+            raise InvalidKeyframes('box sizes must not be negative')
+        keyframes[frame] = (frame, x, y, width, height, bool(value[5]) if len(value) == 6 else False)
+    return sorted(keyframes.values())
+
+
+def pack_keyframes(keyframes):
+    """Pack sorted keyframe tuples into bytes."""
+    return b''.join(
+        KEYFRAME.pack(frame, x, y, width, height, OUTSIDE if outside else 0)
+        for frame, x, y, width, height, outside in keyframes
+    )
+
+
+def unpack_keyframes(data):
+    """Keyframe tuples from bytes written by ``pack_keyframes``."""
+    return [
+        (frame, *(round(value, PRECISION) for value in (x, y, width, height)), bool(flags & OUTSIDE))
+        for frame, x, y, width, height, flags in KEYFRAME.iter_unpack(bytes(data))
+    ]
+
+
+def interpolate(keyframes, frames=None):
+    """
+    Yield ``(frame, x, y, width, height)`` for each of the sorted
+    ``frames`` the object is visible in, or for every such frame of the
+    track when ``frames`` is None.
+    """
+    if not keyframes:
+        return
+    first, last = keyframes[0][0], keyframes[-1][0]
+    if frames is None:
+        frames = range(first, last + 1)
+    starts = [keyframe[0] for keyframe in keyframes]
+    index = 0
+    for n in frames:
+        if n < first or n > last:
+            continue
+        # Frames are sorted, so the enclosing keyframe pair only moves forward
+        if starts[index] > n or (index + 1 < len(starts) and starts[index + 1] <= n):
+            index = bisect.bisect_right(starts, n, index if starts[index] <= n else 0) - 1
+        frame, x, y, width, height, outside = keyframes[index]
+        if outside:
+            continue
+        if n == frame or index + 1 == len(keyframes):
+            yield n, x, y, width, height
+            continue
+        next_frame, next_x, next_y, next_width, next_height, _ = keyframes[index + 1]
+        t = (n - frame) / (next_frame - frame)
+        yield (
+            n,
+            round(x + (next_x - x) * t, PRECISION),
+            round(y + (next_y - y) * t, PRECISION),
+            round(width + (next_width - width) * t, PRECISION),
+            round(height + (next_height - height) * t, PRECISION),
+        )
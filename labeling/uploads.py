@@ -0,0 +1,182 @@
+"""
+Resumable chunked uploads.
+
+A client opens an ``UploadSession`` for one file, sends its bytes with
+``PUT`` requests carrying a ``Content-Range`` header, and finalizes the
+session once the last byte has landed. Chunks are streamed from the
+request straight onto an append-only ``.part`` file in
+``UPLOAD_SESSION_DIR``; the size of that file is the session offset, so
+after a dropped connection the client asks for the offset and resends
+only what is missing. Finalizing moves the part file into storage by
+rename and registers it as an ``Image`` or ``Video``.
+"""
+import os
+import re
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.validators import FileExtensionValidator
+from django.db import transaction
+
+from .dedup import existing_hashes
+from .ingest import inspect_image
+from .models import Image, UploadSession, Video
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+DEFAULT_MAX_BYTES = 50 * 1024 ** 3
+READ_SIZE = 1024 * 1024
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+
+
+class UploadError(ValueError):
+    pass
+
+
+class OffsetMismatch(UploadError):
+    """The chunk does not start where the stored bytes end."""
+
+    def __init__(self, offset):
+        super().__init__(f'Upload is at offset {offset}')
+        self.offset = offset
+
+
+class DuplicateUpload(UploadError):
+    """The uploaded image is byte-identical to one already in the dataset."""
+
+    def __init__(self, filename):
+        super().__init__(f'Duplicate of {filename}')
+        self.filename = filename
+
+
+class PartFile(File):
+    """A finished part file; storage moves it into place instead of copying it."""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def upload_root():
+    return str(getattr(settings, 'UPLOAD_SESSION_DIR', os.path.join(tempfile.gettempdir(), 'labeling_uploads')))
+
+
+def max_upload_bytes():
+    return getattr(settings, 'UPLOAD_SESSION_MAX_BYTES', DEFAULT_MAX_BYTES)
+
+
+def part_path(session):
+    return os.path.join(upload_root(), f'{session.pk}.part')
+
+
+def current_offset(session):
+    try:
+        return os.path.getsize(part_path(session))
+    except FileNotFoundError:
+        return 0
+
+
+def allowed_extensions(kind):
+    model = Video if kind == 'video' else Image
+    for validator in model._meta.get_field('file').validators:
+        if isinstance(validator, FileExtensionValidator):
+            return validator.allowed_extensions
+    return None
+
+
+def parse_content_range(header, size):
+    """Return ``(start, length)`` for a ``Content-Range: bytes start-end/total`` header."""
+    match = CONTENT_RANGE_RE.match(header or '')
+    if not match:
+        raise UploadError('Content-Range header must be "bytes start-end/total"')
+    start, end, total = match.groups()
+    start, end = int(start), int(end)
+    if total != '*' and int(total) != size:
+        raise UploadError(f'Upload size is {size} bytes, not {total}')
+    if end < start or end >= size:
+        raise UploadError('Content-Range is outside the upload')
+    return start, end - start + 1
+
+
+def append_chunk(session, start, length, stream):
+    """
+    Append ``length`` bytes read from ``stream`` at ``start``; returns the new offset.
+
+    Bytes are written as they arrive, so a connection dropped mid-chunk
+    still advances the offset by whatever made it to disk.
+    """
+    if start + length > session.size:
+        raise UploadError('Chunk extends past the end of the upload')
+
+    os.makedirs(upload_root(), exist_ok=True)
+    with open(part_path(session), 'ab') as f:
+        if fcntl is not None:
+            # Held until the file is closed; serializes retries of the same chunk
+            fcntl.flock(f, fcntl.LOCK_EX)
+        offset = f.seek(0, os.SEEK_END)
+        if offset != start:
+            raise OffsetMismatch(offset)
+
+        remaining = length
+        while remaining:
+            data = stream.read(min(READ_SIZE, remaining))
+            if not data:
+                break
+            f.write(data)
+            remaining -= len(data)
+        return f.tell()
+
+
+def finalize_upload(session):
+    """Register the completed upload as an ``Image`` or ``Video`` and return it."""
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(pk=session.pk)
+        if session.status == 'completed':
+            return session.image or session.video
+
+        path = part_path(session)
+        offset = current_offset(session)
+        if offset != session.size:
+            raise OffsetMismatch(offset)
+
+        with open(path, 'rb') as f:
+            if session.kind == 'video':
+                obj = Video(dataset=session.dataset)
+            else:
+                width, height, digest, phash = inspect_image(f)
+                duplicate_of = existing_hashes(session.dataset, [digest]).get(digest)
+                if duplicate_of:
+                    raise DuplicateUpload(duplicate_of)
+                obj = Image(
+                    dataset=session.dataset,
+                    width=width,
+                    height=height,
+                    content_hash=digest,
+                    perceptual_hash=phash
+                )
+            try:
+                # Store first so the row records the name storage settled on
+                obj.file.save(session.filename, PartFile(f, name=session.filename), save=False)
+                obj.save()
+                session.status = 'completed'
+                setattr(session, session.kind, obj)
+                session.save(update_fields=['status', session.kind, 'updated_at'])
+            except Exception:
+                if obj.file._committed:
+                    obj.file.storage.delete(obj.file.name)
+                raise
+    return obj
+
+
+def discard_upload(session):
+    """Delete ``session`` along with any bytes received so far."""
+    try:
+        os.remove(part_path(session))
+    except FileNotFoundError:
+        pass
+    session.delete()
@@ -17,12 +17,32 @@ urlpatterns = [
     
     path('images/<uuid:pk>/', views.ImageDetailView.as_view(), name='image_detail'),
     path('images/<uuid:pk>/annotate/', views.AnnotationView.as_view(), name='annotate_image'),
+    path('images/<uuid:pk>/duplicates/', views.ImageDuplicatesView.as_view(), name='image_duplicates'),
+    path('images/<uuid:pk>/derivatives/<str:spec>/', views.ImageDerivativeView.as_view(), name='image_derivative'),
+    path('images/<uuid:pk>/tiles/', views.ImageTileSourceView.as_view(), name='image_tile_source'),
+    path('images/<uuid:pk>/tiles/<int:level>/<int:x>_<int:y>.<str:fmt>', views.ImageTileView.as_view(), name='image_tile'),
     
+    path('videos/<uuid:pk>/frames/', views.VideoFrameSourceView.as_view(), name='video_frame_source'),
+    path('videos/<uuid:pk>/frames/<int:frame>.jpg', views.VideoFrameView.as_view(), name='video_frame'),
+    path('api/videos/<uuid:pk>/extract/', views.VideoExtractView.as_view(), name='video_extract'),
+    path('api/videos/<uuid:pk>/tracks/', views.VideoTrackListView.as_view(), name='video_tracks'),
+    path('api/tracks/<uuid:pk>/', views.TrackView.as_view(), name='track_detail'),
+    
+    path('api/datasets/<uuid:pk>/images/', views.DatasetImagesAPIView.as_view(), name='dataset_images_api'),
     path('api/annotations/', views.AnnotationAPIView.as_view(), name='annotation_api'),
+    path('api/annotations/batch/', views.AnnotationBatchView.as_view(), name='annotation_batch'),
+    path('api/annotations/changes/', views.AnnotationChangesView.as_view(), name='annotation_changes'),
+    path('api/annotations/events/', views.AnnotationEventsView.as_view(), name='annotation_events'),
     path('api/annotations/<uuid:pk>/', views.AnnotationAPIView.as_view(), name='annotation_api_detail'),
     
     path('export/<uuid:dataset_id>/<str:format>/', views.ExportDatasetView.as_view(), name='export_dataset'),
     
+    path('api/datasets/<uuid:pk>/uploads/', views.UploadSessionListView.as_view(), name='upload_session_list'),
+    path('api/uploads/<uuid:pk>/', views.UploadSessionView.as_view(), name='upload_session'),
+    
+    path('api/tasks/', views.TaskListView.as_view(), name='task_list'),
+    path('api/tasks/<uuid:pk>/', views.TaskDetailView.as_view(), name='task_detail'),
+    
     # Authentication
     path('login/', LoginView.as_view(template_name='labeling/login.html', next_page='labeling:project_list'), name='login'),
     path('logout/', LogoutView.as_view(next_page='labeling:project_list'), name='logout'),
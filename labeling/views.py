@@ -1,17 +1,64 @@
-from django.shortcuts import render, get_object_or_404, redirect
+from django.shortcuts import render, get_object_or_404, aget_object_or_404, redirect
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, View
-from django.contrib.auth.mixins import LoginRequiredMixin
-from django.urls import reverse_lazy
-from django.http import JsonResponse, HttpResponse
+from django.contrib.auth.mixins import AccessMixin, LoginRequiredMixin
+from django.urls import reverse, reverse_lazy
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse, FileResponse
 from django.contrib import messages
+from django.core.exceptions import ValidationError
+from django.core.handlers.asgi import ASGIRequest
 from django.core.files.storage import default_storage
+from django.db import IntegrityError
+from django.db.models import Exists, OuterRef, Prefetch
 from django.forms import modelformset_factory
+from django.utils.cache import get_conditional_response
+from asgiref.sync import sync_to_async
 from PIL import Image as PILImage
+import asyncio
 import json
 import os
+import uuid
 
-from .models import Project, Dataset, Image, Video, Annotation, LabelCategory, AnnotationSession
+from .models import (
+    Project, Dataset, Image, Video, Annotation, AnnotationTombstone, LabelCategory, AnnotationSession, Task, Track,
+    UploadSession
+)
+from .annotations import AnnotationBatchError, apply_annotation_batch
+from .dedup import near_duplicates
+from .events import (
+    FIELD_NAMES, RESYNC, annotation_operation, channel_name, get_broker, publish_annotations, server_sent_event
+)
+from .derivatives import DERIVATIVE_CONTENT_TYPE, DERIVATIVE_SPECS, ensure_derivative
+from .export_cache import export_cache
+from .exporters import iter_export
+from .ingest import ingest_uploads
+from .frames import FrameNotFound, VideoDecodeError, frame_source, get_frame
 from .forms import ProjectForm, DatasetForm, ImageUploadForm, AnnotationForm
+from .pagination import (
+    IMAGE_KEYSET_ORDERING, InvalidCursor, change_cursor, changes_after, decode_change_cursor, image_cursor,
+    images_after
+)
+from .serializers import (
+    ANNOTATION_SHAPES, aimage_annotations, annotation_data, annotation_rows, dumps, image_annotations,
+    image_annotations_etag, json_response
+)
+from .tasks import enqueue, enqueue_ingest
+from .tiles import TILE_FORMATS, TILE_THRESHOLD, ensure_pyramid, tile_path, tile_source
+from .tracks import parse_keyframes
+from .uploads import (
+    DuplicateUpload, OffsetMismatch, UploadError, allowed_extensions, append_chunk, current_offset, discard_upload,
+    finalize_upload, max_upload_bytes, parse_content_range
+)
+
+
+class AsyncLoginRequiredMixin(AccessMixin):
+    """``LoginRequiredMixin`` for views whose handlers are coroutines."""
+    
+    async def dispatch(self, request, *args, **kwargs):
+        # Resolve the lazy user here; touching request.user from a coroutine would query synchronously
+        request.user = await request.auser()
+        if not request.user.is_authenticated:
+            return self.handle_no_permission()
+        return await super().dispatch(request, *args, **kwargs)
 
 
 class ProjectListView(LoginRequiredMixin, ListView):
@@ -81,6 +128,103 @@ class DatasetDetailView(LoginRequiredMixin, DetailView):
     
     def get_queryset(self):
         return Dataset.objects.filter(project__owner=self.request.user)
+    
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['image_count'] = self.object.image_count
+        context['annotated_count'] = self.object.annotated_count
+        context['next_unannotated'] = self.object.images.filter(is_annotated=False).order_by(*IMAGE_KEYSET_ORDERING).first()
+        return context
+
+
+class DatasetImagesAPIView(AsyncLoginRequiredMixin, View):
+    """
+    Keyset-paginated image listing for the dataset grid.
+
+    Each page costs a fixed number of queries: the dataset lookup, the
+    project's labels, one page of images with annotation counts, and one
+    query for the bounding boxes of the images on that page.
+    """
+    default_limit = 48
+    max_limit = 200
+    
+    async def get(self, request, pk):
+        dataset = await aget_object_or_404(Dataset, pk=pk, project__owner=request.user)
+        
+        try:
+            limit = int(request.GET.get('limit', self.default_limit))
+        except ValueError:
+            return JsonResponse({'error': 'limit must be an integer'}, status=400)
+        limit = max(1, min(limit, self.max_limit))
+        
+        images = Image.objects.filter(dataset=dataset)
+        
+        is_annotated = request.GET.get('is_annotated')
+        if is_annotated is not None:
+            if is_annotated.lower() not in ('true', 'false'):
+                return JsonResponse({'error': 'is_annotated must be true or false'}, status=400)
+            images = images.filter(is_annotated=is_annotated.lower() == 'true')
+        
+        labels = [
+            label async for label in
+            LabelCategory.objects.filter(project_id=dataset.project_id).values('id', 'name', 'color')
+        ]
+        label_index = {label['id']: idx for idx, label in enumerate(labels)}
+        
+        label_id = request.GET.get('label')
+        if label_id:
+            try:
+                label_id = uuid.UUID(label_id)
+            except ValueError:
+                return JsonResponse({'error': 'label must be a label id'}, status=400)
+            images = images.filter(Exists(
+                Annotation.objects.filter(image=OuterRef('pk'), label_category_id=label_id)
+            ))
+        
+        cursor = request.GET.get('cursor')
+        if cursor:
+            try:
+                images = images_after(images, cursor)
+            except InvalidCursor as e:
+                return JsonResponse({'error': str(e)}, status=400)
+        
+        # Fetch one extra row to learn whether another page exists.
+        page = [
+            row async for row in images.order_by(*IMAGE_KEYSET_ORDERING)
+            .values('id', 'file', 'filename', 'width', 'height', 'sequence_number',
+                    'is_annotated', 'annotation_count')[:limit + 1]
+        ]
+        has_more = len(page) > limit
+        page = page[:limit]
+        
+        boxes = {row['id']: [] for row in page}
+        if page:
+            box_rows = Annotation.objects.filter(
+                image_id__in=list(boxes), annotation_type='bbox'
+            ).order_by().values_list('image_id', 'label_category_id', 'x', 'y', 'width', 'height')
+            async for image_id, category_id, x, y, width, height in box_rows:
+                boxes[image_id].append([label_index.get(category_id), x, y, width, height])
+        
+        return json_response({
+            'labels': [{
+                'id': str(label['id']),
+                'name': label['name'],
+                'color': label['color']
+            } for label in labels],
+            'images': [{
+                'id': str(row['id']),
+                'url': default_storage.url(row['file']),
+                'thumbnail_url': reverse('labeling:image_derivative', kwargs={'pk': row['id'], 'spec': 'thumb'}),
+                'filename': row['filename'],
+                'width': row['width'],
+                'height': row['height'],
+                'sequence_number': row['sequence_number'],
+                'is_annotated': row['is_annotated'],
+                'annotation_count': row['annotation_count'],
+                'boxes': boxes[row['id']]
+            } for row in page],
+            'next_cursor': image_cursor(page[-1]) if has_more else None
+        })
 
 
 class DatasetUpdateView(LoginRequiredMixin, UpdateView):
@@ -111,24 +255,19 @@ class ImageUploadView(LoginRequiredMixin, View):
             messages.error(request, 'No files selected.')
             return redirect('labeling:image_upload', pk=pk)
         
-        uploaded_count = 0
-        for file in files:
-            try:
-                with PILImage.open(file) as img:
-                    width, height = img.size
-                
-                image = Image.objects.create(
-                    dataset=dataset,
-                    file=file,
-                    width=width,
-                    height=height
-                )
-                uploaded_count += 1
-            except Exception as e:
-                messages.error(request, f'Error uploading {file.name}: {str(e)}')
-        
-        if uploaded_count:
-            messages.success(request, f'Successfully uploaded {uploaded_count} images.')
+        try:
+            images, errors = ingest_uploads(dataset, files)
+        except Exception as e:
+            messages.error(request, f'Error saving uploaded images: {str(e)}')
+            return redirect('labeling:image_upload', pk=pk)
+        
+        for name, error in errors:
+            messages.error(request, f'Error uploading {name}: {error}')
+        
+        if images:
+            # Thumbnails and tiles are rendered by runworker; missing ones are built on first view
+            enqueue_ingest(images, owner=request.user)
+            messages.success(request, f'Successfully uploaded {len(images)} images.')
         
         return redirect('labeling:dataset_detail', pk=pk)
 
@@ -139,81 +278,357 @@ class ImageDetailView(LoginRequiredMixin, DetailView):
     context_object_name = 'image'
     
     def get_queryset(self):
-        return Image.objects.filter(dataset__project__owner=self.request.user)
+        return Image.objects.filter(dataset__project__owner=self.request.user).select_related(
+            'dataset__project'
+        ).prefetch_related(
+            Prefetch('annotations', queryset=Annotation.objects.select_related('label_category', 'annotator'))
+        )
+
+
+class ImageDuplicatesView(LoginRequiredMixin, View):
+    """Near duplicates of an image by perceptual hash, within its dataset or project."""
+    default_distance = 8
+    max_distance = 16
+    max_results = 100
+    
+    def get(self, request, pk):
+        image = get_object_or_404(
+            Image.objects.select_related('dataset'), pk=pk, dataset__project__owner=request.user
+        )
+        scope = request.GET.get('scope', 'dataset')
+        if scope not in ('dataset', 'project'):
+            return JsonResponse({'error': 'scope must be "dataset" or "project"'}, status=400)
+        try:
+            distance = int(request.GET.get('distance', self.default_distance))
+        except ValueError:
+            return JsonResponse({'error': 'Invalid distance'}, status=400)
+        distance = max(0, min(distance, self.max_distance))
+        
+        if scope == 'project':
+            matches = near_duplicates(image, distance, dataset__project_id=image.dataset.project_id)
+        else:
+            matches = near_duplicates(image, distance, dataset_id=image.dataset_id)
+        matches = matches[:self.max_results]
+        
+        rows = {
+            row['id']: row for row in Image.objects.filter(pk__in=[image_id for image_id, _ in matches])
+            .values('id', 'dataset_id', 'file', 'filename', 'width', 'height', 'content_hash')
+        }
+        duplicates = []
+        for image_id, hamming_distance in matches:
+            row = rows.get(image_id)
+            if row is None:
+                continue
+            duplicates.append({
+                'id': str(row['id']),
+                'dataset_id': str(row['dataset_id']),
+                'filename': row['filename'],
+                'width': row['width'],
+                'height': row['height'],
+                'distance': hamming_distance,
+                'identical': bool(image.content_hash) and row['content_hash'] == image.content_hash,
+                'url': default_storage.url(row['file']),
+                'thumbnail_url': reverse('labeling:image_derivative', kwargs={'pk': row['id'], 'spec': 'thumb'}),
+            })
+        
+        return JsonResponse({
+            'image_id': str(image.id),
+            'hashed': image.perceptual_hash is not None,
+            'scope': scope,
+            'distance': distance,
+            'duplicates': duplicates
+        })
+
+
+def serve_streaming(request, response):
+    """
+    Give a streaming response an async iterator when served over ASGI.
+    
+    Django's ASGI handler reads a sync ``streaming_content`` with
+    ``sync_to_async(list)``, holding a whole export or file in memory before
+    the first byte is sent. Fetching one chunk per ``sync_to_async`` call
+    keeps it streaming. Chunks are fetched on the thread sensitive executor,
+    like the rest of a sync view, because exports query the database.
+    """
+    if not isinstance(request, ASGIRequest) or response.is_async:
+        return response
+    chunks = response.streaming_content
+    done = object()
+    
+    async def stream():
+        fetch = sync_to_async(next)
+        while (chunk := await fetch(chunks, done)) is not done:
+            yield chunk
+    
+    # FileResponse has set its length headers and registered the file's close
+    response.streaming_content = stream()
+    return response
+
+
+class ImageDerivativeView(LoginRequiredMixin, View):
+    """Serve a thumbnail or preview of an image, rendering it on first request."""
+    
+    def get(self, request, pk, spec):
+        if spec not in DERIVATIVE_SPECS:
+            return JsonResponse({'error': 'Unknown derivative'}, status=404)
+        image = get_object_or_404(
+            Image.objects.values('id', 'dataset_id', 'file', 'size'),
+            pk=pk, dataset__project__owner=request.user
+        )
+        
+        try:
+            name = ensure_derivative(image, spec)
+        except FileNotFoundError:
+            return JsonResponse({'error': 'Image file is missing'}, status=404)
+        except (OSError, ValueError, PILImage.DecompressionBombError) as e:
+            return JsonResponse({'error': f'Could not render image: {e}'}, status=500)
+        
+        etag = '"%s"' % os.path.splitext(os.path.basename(name))[0]
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = serve_streaming(request, FileResponse(
+                default_storage.open(name, 'rb'), content_type=DERIVATIVE_CONTENT_TYPE
+            ))
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, max-age=86400'
+        return response
+
+
+class ImageTileSourceView(LoginRequiredMixin, View):
+    """Describe the tile pyramid of an image for the annotation canvas."""
+    
+    def get(self, request, pk):
+        image = get_object_or_404(
+            Image.objects.values('id', 'width', 'height'),
+            pk=pk, dataset__project__owner=request.user
+        )
+        data = tile_source(image['width'], image['height'])
+        # Tile URLs nest under this one: <level>/<x>_<y>.<fmt>
+        data['url'] = request.path + '{level}/{x}_{y}.jpg'
+        return JsonResponse(data)
+
+
+class ImageTileView(LoginRequiredMixin, View):
+    def get(self, request, pk, level, x, y, fmt):
+        if fmt not in TILE_FORMATS:
+            return JsonResponse({'error': 'Unsupported tile format'}, status=404)
+        image = get_object_or_404(
+            Image.objects.values('id', 'file', 'size', 'width', 'height'),
+            pk=pk, dataset__project__owner=request.user
+        )
+        
+        levels = tile_source(image['width'], image['height'])['levels']
+        if level >= len(levels):
+            return JsonResponse({'error': 'No such level'}, status=404)
+        
+        try:
+            directory = ensure_pyramid(image, fmt)
+        except FileNotFoundError:
+            return JsonResponse({'error': 'Image file is missing'}, status=404)
+        except (OSError, ValueError, PILImage.DecompressionBombError) as e:
+            return JsonResponse({'error': f'Could not render tiles: {e}'}, status=500)
+        
+        path = tile_path(directory, level, x, y, fmt)
+        if not os.path.exists(path):
+            return JsonResponse({'error': 'No such tile'}, status=404)
+        response = serve_streaming(request, FileResponse(open(path, 'rb'), content_type=TILE_FORMATS[fmt][1]))
+        response['Cache-Control'] = 'private, max-age=86400'
+        return response
+
+
+class VideoFrameMixin:
+    # Seconds a client should wait before asking again while a video is indexed
+    index_retry_after = 2
+
+    def get_video(self, request, pk):
+        return get_object_or_404(Video, pk=pk, dataset__project__owner=request.user)
+
+    def unindexed_response(self, request, video):
+        """
+        ``None`` for an indexed video. Otherwise the response to send
+        instead: 202 with the indexing task, which is queued if there is
+        none yet, or 409 if indexing failed.
+        """
+        if video.keyframes:
+            return None
+        # Normally indexed on ingest; videos from before that are indexed on first view
+        task = Task.objects.filter(kind='index_video', payload__video_id=str(video.pk)).order_by('-created_at').first()
+        if task is None:
+            task = enqueue('index_video', {'video_id': str(video.pk)}, owner=request.user)
+        if task.status == 'failed':
+            return JsonResponse({'error': 'The video could not be indexed', 'task': task_data(task)}, status=409)
+        if task.status == 'succeeded':
+            # Indexed since this request loaded the video
+            video.refresh_from_db()
+            return None
+        response = JsonResponse(task_data(task), status=202)
+        response['Retry-After'] = str(self.index_retry_after)
+        return response
+
+
+class VideoFrameSourceView(LoginRequiredMixin, VideoFrameMixin, View):
+    """
+    Describe the frames of a video for the annotation canvas. Until the
+    video is indexed this answers 202 with the indexing task to poll.
+    """
+    
+    def get(self, request, pk):
+        video = self.get_video(request, pk)
+        response = self.unindexed_response(request, video)
+        if response is not None:
+            return response
+        data = frame_source(video)
+        data['url'] = request.path + '{frame}.jpg'
+        return JsonResponse(data)
+
+
+class VideoFrameView(LoginRequiredMixin, VideoFrameMixin, View):
+    def get(self, request, pk, frame):
+        video = self.get_video(request, pk)
+        response = self.unindexed_response(request, video)
+        if response is not None:
+            return response
+        try:
+            data = get_frame(video, frame)
+        except FrameNotFound as e:
+            return JsonResponse({'error': str(e)}, status=404)
+        except VideoDecodeError as e:
+            return JsonResponse({'error': f'Could not decode frame: {e}'}, status=500)
+        response = HttpResponse(data, content_type='image/jpeg')
+        response['Cache-Control'] = 'private, max-age=86400'
+        return response
+
+
+class VideoExtractView(LoginRequiredMixin, View):
+    """Queue extraction of a video's frames into a sequential dataset and return the task to poll."""
+    
+    def post(self, request, pk):
+        video = get_object_or_404(
+            Video.objects.select_related('dataset'), pk=pk, dataset__project__owner=request.user
+        )
+        try:
+            data = json.loads(request.body or b'{}')
+            options = {key: data.get(key) for key in ('stride', 'fps', 'start', 'end')}
+            if options['stride'] is not None:
+                options['stride'] = int(options['stride'])
+            for key in ('fps', 'start', 'end'):
+                if options[key] is not None:
+                    options[key] = float(options[key])
+        except (json.JSONDecodeError, AttributeError, TypeError, ValueError):
+            return JsonResponse({'error': 'stride must be an integer and fps, start and end numbers'}, status=400)
+        if options['stride'] is not None and options['fps'] is not None:
+            return JsonResponse({'error': 'Give either stride or fps, not both'}, status=400)
+        if (options['stride'] is not None and options['stride'] < 1) or (
+            options['fps'] is not None and options['fps'] <= 0
+        ):
+            return JsonResponse({'error': 'stride and fps must be positive'}, status=400)
+        if (options['start'] or 0) < 0 or (options['end'] is not None and options['end'] <= (options['start'] or 0)):
+            return JsonResponse({'error': 'end must come after start'}, status=400)
+        
+        if data.get('dataset_id'):
+            try:
+                dataset = Dataset.objects.filter(
+                    pk=data['dataset_id'], project_id=video.dataset.project_id, dataset_type='sequential'
+                ).first()
+            except ValidationError:
+                dataset = None
+            if dataset is None:
+                return JsonResponse({'error': 'dataset_id must be a sequential dataset of the same project'}, status=400)
+        else:
+            dataset = Dataset.objects.create(
+                project_id=video.dataset.project_id,
+                name=f'{os.path.splitext(video.filename)[0]} frames',
+                dataset_type='sequential'
+            )
+        
+        task = enqueue('extract_video', {
+            'video_id': str(video.pk),
+            'dataset_id': str(dataset.pk),
+            **options
+        }, owner=request.user)
+        return JsonResponse(task_data(task), status=202)
 
 
 class AnnotationView(LoginRequiredMixin, View):
     template_name = 'labeling/annotate.html'
     
     def get(self, request, pk):
-        image = get_object_or_404(Image, pk=pk, dataset__project__owner=request.user)
+        image = get_object_or_404(
+            Image.objects.select_related('dataset__project'), pk=pk, dataset__project__owner=request.user
+        )
         labels = LabelCategory.objects.filter(project=image.dataset.project)
-        annotations = Annotation.objects.filter(image=image)
         
         context = {
             'image': image,
             'labels': labels,
-            'annotations': annotations,
-            'annotations_json': json.dumps([{
-                'id': str(ann.id),
-                'label_id': str(ann.label_category.id),
-                'label_name': ann.label_category.name,
-                'type': ann.annotation_type,
-                'x': ann.x,
-                'y': ann.y,
-                'width': ann.width,
-                'height': ann.height,
-                'points': ann.points,
-                'color': ann.label_category.color
-            } for ann in annotations])
+            'use_tiles': max(image.width, image.height) > TILE_THRESHOLD,
+            'annotations_json': image_annotations(image.pk, image.annotation_revision).decode('utf-8'),
         }
         return render(request, self.template_name, context)
 
 
-class AnnotationAPIView(LoginRequiredMixin, View):
-    def get(self, request, pk=None):
+class AnnotationAPIView(AsyncLoginRequiredMixin, View):
+    """
+    Annotations as JSON. The handlers are coroutines on the async ORM, so
+    under ASGI a request only borrows a thread for each query instead of
+    holding one from start to finish.
+    """
+    
+    async def get(self, request, pk=None):
         if pk:
-            annotation = get_object_or_404(Annotation, pk=pk)
-            data = {
-                'id': str(annotation.id),
-                'label_id': str(annotation.label_category.id),
-                'label_name': annotation.label_category.name,
-                'type': annotation.annotation_type,
-                'x': annotation.x,
-                'y': annotation.y,
-                'width': annotation.width,
-                'height': annotation.height,
-                'points': annotation.points,
-                'confidence': annotation.confidence,
-                'notes': annotation.notes
-            }
-            return JsonResponse(data)
+            row = await annotation_rows(Annotation.objects.filter(pk=pk)).afirst()
+            if row is None:
+                return JsonResponse({'error': 'Annotation not found'}, status=404)
+            return json_response(annotation_data(row))
         else:
             image_id = request.GET.get('image_id')
             if image_id:
-                annotations = Annotation.objects.filter(image_id=image_id)
-                data = [{
-                    'id': str(ann.id),
-                    'label_id': str(ann.label_category.id),
-                    'label_name': ann.label_category.name,
-                    'type': ann.annotation_type,
-                    'x': ann.x,
-                    'y': ann.y,
-                    'width': ann.width,
-                    'height': ann.height,
-                    'points': ann.points,
-                    'color': ann.label_category.color
-                } for ann in annotations]
-                return JsonResponse({'annotations': data})
+                return await self.image_annotations(request, image_id)
             return JsonResponse({'error': 'image_id required'}, status=400)
+
+    async def image_annotations(self, request, image_id):
+        """
+        All annotations of one image, one object each, or with
+        ``?shape=columnar`` as parallel arrays.
+
+        Unchanged images cost one indexed lookup of the image's annotation
+        revision, which is the ETag; the payload itself comes from the cache.
+        """
+        shape = request.GET.get('shape', 'rows')
+        if shape not in ANNOTATION_SHAPES:
+            return JsonResponse({'error': 'shape must be "rows" or "columnar"'}, status=400)
+        try:
+            image = await Image.objects.filter(
+                pk=image_id, dataset__project__owner=request.user
+            ).values_list('id', 'annotation_revision').afirst()
+        except ValidationError:
+            return JsonResponse({'error': 'Invalid image_id'}, status=400)
+        if image is None:
+            return JsonResponse({'error': 'Image not found'}, status=404)
+        image_id, revision = image
+        
+        etag = image_annotations_etag(image_id, revision, shape)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            not_modified['ETag'] = etag
+            return not_modified
+        
+        payload = await aimage_annotations(image_id, revision, shape)
+        if shape == 'rows':
+            payload = b'{"annotations":' + payload + b'}'
+        response = HttpResponse(payload, content_type='application/json')
+        response['ETag'] = etag
+        # Clients keep the payload but revalidate it on every use
+        response['Cache-Control'] = 'private, no-cache'
+        return response
     
-    def post(self, request):
+    async def post(self, request):
         try:
             data = json.loads(request.body)
-            image = get_object_or_404(Image, pk=data['image_id'])
-            label_category = get_object_or_404(LabelCategory, pk=data['label_id'])
+            image = await aget_object_or_404(Image, pk=data['image_id'])
+            label_category = await aget_object_or_404(LabelCategory, pk=data['label_id'])
             
-            annotation = Annotation.objects.create(
+            annotation = await Annotation.objects.acreate(
                 image=image,
                 label_category=label_category,
                 annotation_type=data['type'],
@@ -226,9 +641,9 @@ class AnnotationAPIView(LoginRequiredMixin, View):
                 notes=data.get('notes', ''),
                 annotator=request.user
             )
-            
-            image.is_annotated = True
-            image.save()
+            await sync_to_async(publish_annotations)(
+                [(annotation.dataset_id, annotation_operation('create', annotation))]
+            )
             
             return JsonResponse({
                 'id': str(annotation.id),
@@ -237,265 +652,491 @@ class AnnotationAPIView(LoginRequiredMixin, View):
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=400)
     
-    def put(self, request, pk):
+    async def put(self, request, pk):
         try:
-            annotation = get_object_or_404(Annotation, pk=pk)
+            annotation = await aget_object_or_404(Annotation, pk=pk)
             data = json.loads(request.body)
             
             annotation.x = data.get('x', annotation.x)
             annotation.y = data.get('y', annotation.y)
             annotation.width = data.get('width', annotation.width)
             annotation.height = data.get('height', annotation.height)
-            annotation.points = data.get('points', annotation.points)
+            if 'points' in data:
+                annotation.points = data['points']
             annotation.confidence = data.get('confidence', annotation.confidence)
             annotation.notes = data.get('notes', annotation.notes)
-            annotation.save()
+            await annotation.asave()
+            await sync_to_async(publish_annotations)([(annotation.dataset_id, annotation_operation(
+                'update', annotation, [field for field, name in FIELD_NAMES.items() if name in data]
+            ))])
             
             return JsonResponse({'success': True})
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=400)
     
-    def delete(self, request, pk):
+    async def delete(self, request, pk):
         try:
-            annotation = get_object_or_404(Annotation, pk=pk)
-            annotation.delete()
+            annotation = await aget_object_or_404(Annotation, pk=pk)
+            operation = annotation_operation('delete', annotation)
+            await annotation.adelete()
+            await sync_to_async(publish_annotations)([(annotation.dataset_id, operation)])
             return JsonResponse({'success': True})
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=400)
 
 
+def track_data(track, frame=None):
+    data = {
+        'id': str(track.id),
+        'label_id': str(track.label_category_id),
+        'start_frame': track.start_frame,
+        'end_frame': track.end_frame,
+        'keyframes': [list(keyframe) for keyframe in track.keyframes],
+    }
+    if frame is not None:
+        box = next(track.boxes([frame]), None)
+        data['box'] = list(box[1:]) if box else None
+    return data
+
+
+class TrackMixin:
+    def get_label(self, video_project_id, label_id):
+        label = LabelCategory.objects.filter(pk=label_id, project_id=video_project_id).only('id').first()
+        if label is None:
+            raise ValueError("label_id must be a label of the video's project")
+        return label
+
+
+class VideoTrackListView(LoginRequiredMixin, TrackMixin, View):
+    """
+    The object tracks of a video. With ``?frame=n`` only the tracks that
+    span frame n are listed, each with its interpolated ``box`` there.
+    """
+    
+    def get(self, request, pk):
+        video = get_object_or_404(Video.objects.only('id'), pk=pk, dataset__project__owner=request.user)
+        tracks = Track.objects.filter(video=video)
+        frame = request.GET.get('frame')
+        if frame is not None:
+            try:
+                frame = int(frame)
+            except ValueError:
+                return JsonResponse({'error': 'frame must be an integer'}, status=400)
+            tracks = tracks.filter(start_frame__lte=frame, end_frame__gte=frame)
+        return JsonResponse({'tracks': [track_data(track, frame) for track in tracks]})
+    
+    def post(self, request, pk):
+        video = get_object_or_404(
+            Video.objects.select_related('dataset'), pk=pk, dataset__project__owner=request.user
+        )
+        try:
+            data = json.loads(request.body)
+            label = self.get_label(video.dataset.project_id, data.get('label_id'))
+            track = Track(video=video, label_category=label, annotator=request.user)
+            track.keyframes = parse_keyframes(data.get('keyframes'))
+        except (ValueError, AttributeError, TypeError, ValidationError) as e:
+            return JsonResponse({'error': f'Invalid request: {e}'}, status=400)
+        track.save()
+        return JsonResponse(track_data(track), status=201)
+
+
+class TrackView(LoginRequiredMixin, TrackMixin, View):
+    """
+    Read, edit or delete one track. ``PUT`` takes ``keyframes`` to replace
+    them all, or ``keyframe`` to add or move a single one, and ``label_id``.
+    """
+    
+    def get_track(self, request, pk):
+        return get_object_or_404(
+            Track.objects.select_related('video__dataset'), pk=pk, video__dataset__project__owner=request.user
+        )
+    
+    def get(self, request, pk):
+        return JsonResponse(track_data(self.get_track(request, pk)))
+    
+    def put(self, request, pk):
+        track = self.get_track(request, pk)
+        try:
+            data = json.loads(request.body)
+            if 'label_id' in data:
+                track.label_category = self.get_label(track.video.dataset.project_id, data['label_id'])
+            if 'keyframes' in data:
+                track.keyframes = parse_keyframes(data['keyframes'])
+            if 'keyframe' in data:
+                # A keyframe at an existing frame replaces it
+                track.keyframes = parse_keyframes(track.keyframes + [data['keyframe']])
+        except (ValueError, AttributeError, TypeError, ValidationError) as e:
+            return JsonResponse({'error': f'Invalid request: {e}'}, status=400)
+        track.save()
+        return JsonResponse(track_data(track))
+    
+    def delete(self, request, pk):
+        self.get_track(request, pk).delete()
+        return JsonResponse({'success': True})
+
+
+class AnnotationChangesView(AsyncLoginRequiredMixin, View):
+    """
+    Annotations of a dataset created, updated or deleted since a revision.
+
+    ``?since=<revision>`` (omitted for a full sync) returns ``changes``, the
+    annotations with the revision they last changed at, and ``deleted``,
+    ``{id, revision}`` tombstones, both in (revision, id) order and at most
+    ``limit`` of them together. While ``next_cursor`` is set, pass it back
+    as ``cursor`` for the next page; once it is null, ``revision`` is the
+    ``since`` to sync from next time.
+
+    Each page is two keyset range scans of the (dataset, revision, id)
+    indexes, however far behind the client is.
+    """
+    default_limit = 500
+    max_limit = 5000
+    
+    async def get(self, request):
+        dataset_id = request.GET.get('dataset_id')
+        if not dataset_id:
+            return JsonResponse({'error': 'dataset_id required'}, status=400)
+        try:
+            since = int(request.GET.get('since', -1))
+            limit = int(request.GET.get('limit', self.default_limit))
+        except ValueError:
+            return JsonResponse({'error': 'since and limit must be integers'}, status=400)
+        limit = max(1, min(limit, self.max_limit))
+        cursor = request.GET.get('cursor')
+        try:
+            after = decode_change_cursor(cursor) if cursor else (since, None)
+        except InvalidCursor as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        try:
+            dataset = await Dataset.objects.filter(
+                pk=dataset_id, project__owner=request.user
+            ).values_list('id', 'revision').afirst()
+        except ValidationError:
+            return JsonResponse({'error': 'Invalid dataset_id'}, status=400)
+        if dataset is None:
+            return JsonResponse({'error': 'Dataset not found'}, status=404)
+        dataset_id, revision = dataset
+        
+        # Writes stamp rows while holding the dataset row, so everything up to
+        # the revision just read is committed; later rows wait for the next sync
+        annotations = changes_after(
+            Annotation.objects.filter(dataset_id=dataset_id, revision__lte=revision), *after
+        ).order_by('revision', 'id')
+        tombstones = changes_after(
+            AnnotationTombstone.objects.filter(dataset_id=dataset_id, revision__lte=revision), *after
+        ).order_by('revision', 'id')
+        page = sorted(
+            [(row['revision'], row['id'], row) async for row in annotation_rows(annotations, 'revision')[:limit + 1]]
+            + [(row['revision'], row['id'], None) async for row in tombstones.values('revision', 'id')[:limit + 1]],
+            key=lambda change: change[:2],
+        )
+        has_more = len(page) > limit
+        page = page[:limit]
+        
+        return json_response({
+            'changes': [
+                {**annotation_data(row), 'revision': row_revision}
+                for row_revision, _, row in page if row is not None
+            ],
+            'deleted': [{'id': pk, 'revision': row_revision} for row_revision, pk, row in page if row is None],
+            'next_cursor': change_cursor(*page[-1][:2]) if has_more else None,
+            'revision': revision,
+        })
+
+
+class AnnotationEventsView(AsyncLoginRequiredMixin, View):
+    """
+    Annotation changes of one image (``?image_id=``) or of a whole dataset
+    (``?dataset_id=``) as Server-Sent Events, pushed as others save them.
+
+    The stream opens with a ``ready`` event carrying the dataset revision it
+    starts from, then sends an ``annotations`` event, a list of batch API
+    operations, per save. ``resync`` means messages were lost and the client
+    should reload. Streams are coroutines, not threads, so this is only
+    served by the ASGI application.
+    """
+    keepalive = 15
+    
+    async def get(self, request):
+        if not isinstance(request, ASGIRequest):
+            return JsonResponse({'error': 'Event streams are only served over ASGI'}, status=501)
+        if request.GET.get('image_id'):
+            kind, targets = 'image', Image.objects.filter(
+                pk=request.GET['image_id'], dataset__project__owner=request.user
+            ).values_list('id', 'dataset_id')
+        elif request.GET.get('dataset_id'):
+            kind, targets = 'dataset', Dataset.objects.filter(
+                pk=request.GET['dataset_id'], project__owner=request.user
+            ).values_list('id', 'id')
+        else:
+            return JsonResponse({'error': 'image_id or dataset_id required'}, status=400)
+        try:
+            target = await targets.afirst()
+        except ValidationError:
+            return JsonResponse({'error': f'Invalid {kind}_id'}, status=400)
+        if target is None:
+            return JsonResponse({'error': f'{kind.capitalize()} not found'}, status=404)
+        pk, dataset_id = target
+        
+        subscription = get_broker().subscribe(channel_name(kind, pk))
+        response = StreamingHttpResponse(self.stream(subscription, dataset_id), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # Keep nginx from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+    
+    async def stream(self, subscription, dataset_id):
+        async with subscription:
+            # Read after subscribing, so no change falls between the two
+            revision = await Dataset.objects.filter(pk=dataset_id).values_list('revision', flat=True).aget()
+            yield server_sent_event('ready', dumps({'revision': revision}))
+            while True:
+                try:
+                    message = await subscription.get(self.keepalive)
+                except asyncio.TimeoutError:
+                    yield b': keepalive\n\n'
+                    continue
+                if message is RESYNC:
+                    yield server_sent_event('resync', b'{}')
+                else:
+                    yield server_sent_event('annotations', message)
+
+
+class AnnotationBatchView(LoginRequiredMixin, View):
+    """Apply a list of annotation creates, updates and deletes in one transaction."""
+    
+    def post(self, request):
+        try:
+            data = json.loads(request.body)
+            results = apply_annotation_batch(data.get('operations'), request.user)
+        except AnnotationBatchError as e:
+            return JsonResponse({'error': str(e), 'index': e.index}, status=400)
+        except (ValueError, AttributeError) as e:
+            return JsonResponse({'error': f'Invalid request: {e}'}, status=400)
+        return JsonResponse({'success': True, 'results': results})
+
+
 class ExportDatasetView(LoginRequiredMixin, View):
     def get(self, request, dataset_id, format):
         dataset = get_object_or_404(Dataset, pk=dataset_id, project__owner=request.user)
         include_images = request.GET.get('include_images', 'false').lower() == 'true'
         
         if format == 'coco':
-            return self.export_coco(dataset)
+            return self.export_coco(request, dataset)
         elif format == 'yolo':
-            return self.export_yolo(dataset, include_images)
+            return self.export_yolo(request, dataset, include_images)
         else:
             return JsonResponse({'error': 'Unsupported format'}, status=400)
     
-    def export_coco(self, dataset):
-        images = dataset.images.all()
-        categories = LabelCategory.objects.filter(project=dataset.project)
-        
-        coco_data = {
-            'info': {
-                'description': dataset.description,
-                'version': '1.0',
-                'year': 2024
-            },
-            'images': [],
-            'annotations': [],
-            'categories': []
-        }
-        
-        for idx, category in enumerate(categories, 1):
-            coco_data['categories'].append({
-                'id': idx,
-                'name': category.name,
-                'supercategory': 'object'
-            })
+    def post(self, request, dataset_id, format):
+        """Queue the export for ``runworker`` and return the task to poll."""
+        dataset = get_object_or_404(Dataset, pk=dataset_id, project__owner=request.user)
+        if format not in ('coco', 'yolo'):
+            return JsonResponse({'error': 'Unsupported format'}, status=400)
         
-        category_map = {str(cat.id): idx for idx, cat in enumerate(categories, 1)}
+        options = {}
+        if format == 'yolo':
+            options['include_images'] = request.GET.get('include_images', 'false').lower() == 'true'
         
-        for img_idx, image in enumerate(images, 1):
-            coco_data['images'].append({
-                'id': img_idx,
-                'width': image.width,
-                'height': image.height,
-                'file_name': image.filename
-            })
-            
-            for ann_idx, annotation in enumerate(image.annotations.all()):
-                coco_data['annotations'].append({
-                    'id': ann_idx + img_idx * 1000,
-                    'image_id': img_idx,
-                    'category_id': category_map.get(str(annotation.label_category.id)),
-                    'bbox': [annotation.x, annotation.y, annotation.width, annotation.height],
-                    'area': annotation.width * annotation.height,
-                    'iscrowd': 0
-                })
-        
-        response = HttpResponse(
-            json.dumps(coco_data, indent=2),
-            content_type='application/json'
+        task = enqueue('export_dataset', {
+            'dataset_id': str(dataset.pk),
+            'format': format,
+            'options': options
+        }, owner=request.user)
+        return JsonResponse(task_data(task), status=202)
+    
+    def export_coco(self, request, dataset):
+        return self.cached_export(
+            request, dataset, 'coco', {},
+            content_type='application/json',
+            filename=f'{dataset.name}_coco.json'
         )
-        response['Content-Disposition'] = f'attachment; filename="{dataset.name}_coco.json"'
-        return response
     
-    def export_yolo(self, dataset, include_images=False):
-        import zipfile
-        import tempfile
-        import os
-        import shutil
-        from io import BytesIO
-        
-        # Create a temporary directory for YOLO files
-        with tempfile.TemporaryDirectory() as temp_dir:
-            images_dir = os.path.join(temp_dir, 'images')
-            labels_dir = os.path.join(temp_dir, 'labels')
-            os.makedirs(images_dir, exist_ok=True)
-            os.makedirs(labels_dir, exist_ok=True)
-            
-            # Get all images and categories
-            images = dataset.images.all()
-            categories = LabelCategory.objects.filter(project=dataset.project)
-            
-            # Create class mapping (YOLO uses integer class IDs)
-            class_mapping = {str(cat.id): idx for idx, cat in enumerate(categories)}
-            
-            # Create classes.txt file
-            classes_file = os.path.join(temp_dir, 'classes.txt')
-            with open(classes_file, 'w') as f:
-                for category in categories:
-                    f.write(f"{category.name}\n")
-            
-            # Create data.yaml file for YOLO training
-            data_yaml = os.path.join(temp_dir, 'data.yaml')
-            with open(data_yaml, 'w') as f:
-                f.write(f"# Dataset configuration for {dataset.name}\n")
-                f.write(f"path: ./  # dataset root dir\n")
-                f.write(f"train: images/  # train images (relative to 'path')\n")
-                f.write(f"val: images/  # val images (relative to 'path')\n")
-                f.write(f"test:  # test images (optional)\n\n")
-                f.write(f"# Classes\n")
-                f.write(f"nc: {len(categories)}  # number of classes\n")
-                f.write(f"names: [")
-                for i, category in enumerate(categories):
-                    f.write(f"'{category.name}'")
-                    if i < len(categories) - 1:
-                        f.write(', ')
-                f.write("]\n")
-            
-            # Process each image
-            for image in images:
-                # Copy image file if requested
-                if include_images and image.file:
-                    try:
-                        image_source_path = image.file.path
-                        image_dest_path = os.path.join(images_dir, image.filename)
-                        shutil.copy2(image_source_path, image_dest_path)
-                    except Exception as e:
-                        print(f"Warning: Could not copy image {image.filename}: {e}")
-                
-                # Create YOLO format annotation file
-                label_filename = os.path.splitext(image.filename)[0] + '.txt'
-                label_path = os.path.join(labels_dir, label_filename)
-                
-                # Get annotations for this image
-                annotations = image.annotations.filter(annotation_type='bbox')
-                
-                if annotations.exists():
-                    with open(label_path, 'w') as f:
-                        for annotation in annotations:
-                            # Convert to YOLO format
-                            class_id = class_mapping.get(str(annotation.label_category.id), 0)
-                            
-                            # YOLO format: class_id center_x center_y width height (all normalized 0-1)
-                            img_width = image.width
-                            img_height = image.height
-                            
-                            # Convert from top-left corner format to center format
-                            center_x = (annotation.x + annotation.width / 2) / img_width
-                            center_y = (annotation.y + annotation.height / 2) / img_height
-                            norm_width = annotation.width / img_width
-                            norm_height = annotation.height / img_height
-                            
-                            # Ensure values are within [0, 1] range
-                            center_x = max(0, min(1, center_x))
-                            center_y = max(0, min(1, center_y))
-                            norm_width = max(0, min(1, norm_width))
-                            norm_height = max(0, min(1, norm_height))
-                            
-                            f.write(f"{class_id} {center_x:.6f} {center_y:.6f} {norm_width:.6f} {norm_height:.6f}\n")
-                else:
-                    # Create empty annotation file for images without annotations
-                    with open(label_path, 'w') as f:
-                        pass  # Empty file
-            
-            # Create README file
-            readme_path = os.path.join(temp_dir, 'README.txt')
-            with open(readme_path, 'w') as f:
-                f.write(f"YOLO Dataset Export - {dataset.name}\n")
-                f.write("=" * 50 + "\n\n")
-                f.write("Generated by Image Labeling Tool\n")
-                f.write(f"Export Date: {dataset.updated_at.strftime('%Y-%m-%d %H:%M:%S')}\n")
-                f.write(f"Dataset Type: {dataset.get_dataset_type_display()}\n\n")
-                
-                f.write("OVERVIEW\n")
-                f.write("-" * 20 + "\n")
-                f.write("This export contains annotation files in YOLO format, ready for training\n")
-                f.write("YOLO (You Only Look Once) object detection models.\n\n")
-                
-                f.write("FILE STRUCTURE\n")
-                f.write("-" * 20 + "\n")
-                f.write("📁 Root Directory\n")
-                f.write("├── 📁 labels/          # YOLO annotation files (.txt)\n")
-                if include_images:
-                    f.write("├── 📁 images/          # Training images\n")
-                f.write("├── 📄 classes.txt      # Class names (one per line)\n")
-                f.write("├── 📄 data.yaml        # YOLO dataset configuration\n")
-                f.write("└── 📄 README.txt       # This documentation\n\n")
-                
-                f.write("YOLO ANNOTATION FORMAT\n")
-                f.write("-" * 20 + "\n")
-                f.write("Each annotation file (.txt) contains one line per object:\n")
-                f.write("Format: class_id center_x center_y width height\n\n")
-                f.write("Where:\n")
-                f.write("• class_id    = Integer class identifier (0-based)\n")
-                f.write("• center_x    = X-coordinate of bounding box center (0.0-1.0)\n")
-                f.write("• center_y    = Y-coordinate of bounding box center (0.0-1.0)\n")
-                f.write("• width       = Bounding box width (0.0-1.0)\n")
-                f.write("• height      = Bounding box height (0.0-1.0)\n\n")
-                f.write("All coordinates are normalized relative to image dimensions.\n\n")
-                
-                f.write("DATASET STATISTICS\n")
-                f.write("-" * 20 + "\n")
-                total_annotations = sum(img.annotations.filter(annotation_type='bbox').count() for img in images)
-                f.write(f"📊 Total Images:        {images.count()}\n")
-                f.write(f"✅ Annotated Images:    {images.filter(is_annotated=True).count()}\n")
-                f.write(f"🏷️  Total Annotations:   {total_annotations}\n")
-                f.write(f"📦 Number of Classes:   {len(categories)}\n\n")
-                
-                f.write("CLASS MAPPING\n")
-                f.write("-" * 20 + "\n")
-                f.write("ID | Class Name\n")
-                f.write("---|------------\n")
-                for category in categories:
-                    class_id = class_mapping[str(category.id)]
-                    f.write(f"{class_id:2d} | {category.name}\n")
-                
-                f.write(f"\nUSAGE WITH YOLO\n")
-                f.write("-" * 20 + "\n")
-                f.write("1. Use the data.yaml file to configure your YOLO training\n")
-                f.write("2. Place this dataset in your YOLO project directory\n")
-                f.write("3. Update the paths in data.yaml if needed\n")
-                f.write("4. Train your model: yolo train data=data.yaml\n\n")
-                
-                if not include_images:
-                    f.write("NOTE: This export contains labels only. Add your images to the\n")
-                    f.write("'images/' directory to complete the dataset structure.\n\n")
-                
-                f.write("For more information about YOLO format and training, visit:\n")
-                f.write("https://github.com/ultralytics/ultralytics\n")
-            
-            # Create ZIP file
-            zip_buffer = BytesIO()
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                # Add all files to ZIP
-                for root, dirs, files in os.walk(temp_dir):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        arc_path = os.path.relpath(file_path, temp_dir)
-                        zip_file.write(file_path, arc_path)
-            
-            zip_buffer.seek(0)
-            
-            response = HttpResponse(
-                zip_buffer.getvalue(),
-                content_type='application/zip'
+    def export_yolo(self, request, dataset, include_images=False):
+        return self.cached_export(
+            request, dataset, 'yolo', {'include_images': include_images},
+            content_type='application/zip',
+            filename=f'{dataset.name}_yolo.zip'
+        )
+    
+    def cached_export(self, request, dataset, format, options, content_type, filename):
+        """
+        Serve an export from the artifact cache, building and storing it on a miss.
+        
+        The cache key doubles as a strong ETag: it only changes when the
+        dataset revision does, so clients revalidating with If-None-Match
+        get a 304 without the export being read or rebuilt.
+        """
+        key = export_cache.key(dataset, format, options)
+        etag = f'"{key}"'
+        
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            not_modified['ETag'] = etag
+            return not_modified
+        
+        path = export_cache.get(dataset, format, options, key)
+        if path:
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+        else:
+            response = StreamingHttpResponse(
+                export_cache.stream_and_store(dataset, format, options, key, iter_export(dataset, format, options)),
+                content_type=content_type
             )
-            response['Content-Disposition'] = f'attachment; filename="{dataset.name}_yolo.zip"'
-            return response
+        response['ETag'] = etag
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return serve_streaming(request, response)
+
+
+def task_data(task):
+    return {
+        'id': str(task.id),
+        'kind': task.kind,
+        'status': task.status,
+        'progress': task.progress,
+        'message': task.message,
+        'result': task.result,
+        'error': task.error,
+        'created_at': task.created_at.isoformat(),
+        'started_at': task.started_at.isoformat() if task.started_at else None,
+        'finished_at': task.finished_at.isoformat() if task.finished_at else None,
+        'status_url': reverse('labeling:task_detail', kwargs={'pk': task.pk})
+    }
+
+
+class TaskListView(AsyncLoginRequiredMixin, View):
+    async def get(self, request):
+        tasks = Task.objects.filter(owner=request.user)
+        status = request.GET.get('status')
+        if status:
+            tasks = tasks.filter(status=status)
+        return JsonResponse({'tasks': [task_data(task) async for task in tasks[:50]]})
+
+
+class TaskDetailView(AsyncLoginRequiredMixin, View):
+    async def get(self, request, pk):
+        task = await aget_object_or_404(Task, pk=pk, owner=request.user)
+        return JsonResponse(task_data(task))
+
+
+def upload_session_data(session):
+    data = {
+        'id': str(session.id),
+        'kind': session.kind,
+        'filename': session.filename,
+        'size': session.size,
+        'offset': session.size if session.status == 'completed' else current_offset(session),
+        'status': session.status,
+        'url': reverse('labeling:upload_session', kwargs={'pk': session.pk}),
+        'created_at': session.created_at.isoformat(),
+    }
+    if session.image_id:
+        data['image_id'] = str(session.image_id)
+    if session.video_id:
+        data['video_id'] = str(session.video_id)
+    return data
+
+
+class UploadSessionListView(LoginRequiredMixin, View):
+    """Open resumable upload sessions on a dataset, or start a new one."""
+    
+    def get(self, request, pk):
+        dataset = get_object_or_404(Dataset, pk=pk, project__owner=request.user)
+        sessions = UploadSession.objects.filter(dataset=dataset, owner=request.user, status='uploading')
+        return JsonResponse({'uploads': [upload_session_data(session) for session in sessions]})
+    
+    def post(self, request, pk):
+        dataset = get_object_or_404(Dataset, pk=pk, project__owner=request.user)
+        try:
+            data = json.loads(request.body)
+            kind = data.get('kind', 'image')
+            filename = os.path.basename(str(data['filename']))
+            size = int(data['size'])
+        except (ValueError, KeyError, TypeError) as e:
+            return JsonResponse({'error': f'Invalid upload request: {e}'}, status=400)
+        
+        if kind not in dict(UploadSession.KIND_CHOICES):
+            return JsonResponse({'error': f'Unknown upload kind: {kind}'}, status=400)
+        extensions = allowed_extensions(kind)
+        extension = os.path.splitext(filename)[1][1:].lower()
+        if not filename or (extensions and extension not in extensions):
+            return JsonResponse({'error': f'Unsupported file type: {filename}'}, status=400)
+        if size <= 0 or size > max_upload_bytes():
+            return JsonResponse({'error': f'File size must be between 1 and {max_upload_bytes()} bytes'}, status=400)
+        
+        session = UploadSession.objects.create(
+            dataset=dataset,
+            owner=request.user,
+            kind=kind,
+            filename=filename,
+            size=size
+        )
+        return JsonResponse(upload_session_data(session), status=201)
+
+
+class UploadSessionView(LoginRequiredMixin, View):
+    """
+    One resumable upload.
+
+    GET reports the offset, PUT appends the byte range named by its
+    Content-Range header, POST finalizes and DELETE abandons the upload.
+    """
+    
+    def get_session(self, request, pk):
+        return get_object_or_404(UploadSession.objects.select_related('dataset'), pk=pk, owner=request.user)
+    
+    def get(self, request, pk):
+        return JsonResponse(upload_session_data(self.get_session(request, pk)))
+    
+    def put(self, request, pk):
+        session = self.get_session(request, pk)
+        if session.status != 'uploading':
+            return JsonResponse({'error': 'Upload is already complete'}, status=409)
+        
+        try:
+            start, length = parse_content_range(request.headers.get('Content-Range'), session.size)
+            try:
+                content_length = int(request.headers.get('Content-Length') or 0)
+            except ValueError:
+                raise UploadError('Content-Length must be a number of bytes')
+            if content_length != length:
+                raise UploadError('Content-Length does not match Content-Range')
+            # Read the body as a stream; request.body would buffer the whole chunk
+            offset = append_chunk(session, start, length, request)
+        except OffsetMismatch as e:
+            return JsonResponse({'error': str(e), 'offset': e.offset}, status=409)
+        except UploadError as e:
+            return JsonResponse({'error': str(e), 'offset': current_offset(session)}, status=400)
+        
+        return JsonResponse({'offset': offset, 'size': session.size})
+    
+    def post(self, request, pk):
+        session = self.get_session(request, pk)
+        try:
+            obj = finalize_upload(session)
+        except OffsetMismatch as e:
+            return JsonResponse({'error': 'Upload is incomplete', 'offset': e.offset}, status=409)
+        except DuplicateUpload as e:
+            discard_upload(session)
+            return JsonResponse({'error': str(e), 'duplicate_of': e.filename}, status=409)
+        except IntegrityError:
+            discard_upload(session)
+            return JsonResponse({'error': f'{session.filename} already exists in this dataset'}, status=409)
+        except (OSError, ValueError, PILImage.DecompressionBombError) as e:
+            # The bytes are all there but not a readable image; resending cannot help
+            discard_upload(session)
+            return JsonResponse({'error': f'Error processing {session.filename}: {e}'}, status=400)
+        
+        session.refresh_from_db()
+        if session.kind == 'image':
+            enqueue_ingest([obj], owner=request.user)
+        else:
+            enqueue('index_video', {'video_id': str(obj.pk)}, owner=request.user)
+        return JsonResponse(upload_session_data(session))
+    
+    def delete(self, request, pk):
+        session = self.get_session(request, pk)
+        if session.status != 'uploading':
+            return JsonResponse({'error': 'Upload is already complete'}, status=409)
+        discard_upload(session)
+        return JsonResponse({'success': True})